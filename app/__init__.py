@@ -13,4 +13,14 @@ lm = LoginManager()
 lm.init_app(app)
 lm.login_view = 'login'
 
+from app.usercache import UserCache
+user_cache = UserCache(app.config['USER_CACHE_SIZE'],
+                       app.config['USER_CACHE_TTL'])
+
+from app.hashing import PasswordHasher
+password_hasher = PasswordHasher(app.config['PASSWORD_HASH_WORKERS'],
+                                 app.config['PASSWORD_HASH_QUEUE'],
+                                 app.config['PASSWORD_HASH_ROUNDS'],
+                                 app.config['PASSWORD_HASH_TIMEOUT'])
+
 from app import views, models
@@ -0,0 +1,144 @@
+# -*- encoding: utf-8 -*-
+"""
+hashing.py
+
+Hashes and verifies passwords on a small pool of worker threads
+rather than on the request thread. Requests wait for their result but
+at most queue_size of them can be waiting at once. Beyond that they
+fail straight away with Saturated, which is answered with a 503, so a
+burst of logins can not tie up every request thread. A request that
+waits longer than the timeout fails with TimedOut, also a 503, and its
+call is dropped if no worker has started it.
+
+The number of rounds of the hash can be set. Passwords hashed with
+other rounds are rehashed when they are next verified.
+"""
+
+import threading
+import Queue
+
+from passlib.apps import custom_app_context
+from passlib.context import CryptContext
+
+class Saturated(Exception):
+    """raised when too many passwords are waiting to be hashed"""
+
+class TimedOut(Saturated):
+    """raised when a password waited too long to be hashed"""
+
+class Future(object):
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self.cancelled = False
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_error(self, error):
+        self._error = error
+        self._done.set()
+
+    def cancel(self):
+        """drops the call if a worker has not started it yet"""
+        self.cancelled = True
+
+    def result(self, timeout=None):
+        """waits for the result. The call is cancelled when it times
+        out, so nothing is left running for a request that failed."""
+        if not self._done.wait(timeout):
+            self.cancel()
+            raise TimedOut('Password hashing timed out')
+
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+def _context(rounds):
+    """the passlib context hashing with the rounds. A hash with other
+    rounds needs updating."""
+    if rounds is None:
+        return custom_app_context
+
+    schemes = custom_app_context.schemes()
+    options = {'schemes': schemes,
+               'default': custom_app_context.default_scheme()}
+    for scheme in schemes:
+        for setting in ['default_rounds', 'min_rounds', 'max_rounds']:
+            options['{}__{}'.format(scheme, setting)] = rounds
+
+    return CryptContext(**options)
+
+class PasswordHasher(object):
+    def __init__(self, workers=2, queue_size=16, rounds=None, timeout=30):
+        self.workers = workers
+        self.timeout = timeout
+        self.context = _context(rounds)
+
+        self._queue = Queue.Queue(queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'cancelled': 0}
+
+    def submit(self, fn, *args):
+        """queues a call for the workers and returns its Future"""
+        self._start()
+        future = Future()
+        try:
+            self._queue.put_nowait((future, fn, args))
+        except Queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise Saturated('Too many passwords waiting to be hashed')
+
+        with self._lock:
+            self._stats['submitted'] += 1
+
+        return future
+
+    def hash(self, password):
+        return self.submit(self.context.encrypt, password).result(self.timeout)
+
+    def verify_and_update(self, password, hash):
+        """checks a password against its hash. Returns whether it
+        matched and a new hash when the hash was made with an old
+        policy, or None."""
+        return self.submit(self.context.verify_and_update, password,
+                hash).result(self.timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats['waiting'] = self._queue.qsize()
+        stats['workers'] = len(self._threads)
+        return stats
+
+    def _start(self):
+        # NOTE(steve): the workers are started on first use rather
+        # than at import so they are not lost by a forking server.
+        if len(self._threads) == self.workers:
+            return
+
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            (future, fn, args) = self._queue.get()
+            if future.cancelled:
+                with self._lock:
+                    self._stats['cancelled'] += 1
+                continue
+
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_error(e)
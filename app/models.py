@@ -1,8 +1,9 @@
 # -*- encoding: utf-8 -*-
 from flask_login import UserMixin
-from passlib.apps import custom_app_context as pwd_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
-from app import db
+from app import db, user_cache, password_hasher
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -11,10 +12,17 @@ class User(db.Model, UserMixin):
     password_hash = db.Column(db.String(128))
 
     def hash_password(self, password):
-        self.password_hash = pwd_context.encrypt(password)
+        self.password_hash = password_hasher.hash(password)
 
     def verify_password(self, password):
-        return pwd_context.verify(password, self.password_hash)
+        """checks the password. A hash made with other rounds than
+        the ones configured is replaced, to be saved by the caller."""
+        (valid, new_hash) = password_hasher.verify_and_update(password,
+                self.password_hash)
+        if new_hash is not None:
+            self.password_hash = new_hash
+
+        return valid
 
     def get_id(self):
         try:
@@ -24,3 +32,71 @@ class User(db.Model, UserMixin):
 
     def __repr__(self):
         return '<User %r>' % (self.username)
+
+# NOTE(steve): the users cached for the login manager are dropped as
+# soon as they are changed or deleted. Bulk updates and deletes do not
+# say which users they touched so the whole cache is dropped. They are
+# listened for on every Session, as db.session is a scoped_session
+# which does not take session events.
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user(mapper, connection, user):
+    user_cache.invalidate(user.id)
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def _invalidate_users(context):
+    if context.mapper.class_ is User:
+        user_cache.clear()
+
+# NOTE(steve): the wallet data below is imported from the csv user
+# directories, see scripts/db_tools.py. Amounts are kept in cents.
+class Wallet(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    name = db.Column(db.String(64))
+    cents = db.Column(db.Integer)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'name'),)
+
+    def __repr__(self):
+        return '<Wallet %r>' % (self.name)
+
+class Account(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    name = db.Column(db.String(64))
+    cents = db.Column(db.Integer)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'name'),)
+
+    def __repr__(self):
+        return '<Account %r>' % (self.name)
+
+class FundingTemplate(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    name = db.Column(db.String(64))
+    cents = db.Column(db.Integer)
+    frequency = db.Column(db.String(32))
+    account = db.Column(db.String(64))
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'name'),)
+
+    def __repr__(self):
+        return '<FundingTemplate %r>' % (self.name)
+
+class Allocation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    template = db.Column(db.String(64))
+    wallet = db.Column(db.String(64))
+    cents = db.Column(db.Integer)
+
+    def __repr__(self):
+        return '<Allocation %r %r>' % (self.template, self.wallet)
+
+class CsvImport(db.Model):
+    """the users whose csv directories have been imported"""
+    username = db.Column(db.String(32), primary_key=True)
+    imported = db.Column(db.DateTime)
@@ -0,0 +1,105 @@
+# -*- encoding: utf-8 -*-
+"""
+usercache.py
+
+An in-process cache of the users loaded by Flask-Login, so that an
+authenticated request does not have to query the database for its
+user. Entries are dropped when they are older than the time to live
+or when the cache is full, least recently used first, and when the
+user is changed or deleted, see models.py.
+
+NOTE(steve): the cache is per process. A change made by another
+process is only seen once the entry has expired.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+class CachedUser(UserMixin):
+    """the identity of a logged in user. It is a plain copy of the
+    User so it can outlive the session it was loaded in."""
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email)
+
+    def get_id(self):
+        try:
+            return unicode(self.id)     # python 2
+        except NameError:
+            return str(self.id)         # python 3
+
+    def __repr__(self):
+        return '<CachedUser %r>' % (self.username)
+
+class UserCache(object):
+    def __init__(self, maxsize=1024, ttl=300, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+
+        # id -> (expires, user) from least to most recently used
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def get(self, id):
+        """the cached user or None when it is not cached or expired"""
+        with self._lock:
+            item = self._items.pop(id, None)
+            if item is None:
+                self._stats['misses'] += 1
+                return None
+
+            if item[0] <= self.clock():
+                self._stats['misses'] += 1
+                self._stats['expired'] += 1
+                return None
+
+            self._items[id] = item
+            self._stats['hits'] += 1
+            return item[1]
+
+    def put(self, id, user):
+        with self._lock:
+            self._items.pop(id, None)
+            self._items[id] = (self.clock() + self.ttl, user)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, id):
+        with self._lock:
+            if self._items.pop(id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats['invalidations'] += len(self._items)
+            self._items.clear()
+
+    def stats(self):
+        """the counts of hits, misses, expired entries, evictions and
+        invalidations together with the hit rate and size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._items)
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        return stats
+
+    def reset_stats(self):
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0,
+                'invalidations': 0}
+
+    def __len__(self):
+        return len(self._items)
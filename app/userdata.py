@@ -0,0 +1,28 @@
+# -*- encoding: utf-8 -*-
+"""
+The wallets modules in tmp/ that hold each user's wallets data.
+tmp/app.py is loaded as wallets_app since its name clashes with
+this package.
+"""
+
+import os
+import sys
+import imp
+
+TMP_PATH = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tmp')
+
+if TMP_PATH not in sys.path:
+    sys.path.insert(0, TMP_PATH)
+
+wallets_app = sys.modules.get('wallets_app')
+if wallets_app is None:
+    wallets_app = imp.load_source('wallets_app',
+            os.path.join(TMP_PATH, 'app.py'))
+
+import export
+import layout
+import storage
+import wallet
+
+App = wallets_app.App
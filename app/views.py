@@ -1,12 +1,16 @@
 # -*- encoding: utf-8 -*-
 
-from flask import render_template, flash, redirect
-from flask import url_for, request, g
+import os
+
+from flask import render_template, flash, redirect, abort
+from flask import url_for, request, g, Response, stream_with_context
 from flask_login import login_user, logout_user, current_user, login_required
 
-from app import app, db, lm
+from app import app, db, lm, userdata, user_cache
+from .hashing import Saturated
 from .forms import LoginForm, RegistrationForm
 from .models import User
+from .usercache import CachedUser
 
 @app.route('/', methods=['GET'])
 @app.route('/index', methods=['GET'])
@@ -33,6 +37,10 @@ def login():
             flash('Incorrect Password.')
             return redirect(url_for('login'))
 
+        # the password may have been rehashed with the current rounds
+        if user in db.session.dirty:
+            db.session.commit()
+
         login_user(user, remember = form.remember_me.data)
 
         flash('Logged in successfully for {}.'.format(username))
@@ -71,10 +79,64 @@ def logout():
     logout_user()
     return redirect(url_for('index'))
 
+EXPORT_MIMETYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+@app.route('/export', methods=['GET'])
+@login_required
+def export():
+    format = request.args.get('format', 'jsonl')
+    if format not in userdata.export.FORMATS:
+        abort(400)
+
+    conn = app.config['WALLETS_DATA_PATH']
+    username = g.user.username
+    if not os.path.isdir(userdata.layout.user_path(conn, username)):
+        abort(404)
+
+    # NOTE(steve): the records are generated as the response is
+    # sent so the export is never held in memory.
+    records = userdata.export.records(conn, [username])
+    body = userdata.export.lines(records, format)
+    filename = 'wallets.{}'.format(format)
+    mimetype = EXPORT_MIMETYPES[format]
+    if request.args.get('gzip'):
+        body = userdata.export.compress(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    headers = {
+        'Content-Disposition': 'attachment; filename={}'.format(filename)
+    }
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers=headers)
+
+@app.errorhandler(Saturated)
+def hashing_saturated(error):
+    return Response('Too many logins at once, please try again shortly.',
+                    status=503, headers={'Retry-After': '1'})
+
 @lm.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    id = int(id)
+    user = user_cache.get(id)
+    if user is None:
+        user = User.query.get(id)
+        if user is None:
+            return None
+
+        user = CachedUser.from_user(user)
+        user_cache.put(id, user)
+
+    return user
 
 @app.before_request
 def before_request():
+    # NOTE(steve): static files do not need the user so the session
+    # is not looked at for them.
+    if request.endpoint == 'static':
+        return
+
     g.user = current_user
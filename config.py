@@ -9,3 +9,19 @@ SQLALCHEMY_TRACK_MODIFICATIONS = True
 
 WTF_CSRF_ENABLED = True
 SECRET_KEY = os.environ.get('WALLETS_SECRET_KEY')
+
+# directory holding a directory of wallets data for each user
+WALLETS_DATA_PATH = os.path.join(basedir, 'data')
+
+# users kept in memory by the login manager and the seconds each is kept
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 300
+
+# threads hashing passwords, the logins and registrations allowed to
+# wait for them before answering 503, the rounds of the hash, or None
+# for the passlib default, and the seconds a login waits for its hash
+# before answering 503
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_QUEUE = 16
+PASSWORD_HASH_ROUNDS = None
+PASSWORD_HASH_TIMEOUT = 30
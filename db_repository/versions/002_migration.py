@@ -0,0 +1,72 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+wallet = Table('wallet', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('user_id', Integer, ForeignKey('user.id'), index=True),
+    Column('name', String(length=64)),
+    Column('cents', Integer),
+    UniqueConstraint('user_id', 'name'),
+)
+
+account = Table('account', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('user_id', Integer, ForeignKey('user.id'), index=True),
+    Column('name', String(length=64)),
+    Column('cents', Integer),
+    UniqueConstraint('user_id', 'name'),
+)
+
+funding_template = Table('funding_template', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('user_id', Integer, ForeignKey('user.id'), index=True),
+    Column('name', String(length=64)),
+    Column('cents', Integer),
+    Column('frequency', String(length=32)),
+    Column('account', String(length=64)),
+    UniqueConstraint('user_id', 'name'),
+)
+
+allocation = Table('allocation', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('user_id', Integer, ForeignKey('user.id'), index=True),
+    Column('template', String(length=64)),
+    Column('wallet', String(length=64)),
+    Column('cents', Integer),
+)
+
+csv_import = Table('csv_import', post_meta,
+    Column('username', String(length=32), primary_key=True, nullable=False),
+    Column('imported', DateTime),
+)
+
+user = Table('user', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['wallet'].create()
+    post_meta.tables['account'].create()
+    post_meta.tables['funding_template'].create()
+    post_meta.tables['allocation'].create()
+    post_meta.tables['csv_import'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['wallet'].drop()
+    post_meta.tables['account'].drop()
+    post_meta.tables['funding_template'].drop()
+    post_meta.tables['allocation'].drop()
+    post_meta.tables['csv_import'].drop()
@@ -2,6 +2,8 @@
 # -*- encoding: utf-8 -*-
 
 import sys
+import time
+import datetime
 import os.path
 
 sys.path.insert(0, os.path.abspath('.'))
@@ -11,7 +13,7 @@ from migrate.versioning import api
 from config import SQLALCHEMY_DATABASE_URI
 from config import SQLALCHEMY_MIGRATE_REPO
 
-from app import db, models
+from app import db, models, userdata
 
 def create():
     from app import db
@@ -62,11 +64,171 @@ def downgrade():
     print('Current database version: {}'.format(str(v)))
 
 def clean():
+    for model in [models.Wallet, models.Account, models.FundingTemplate,
+            models.Allocation, models.CsvImport]:
+        model.query.delete()
+
     for u in models.User.query.all():
         db.session.delete(u)
 
     db.session.commit()
 
+# users written in each transaction of an import
+IMPORT_CHUNK = 100
+
+_engine = None
+
+def _init_import():
+    """gives each import process its own connection to the db"""
+    global _engine
+    from sqlalchemy import create_engine
+
+    options = {}
+    if SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        # writers from other processes wait for the db to be free
+        options['connect_args'] = {'timeout': 30}
+
+    _engine = create_engine(SQLALCHEMY_DATABASE_URI, **options)
+
+def _read_user(conn, user):
+    """the rows for each table from a user's csv directory. The
+    directory is only read, a long journal is not compacted."""
+    w = userdata.App(user, conn=conn, autocompact=False)
+    w.preload()
+
+    rows = {
+            'wallet': [],
+            'account': [],
+            'funding_template': [],
+            'allocation': []
+            }
+    for (name, wallet) in w.wallets.items():
+        rows['wallet'].append({'name': name, 'cents': wallet.cents()})
+
+    for (name, account) in w.accounts.items():
+        rows['account'].append({'name': name, 'cents': account.cents()})
+
+    for (name, template) in w.funding_templates.items():
+        rows['funding_template'].append({
+            'name': name,
+            'cents': userdata.wallet.to_cents(template.amount()),
+            'frequency': template.frequency(),
+            'account': template.account()
+            })
+        for (wallet, amount) in template.allocation().iteritems():
+            rows['allocation'].append({
+                'template': name,
+                'wallet': wallet,
+                'cents': userdata.wallet.to_cents(amount)
+                })
+
+    return rows
+
+def _user_id(c, username):
+    """the id of a registered user. The data of a directory without
+    a user is not imported, as no one could log in to see it."""
+    users = models.User.__table__
+    row = c.execute(users.select().where(users.c.username == username)).first()
+    if row is None:
+        raise Exception('User {} is not registered'.format(username))
+
+    return row['id']
+
+def _import_users(conn, users):
+    """writes the users with a bulk insert into each table in a single
+    transaction. Users that were imported before are replaced."""
+    data = [(user, _read_user(conn, user)) for user in users]
+
+    tables = [models.Wallet.__table__, models.Account.__table__,
+            models.FundingTemplate.__table__, models.Allocation.__table__]
+    inserts = dict((t.name, []) for t in tables)
+    n = 0
+    with _engine.begin() as c:
+        ids = []
+        for (user, rows) in data:
+            user_id = _user_id(c, user)
+            ids.append(user_id)
+            for (table, records) in rows.iteritems():
+                for r in records:
+                    r['user_id'] = user_id
+                inserts[table].extend(records)
+                n += len(records)
+
+        for t in tables:
+            c.execute(t.delete().where(t.c.user_id.in_(ids)))
+            if inserts[t.name]:
+                c.execute(t.insert(), inserts[t.name])
+
+        now = datetime.datetime.utcnow()
+        c.execute(models.CsvImport.__table__.insert(),
+                [{'username': user, 'imported': now} for user in users])
+
+    return n
+
+def _import_chunk(args):
+    """imports a chunk of users. When the chunk fails each user is
+    tried on their own so one bad directory only fails itself."""
+    conn, users = args
+    try:
+        return (len(users), _import_users(conn, users), [])
+    except Exception as e:
+        if len(users) == 1:
+            return (0, 0, [(users[0], str(e))])
+
+    imported, n, failed = 0, 0, []
+    for user in users:
+        (i, rows, f) = _import_chunk((conn, [user]))
+        imported += i
+        n += rows
+        failed.extend(f)
+
+    return (imported, n, failed)
+
+def import_csv(conn, processes=None, chunk=IMPORT_CHUNK):
+    """imports the wallet data of every user directory in conn. Users
+    that have already been imported are skipped so an interrupted
+    import carries on where it stopped. Directories of users that are
+    not registered fail."""
+    import multiprocessing
+
+    done = set(u for (u,) in db.session.query(models.CsvImport.username))
+    db.session.remove()
+
+    users = [u for u in userdata.layout.iter_users(conn) if u not in done]
+    chunks = [(conn, users[i:i + chunk]) for i in range(0, len(users), chunk)]
+
+    print('Importing {} users, {} already imported'.format(len(users),
+        len(done)))
+
+    pool = None
+    if processes == 1:
+        _init_import()
+        results = (_import_chunk(c) for c in chunks)
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_import)
+        results = pool.imap_unordered(_import_chunk, chunks)
+
+    start = time.time()
+    imported, rows, failed = 0, 0, []
+    try:
+        for (i, n, f) in results:
+            imported += i
+            rows += n
+            for (user, error) in f:
+                print('Failed to import {}: {}'.format(user, error))
+            failed.extend(f)
+
+            seconds = time.time() - start
+            print('Imported {}/{} users, {} rows ({:.0f} users/s)'.format(
+                imported, len(users), rows,
+                imported / seconds if seconds else 0.0))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return {'imported': imported, 'rows': rows, 'failed': failed}
+
 if __name__ == '__main__':
     import argparse
 
@@ -86,6 +248,12 @@ if __name__ == '__main__':
                          help="Downgrade db to older version")
     options.add_argument('--clean', action="store_true",
                          help="Delete all data in db")
+    options.add_argument('--import-csv', metavar='CONN',
+                         help="Import the csv user directories in CONN")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Number of users imported in parallel")
+    parser.add_argument('--chunk', type=int, default=IMPORT_CHUNK,
+                        help="Number of users written per transaction")
 
     args = parser.parse_args()
 
@@ -99,5 +267,7 @@ if __name__ == '__main__':
         downgrade()
     elif args.clean:
         clean()
+    elif args.import_csv:
+        import_csv(args.import_csv, args.processes, args.chunk)
     else:
         print("$ python db_tools.py --help")
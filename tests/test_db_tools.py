@@ -0,0 +1,102 @@
+#!env/bin/python
+# -*- encoding: utf-8 -*-
+
+import sys
+import os.path
+
+sys.path.insert(0, os.path.abspath('.'))
+sys.path.insert(0, os.path.abspath('..'))
+sys.path.insert(0, os.path.abspath('scripts'))
+sys.path.insert(0, os.path.abspath('../scripts'))
+
+import shutil
+import multiprocessing
+import tempfile
+import unittest
+from app import db, models, userdata
+
+import db_tools
+
+class BrokenPool(object):
+    """a pool whose workers die before returning anything"""
+    pools = []
+
+    def __init__(self, processes, initializer=None):
+        self.closed = self.joined = False
+        self.pools.append(self)
+
+    def imap_unordered(self, func, chunks):
+        raise IOError('worker died')
+        yield
+
+    def close(self):
+        self.closed = True
+
+    def join(self):
+        self.joined = True
+
+class ImportCsvTestCase(unittest.TestCase):
+
+    def setUp(self):
+        db.create_all()
+
+        self.conn = tempfile.mkdtemp()
+        source = os.path.join(userdata.TMP_PATH, 'test', 'steve')
+        for user in ['kate', 'ghost']:
+            shutil.copytree(source, os.path.join(self.conn, user))
+
+        u = models.User(username='kate', email='kate@email.com')
+        db.session.add(u)
+        db.session.commit()
+        self.id = u.id
+
+    def tearDown(self):
+        for model in [models.Wallet, models.Account, models.FundingTemplate,
+                models.Allocation]:
+            model.query.filter_by(user_id=self.id).delete()
+        models.CsvImport.query.filter(models.CsvImport.username.in_(
+            ['kate', 'ghost'])).delete(synchronize_session=False)
+        models.User.query.filter_by(username='kate').delete()
+        db.session.commit()
+
+        shutil.rmtree(self.conn)
+
+    def rows(self):
+        return dict((model.__name__, model.query.filter_by(
+            user_id=self.id).count()) for model in [models.Wallet,
+                models.Account, models.FundingTemplate, models.Allocation])
+
+    def test_import_twice(self):
+        result = db_tools.import_csv(self.conn, processes=1)
+        assert result['imported'] == 1
+        assert result['rows'] == 8
+        assert result['failed'] == [('ghost', 'User ghost is not registered')]
+
+        rows = self.rows()
+        assert rows == {'Wallet': 3, 'Account': 2, 'FundingTemplate': 1,
+                'Allocation': 2}
+        w = models.Wallet.query.filter_by(user_id=self.id,
+                name='shares').one()
+        assert w.cents == 235000
+
+        # kate was imported and is skipped, ghost is tried again
+        result = db_tools.import_csv(self.conn, processes=1)
+        assert result['imported'] == 0
+        assert [user for (user, error) in result['failed']] == ['ghost']
+        assert self.rows() == rows
+        assert models.User.query.filter_by(username='ghost').count() == 0
+
+    def test_pool_is_joined_when_results_fail(self):
+        pool = multiprocessing.Pool
+        multiprocessing.Pool = BrokenPool
+        try:
+            with self.assertRaises(IOError):
+                db_tools.import_csv(self.conn, processes=2)
+        finally:
+            multiprocessing.Pool = pool
+
+        assert BrokenPool.pools[-1].closed
+        assert BrokenPool.pools[-1].joined
+
+if __name__ == '__main__':
+    unittest.main()
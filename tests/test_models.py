@@ -8,7 +8,9 @@ sys.path.insert(0, os.path.abspath('.'))
 sys.path.insert(0, os.path.abspath('..'))
 
 import unittest
-from app import db, models
+import threading
+from app import app, db, models, user_cache, usercache, hashing
+from app.views import load_user
 
 class UserTestCase(unittest.TestCase):
 
@@ -40,6 +42,188 @@ class UserTestCase(unittest.TestCase):
     def test_verify_password_unsuccessful(self):
         assert not self.user.verify_password('incorrect_password')
 
+class WalletTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        u = models.User(username='mary', email='mary@email.com')
+        db.session.add(u)
+        db.session.commit()
+
+        w = models.Wallet(user_id=u.id, name='savings', cents=35000)
+        t = models.FundingTemplate(user_id=u.id, name='salary', cents=35000,
+                frequency='Monthly', account='bank account')
+        a = models.Allocation(user_id=u.id, template='salary',
+                wallet='savings', cents=35000)
+        db.session.add_all([w, t, a])
+        db.session.commit()
+
+        self.user = u
+
+    @classmethod
+    def tearDownClass(self):
+        for model in [models.Wallet, models.FundingTemplate,
+                models.Allocation]:
+            model.query.delete()
+
+        db.session.delete(self.user)
+        db.session.commit()
+
+    def test_wallet_belongs_to_user(self):
+        w = models.Wallet.query.filter_by(user_id=self.user.id).one()
+        assert w.name == 'savings'
+        assert w.cents == 35000
+
+    def test_allocation_of_template(self):
+        a = models.Allocation.query.filter_by(user_id=self.user.id,
+                template='salary').one()
+        assert a.wallet == 'savings'
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class UserCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = usercache.UserCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_hits_and_misses(self):
+        assert self.cache.get(1) is None
+        self.cache.put(1, 'steve')
+        assert self.cache.get(1) == 'steve'
+
+        stats = self.cache.stats()
+        assert (stats['hits'], stats['misses']) == (1, 1)
+        assert stats['hit_rate'] == 0.5
+
+    def test_entries_expire(self):
+        self.cache.put(1, 'steve')
+        self.clock.now = 10.0
+        assert self.cache.get(1) is None
+        assert self.cache.stats()['expired'] == 1
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put(1, 'steve')
+        self.cache.put(2, 'mary')
+        self.cache.get(1)
+        self.cache.put(3, 'john')
+
+        assert self.cache.get(2) is None
+        assert self.cache.get(1) == 'steve'
+        assert self.cache.stats()['evictions'] == 1
+
+class UserLoaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        u = models.User(username='john', email='john@email.com')
+        db.session.add(u)
+        db.session.commit()
+
+        self.id = u.id
+        user_cache.clear()
+        user_cache.reset_stats()
+
+    def tearDown(self):
+        models.User.query.filter_by(username='john').delete()
+        db.session.commit()
+
+    def test_loaded_user_is_cached(self):
+        assert load_user(unicode(self.id)).username == 'john'
+        assert load_user(unicode(self.id)).username == 'john'
+        assert user_cache.stats()['hits'] == 1
+
+    def test_changed_user_is_invalidated(self):
+        load_user(unicode(self.id))
+        u = models.User.query.get(self.id)
+        u.email = 'john@example.com'
+        db.session.commit()
+
+        assert load_user(unicode(self.id)).email == 'john@example.com'
+        assert user_cache.stats()['hits'] == 0
+
+    def test_deleted_user_is_invalidated(self):
+        load_user(unicode(self.id))
+        db.session.delete(models.User.query.get(self.id))
+        db.session.commit()
+
+        assert load_user(unicode(self.id)) is None
+
+    def test_bulk_update_clears_cache(self):
+        load_user(unicode(self.id))
+        models.User.query.filter_by(id=self.id).update({'email': 'x@y.z'})
+        db.session.commit()
+
+        assert len(user_cache) == 0
+
+class PasswordHasherTestCase(unittest.TestCase):
+
+    def test_saturated_hasher_rejects(self):
+        hasher = hashing.PasswordHasher(workers=1, queue_size=1)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        busy = hasher.submit(block)
+        started.wait()
+        waiting = hasher.submit(block)
+
+        with self.assertRaises(hashing.Saturated):
+            hasher.submit(block)
+
+        release.set()
+        busy.result(5)
+        waiting.result(5)
+        assert hasher.stats()['rejected'] == 1
+
+    def test_timed_out_call_is_dropped(self):
+        hasher = hashing.PasswordHasher(workers=1, queue_size=2, timeout=0.01)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def block():
+            started.set()
+            release.wait()
+
+        busy = hasher.submit(block)
+        started.wait()
+
+        with self.assertRaises(hashing.TimedOut):
+            hasher.submit(calls.append, 'late').result(hasher.timeout)
+
+        release.set()
+        busy.result(5)
+        hasher.submit(calls.append, 'next').result(5)
+        assert calls == ['next']
+        assert hasher.stats()['cancelled'] == 1
+
+    def test_timeout_is_answered_with_503(self):
+        @app.route('/_timed_out')
+        def timed_out():
+            raise hashing.TimedOut('Password hashing timed out')
+
+        r = app.test_client().get('/_timed_out')
+        assert r.status_code == 503
+        assert r.headers['Retry-After'] == '1'
+
+    def test_password_is_rehashed_with_new_rounds(self):
+        old = hashing.PasswordHasher(rounds=5000)
+        new = hashing.PasswordHasher(rounds=6000)
+        h = old.hash('super-secret-password')
+
+        (valid, new_hash) = new.verify_and_update('super-secret-password', h)
+        assert valid and new_hash is not None
+        assert new.verify_and_update('super-secret-password',
+                new_hash) == (True, None)
+        assert new.verify_and_update('incorrect_password',
+                h) == (False, None)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,114 @@
+#!env/bin/python
+# -*- encoding: utf-8 -*-
+
+import sys
+import os.path
+
+sys.path.insert(0, os.path.abspath('.'))
+sys.path.insert(0, os.path.abspath('..'))
+
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from app import app, db, models, userdata
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(userdata.TMP_PATH, 'test', 'steve'),
+                os.path.join(self.conn, 'jane'))
+
+        self.config = dict(app.config)
+        app.config['WALLETS_DATA_PATH'] = self.conn
+        app.config['SECRET_KEY'] = 'test'
+        app.config['TESTING'] = True
+
+        u = models.User(username='jane', email='jane@email.com')
+        db.session.add(u)
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = unicode(u.id)
+            session['_fresh'] = True
+
+    def tearDown(self):
+        models.User.query.filter_by(username='jane').delete()
+        db.session.commit()
+
+        app.config.clear()
+        app.config.update(self.config)
+        shutil.rmtree(self.conn)
+
+    def test_export_jsonl(self):
+        r = self.client.get('/export')
+        assert r.status_code == 200
+        assert r.mimetype == 'application/x-ndjson'
+        assert 'wallets.jsonl' in r.headers['Content-Disposition']
+
+        records = [json.loads(l) for l in r.data.splitlines()]
+        assert len(records) == 7
+        assert set(rec['user'] for rec in records) == set(['jane'])
+
+    def test_export_csv_gzip(self):
+        r = self.client.get('/export?format=csv&gzip=1')
+        assert r.status_code == 200
+        assert r.mimetype == 'application/gzip'
+
+        lines = gzip.GzipFile(fileobj=StringIO(r.data)).read().splitlines()
+        assert lines[0].startswith('user,type,name')
+        assert len(lines) == 8
+
+    def test_export_does_not_compact(self):
+        w = userdata.App('jane', conn=self.conn, journaled=True,
+                autocompact=False)
+        with w.batch():
+            for i in range(w.journal.max_records):
+                w.add_expense('mobile', 'cash', 0.01)
+        size = w.journal.size()
+
+        records = [json.loads(l) for l in
+                self.client.get('/export').data.splitlines()]
+        assert records[0]['amount'] == 90.0
+        assert w.journal.size() == size
+
+    def test_export_unicode_user_name(self):
+        u = models.User(username=u'zo\xeb', email='zoe@email.com')
+        db.session.add(u)
+        db.session.commit()
+        userdata.App.create_user(u'zo\xeb', conn=self.conn)
+        userdata.App(u'zo\xeb', conn=self.conn).create_wallet('mobile', 5.0)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = unicode(u.id)
+            session['_fresh'] = True
+
+        try:
+            r = client.get('/export?format=csv')
+            assert r.status_code == 200
+            assert r.data.splitlines()[1].startswith(
+                    'zo\xc3\xab,wallet,mobile,5.0')
+        finally:
+            models.User.query.filter_by(username=u'zo\xeb').delete()
+            db.session.commit()
+
+    def test_invalid_format(self):
+        assert self.client.get('/export?format=xml').status_code == 400
+
+    def test_user_without_data(self):
+        shutil.rmtree(os.path.join(self.conn, 'jane'))
+        assert self.client.get('/export').status_code == 404
+
+    def test_login_required(self):
+        with self.client.session_transaction() as session:
+            session.clear()
+
+        assert self.client.get('/export').status_code == 302
+
+if __name__ == '__main__':
+    unittest.main()
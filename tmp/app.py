@@ -3,24 +3,147 @@ app.py
 """
 
 import os
+import time
 import shutil
+from contextlib import contextmanager
 
-from wallets import Wallets, Accounts, FundingTemplates
-from wallet import FundingTemplate, Wallet
+from wallet import FundingTemplate, Wallet, to_cents
+from journal import Journal
+from history import History
+from rollups import Rollups
+from storage import COLLECTIONS, connect, detect
+from layout import user_path, create_path, flat_path
+import locks
 
 class App(object):
-    def __init__(self, user, conn=None):
+    def __init__(self, user, conn=None, journaled=False, columnar=False,
+            storage=None, history=False, clock=time.time, autocompact=True):
         self.conn = user
         if conn:
-            self.conn = os.path.join(conn, user)
+            self.conn = user_path(conn, user)
 
         if not os.path.isdir(self.conn):
             msg = 'User {} does not exist'.format(user)
             raise Exception(msg)
 
-        self.wallets = Wallets(self.conn)
-        self.accounts = Accounts(self.conn)
-        self.funding_templates = FundingTemplates(self.conn)
+        # NOTE(steve): in journaled mode the csv files are only
+        # a snapshot. Every change is appended to the journal
+        # and replayed on top of the snapshot when loading.
+        self.journal = None
+        self._replaying = False
+
+        # NOTE(steve): a journal that has grown too long is compacted
+        # when it is loaded or written. Readers such as exports turn
+        # this off so that reading a user never rewrites their files.
+        self.autocompact = autocompact
+        self._batch = None
+
+        # counts the changes made through this instance, and the
+        # version last persisted, see unchanged()
+        self.version = 0
+        self.saved_version = 0
+
+        # the engine the collections are stored in, see storage.py
+        if storage is None:
+            storage = detect(self.conn)
+
+        # NOTE(steve): being journaled belongs to the user rather than
+        # the app. A user with records in their journal is always
+        # opened journaled, otherwise the journal would be left out
+        # of what is loaded and replayed again on top of what is saved.
+        if storage == 'csv' and Journal(self.conn).size():
+            journaled = True
+
+        if journaled:
+            if storage != 'csv':
+                raise Exception('Only csv storage can be journaled')
+            self.journal = Journal(self.conn)
+
+        self.storage = connect(self.conn, storage, columnar)
+        self.storage.recover()
+
+        # collections are loaded on first access, see preload()
+        self._collections = {}
+
+        # NOTE(steve): with history every change to a balance is
+        # also posted to the user's transaction history. It starts
+        # from the balances at the time it is first used. The
+        # monthly and weekly totals in rollups are kept up to date
+        # with it.
+        self.history = None
+        self.rollups = None
+        self._postings = []
+        if history:
+            self.history = History(self.conn, clock)
+            self.rollups = Rollups(self.conn)
+            if not self.history.started():
+                self.history.start(self._balances())
+
+    @property
+    def wallets(self):
+        return self._collection('wallets')
+
+    @property
+    def accounts(self):
+        return self._collection('accounts')
+
+    @property
+    def funding_templates(self):
+        return self._collection('funding_templates')
+
+    def preload(self, *names):
+        """loads the named collections, or all of them when no names
+        are given, rather than waiting for their first access. A
+        journaled app always loads every collection as the journal
+        is replayed across all of them."""
+        if not names or self.journal is not None:
+            names = COLLECTIONS
+
+        autosave = self.journal is None and self._batch is None
+        loaded = False
+
+        # NOTE(steve): the files are read under one shared lock so
+        # that the collections and journal are from the same save.
+        with locks.read(self.conn):
+            for name in COLLECTIONS:
+                if name in names and name not in self._collections:
+                    self._collections[name] = self.storage.open(name, autosave)
+                    loaded = True
+
+            if loaded and self.journal is not None:
+                self._replay()
+
+        if loaded and self.journal is not None and self.autocompact:
+            if self.journal.needs_compaction():
+                self.compact()
+
+    def unchanged(self):
+        """whether what this app holds is still what is stored, i.e.
+        it has persisted all its changes and nothing has been saved
+        since other than by this app"""
+        if self.version != self.saved_version:
+            return False
+
+        if not os.path.isdir(self.conn):
+            return False
+
+        if self.journal is None:
+            if self.storage.name == 'csv' and Journal(self.conn).size():
+                return False
+        elif not self.journal.unchanged():
+            return False
+
+        return all(c.unchanged() for c in self._loaded())
+
+    def _collection(self, name):
+        if name not in self._collections:
+            self.preload(name)
+
+        return self._collections[name]
+
+    def _loaded(self):
+        return [self._collections[name] for name in COLLECTIONS
+                if name in self._collections]
 
     #TODO(steve): make this more pythonic
     # by removing them from the class
@@ -28,7 +151,9 @@ class App(object):
     def create_user(user, conn=None):
         data = user
         if conn:
-            data = os.path.join(conn, user)
+            if os.path.isdir(user_path(conn, user)):
+                raise Exception('User already exists: {}'.format(user))
+            data = create_path(conn, user)
 
         if os.path.isdir(data):
             raise Exception('User already exists: {}'.format(user))
@@ -43,7 +168,7 @@ class App(object):
     def remove_user(user, conn=None):
         data = user
         if conn:
-            data = os.path.join(conn, user)
+            data = user_path(conn, user)
 
         if not os.path.isdir(data):
             msg = 'User does not exist: {}'.format(user)
@@ -51,6 +176,10 @@ class App(object):
 
         shutil.rmtree(data)
 
+        # the link left in the flat layout by layout.migrate()
+        if conn and os.path.islink(flat_path(conn, user)):
+            os.remove(flat_path(conn, user))
+
     # TODO(steve): should we check that wallet is of
     # type string?? Could have unwanted behaviour
     # if not.
@@ -61,6 +190,9 @@ class App(object):
             raise e
 
         self.wallets.create_item(wallet, Wallet(valid_balance))
+        self._log('create', 'wallet', wallet, valid_balance)
+        self._save()
+        self._post('create', ('wallet', wallet, valid_balance))
 
     def create_account(self, account, opening_balance):
         try:
@@ -69,6 +201,9 @@ class App(object):
             raise e
 
         self.accounts.create_item(account, Wallet(valid_balance))
+        self._log('create', 'account', account, valid_balance)
+        self._save()
+        self._post('create', ('account', account, valid_balance))
 
     def create_funding_template(self, template, amount, account,
             frequency, allocation):
@@ -80,6 +215,10 @@ class App(object):
         funding_template = self._create_funding_template(template, amount,
                 account, frequency, allocation)
         self.funding_templates.create_item(template, funding_template)
+        self._log('create', 'funding', template, funding_template.amount(),
+                account, frequency,
+                *self._flatten(funding_template.allocation()))
+        self._save()
 
     def _create_funding_template(self, template, amount, account,
             frequency, allocation):
@@ -120,9 +259,12 @@ class App(object):
         self.wallets[transfer].add(bal)
         del self.wallets[wallet]
 
-        for f in self.funding_templates:
-            self.funding_templates[f].remove_wallet_from_allocation(wallet,
-                    transfer=transfer)
+        self.funding_templates.replace_wallet(wallet, transfer)
+
+        self._log('remove', 'wallet', wallet, transfer)
+        self._save(self.wallets, self.funding_templates)
+        self._post('remove', ('wallet', transfer, bal),
+                ('wallet', wallet, -bal))
 
     def remove_account(self, account, transfer):
         if account not in self.accounts:
@@ -137,9 +279,12 @@ class App(object):
         self.accounts[transfer].add(bal)
         del self.accounts[account]
 
-        for f in self.funding_templates:
-            if self.funding_templates[f].account() == account:
-                self.funding_templates[f].update_account(transfer)
+        self.funding_templates.replace_account(account, transfer)
+
+        self._log('remove', 'account', account, transfer)
+        self._save(self.accounts, self.funding_templates)
+        self._post('remove', ('account', transfer, bal),
+                ('account', account, -bal))
 
     def remove_funding_template(self, template):
         if template not in self.funding_templates:
@@ -147,6 +292,8 @@ class App(object):
             raise Exception(msg)
 
         del self.funding_templates[template]
+        self._log('remove', 'funding', template)
+        self._save(self.funding_templates)
 
     def update_funding_template(self, template, amount, account,
             frequency, allocation):
@@ -162,6 +309,10 @@ class App(object):
             raise e
 
         self.funding_templates[template] = funding_template
+        self._log('update', 'funding', template, funding_template.amount(),
+                account, frequency,
+                *self._flatten(funding_template.allocation()))
+        self._save(self.funding_templates)
 
     def add_expense(self, wallet, account, amount):
         if wallet not in self.wallets:
@@ -179,6 +330,10 @@ class App(object):
 
         self.wallets[wallet].add(-valid_amount)
         self.accounts[account].add(-valid_amount)
+        self._log('expense', wallet, account, valid_amount)
+        self._save(self.wallets, self.accounts)
+        self._post('expense', ('wallet', wallet, -valid_amount),
+                ('account', account, -valid_amount))
 
     def transfer_funds(self, amount, from_acct, to_acct, transfer_type):
         try:
@@ -210,16 +365,233 @@ class App(object):
 
         collection[from_acct].add(-valid_amount)
         collection[to_acct].add(valid_amount)
-
-    def fund_wallets(self, template):
+        self._log('transfer', transfer_type, from_acct, to_acct, valid_amount)
+        self._save(collection)
+        self._post('transfer', (transfer_type, from_acct, -valid_amount),
+                (transfer_type, to_acct, valid_amount))
+
+    def fund_wallets(self, template, times=1):
+        """runs a funding template, or runs it a number of times at
+        once e.g. to catch up on missed fundings"""
         if template not in self.funding_templates:
             msg = 'Funding does not contain template {}.'.format(template)
             raise Exception(msg)
 
+        if not isinstance(times, (int, long)) or times < 1:
+            msg = 'Invalid number of times: {}'.format(times)
+            raise Exception(msg)
+
         funding = self.funding_templates[template]
-        self.accounts[funding.account()].add(funding.amount())
-        for (k, v) in funding.allocation().iteritems():
-            self.wallets[k].add(v)
+        amount = to_cents(funding.amount()) * times / 100.0
+        allocation = dict((k, to_cents(v) * times / 100.0)
+                for (k, v) in funding.allocation().iteritems())
+        self._fund(funding.account(), amount, allocation)
+
+        # NOTE(steve): the funding is logged with the amounts
+        # that were applied so that replaying it is not affected
+        # by later changes to the template.
+        self._log('fund', template, funding.account(), amount,
+                *self._flatten(allocation))
+        self._save(self.accounts, self.wallets)
+        self._post('fund', ('account', funding.account(), amount),
+                *[('wallet', k, v) for (k, v) in allocation.iteritems()])
+
+    def _fund(self, account, amount, allocation):
+        self.accounts[account].add(amount)
+        self.wallets.add_many(allocation)
+
+    def compact(self):
+        """folds the journal into a fresh csv snapshot"""
+        if self.journal is None:
+            raise Exception('Only a journaled app can be compacted')
+
+        self.preload()
+        self.journal.checkpoint(self._loaded())
+
+    @contextmanager
+    def batch(self, *extra):
+        """applies the operations in the block in memory and persists
+        them with a single write when the block exits. Nothing is
+        kept if any of the operations fail.
+
+        Extra objects saved like a collection, e.g. a user's schedule,
+        are committed in the same step as the collections."""
+        if self._batch is not None:
+            if extra:
+                raise Exception('Only the outermost batch can save extra')
+            yield self
+            return
+
+        # NOTE(steve): collections that are first loaded during
+        # the batch are rolled back by dropping them so that they
+        # are loaded again from storage.
+        state = dict((name, c.snapshot())
+                for (name, c) in self._collections.iteritems())
+        version = self.version
+        self._batch = []
+        for c in self._loaded():
+            c.autosave = False
+
+        self._postings = []
+        try:
+            yield self
+            self._commit(self._batch, extra)
+            self.saved_version = self.version
+        except Exception:
+            self.version = version
+            for name in self._collections.keys():
+                if name in state:
+                    self._collections[name].restore(state[name])
+                else:
+                    del self._collections[name]
+            raise
+        finally:
+            self._batch = None
+            self._postings = []
+            for c in self._loaded():
+                c.autosave = self.journal is None
+
+    def apply_operations(self, operations):
+        """applies a list of operations as a single batch. Each
+        operation is a tuple of its name and arguments e.g.
+        ('expense', wallet, account, amount),
+        ('transfer', amount, from_acct, to_acct, transfer_type) or
+        ('fund', template)."""
+        methods = {
+                'expense': self.add_expense,
+                'transfer': self.transfer_funds,
+                'fund': self.fund_wallets
+                }
+
+        with self.batch():
+            for operation in operations:
+                if operation[0] not in methods:
+                    msg = 'Invalid operation: {}'.format(operation[0])
+                    raise Exception(msg)
+
+                methods[operation[0]](*operation[1:])
+
+    def _commit(self, records, extra=()):
+        if self.journal is None:
+            self.storage.commit(self._loaded() + list(extra))
+        elif extra:
+            # NOTE(steve): the journal only holds operations, so the
+            # records are folded into a checkpoint that replaces the
+            # extra files in the same step.
+            self.preload()
+            self.journal.checkpoint(self._loaded() + list(extra))
+        elif records:
+            self.journal.append_many(records)
+            if self.autocompact and self.journal.needs_compaction():
+                self.compact()
+
+        if self.history is not None:
+            self._record(self._postings)
+
+    def _save(self, *collections):
+        """saves the collections changed by an operation made outside
+        a batch in a single step, so either all of them are kept or
+        none. Journaled apps keep the operation in the journal.
+        Collections that saved themselves, e.g. in create_item(), are
+        not given."""
+        if self.journal is None and self._batch is None:
+            if collections:
+                self.storage.commit(collections)
+            self.saved_version = self.version
+
+    def _post(self, op, *changes):
+        """posts (kind, name, amount) changes to balances made by an
+        operation to the history. It is called once the operation has
+        been saved, or logged when journaled, so a change that failed
+        to persist is never posted."""
+        if self.history is None or self._replaying:
+            return
+
+        postings = [(kind, name, to_cents(amount), op)
+                for (kind, name, amount) in changes]
+        if self._batch is not None:
+            self._postings.extend(postings)
+        else:
+            self._record(postings)
+
+    def _record(self, postings):
+        """posts to the history and adds to the rollups"""
+        when = self.history.post(postings)
+        if when is not None:
+            self.rollups.add(postings, when)
+
+    def _balances(self):
+        """the balance in cents of every wallet and account"""
+        balances = {}
+        for (name, wallet) in self.wallets.items():
+            balances[('wallet', name)] = wallet.cents()
+        for (name, account) in self.accounts.items():
+            balances[('account', name)] = account.cents()
+
+        return balances
+
+    def _log(self, *record):
+        if self._replaying:
+            return
+
+        self.version += 1
+        if self.journal is None:
+            return
+
+        if self._batch is not None:
+            self._batch.append(record)
+        else:
+            self.journal.append(*record)
+            self.saved_version = self.version
+            if self.autocompact and self.journal.needs_compaction():
+                self.compact()
+
+    @staticmethod
+    def _flatten(allocation):
+        record = []
+        for (k, v) in allocation.iteritems():
+            record.extend([k, v])
 
-        self.accounts.save()
-        self.wallets.save()
+        return record
+
+    @staticmethod
+    def _allocation(record):
+        return dict(zip(record[0::2], [float(v) for v in record[1::2]]))
+
+    def _replay(self):
+        """rebuilds the collections by applying the journal on
+        top of the loaded csv snapshot"""
+        self._replaying = True
+        try:
+            for record in self.journal:
+                self._apply(record)
+        finally:
+            self._replaying = False
+
+    def _apply(self, record):
+        op, args = record[0], record[1:]
+        if op == 'create' and args[0] == 'wallet':
+            self.create_wallet(args[1], args[2])
+        elif op == 'create' and args[0] == 'account':
+            self.create_account(args[1], args[2])
+        elif op == 'create' and args[0] == 'funding':
+            self.create_funding_template(args[1], args[2], args[3], args[4],
+                    self._allocation(args[5:]))
+        elif op == 'update' and args[0] == 'funding':
+            self.update_funding_template(args[1], args[2], args[3], args[4],
+                    self._allocation(args[5:]))
+        elif op == 'remove' and args[0] == 'wallet':
+            self.remove_wallet(args[1], transfer=args[2])
+        elif op == 'remove' and args[0] == 'account':
+            self.remove_account(args[1], transfer=args[2])
+        elif op == 'remove' and args[0] == 'funding':
+            self.remove_funding_template(args[1])
+        elif op == 'expense':
+            self.add_expense(args[0], args[1], args[2])
+        elif op == 'transfer':
+            self.transfer_funds(args[3], args[1], args[2], args[0])
+        elif op == 'fund':
+            self._fund(args[1], float(args[2]), self._allocation(args[3:]))
+        else:
+            msg = 'Invalid journal record: {}'.format(record)
+            raise Exception(msg)
@@ -0,0 +1,112 @@
+"""
+cache.py
+
+A process wide cache of loaded App instances. An entry is reloaded
+unless everything its app holds is still what is stored, i.e. the app
+has persisted all its changes and nothing has been saved since other
+than through the app itself.
+
+An app is not safe to use from two threads at once. Threads sharing
+the cache should take their apps with checkout(), which holds the
+entry for the block.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from app import App
+from layout import user_path
+
+class AppCache(object):
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        # key -> (app, lock held while the app is in use)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(user, conn, options):
+        path = user
+        if conn:
+            path = user_path(conn, user)
+
+        return (os.path.abspath(path), tuple(sorted(options.items())))
+
+    def get(self, user, conn=None, **options):
+        """returns the cached App for the user, loading it when it is
+        missing or out of date"""
+        return self._get(user, conn, options)[0]
+
+    @contextmanager
+    def checkout(self, user, conn=None, **options):
+        """holds the user's cached App for the block so no other
+        thread uses or reloads it in the meantime"""
+        while True:
+            (app, lock) = self._get(user, conn, options)
+            with lock:
+                # NOTE(steve): the app may have been saved over while
+                # waiting for the lock, in which case it is reloaded.
+                if app.unchanged():
+                    yield app
+                    return
+
+            self.invalidate(user, conn, **options)
+
+    def _get(self, user, conn, options):
+        key = self._key(user, conn, options)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if entry[0].unchanged():
+                    self.hits += 1
+                else:
+                    self.invalidations += 1
+                    entry = None
+
+            if entry is None:
+                self.misses += 1
+                entry = (App(user, conn, **options), threading.RLock())
+
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+            return entry
+
+    def invalidate(self, user, conn=None, **options):
+        key = self._key(user, conn, options)
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': float(self.hits) / requests if requests else 0.0
+                }
+
+apps = AppCache()
+
+def get_app(user, conn=None, **options):
+    return apps.get(user, conn, **options)
@@ -0,0 +1,52 @@
+"""
+convert.py
+
+Converts the data files of user directories between the csv and
+packed formats in place. The collections detect the format when
+they are loaded so converted users can be used straight away.
+"""
+
+from wallets import Wallets, Accounts, FundingTemplates
+from journal import commit, recover
+from layout import iter_users, user_path
+
+FORMATS = ['csv', 'packed']
+
+def convert(conn, format='packed'):
+    """converts the data files of a single user directory"""
+    if format not in FORMATS:
+        raise Exception('Invalid format: {}'.format(format))
+
+    recover(conn)
+
+    # NOTE(steve): the collections are loaded without replaying
+    # the journal so only the snapshot changes format.
+    collections = [Wallets(conn), Accounts(conn), FundingTemplates(conn)]
+    for c in collections:
+        c.format = format
+
+    commit(conn, collections)
+
+def convert_all(conn, format='packed'):
+    """converts every user directory in conn"""
+    users = []
+    for user in iter_users(conn):
+        convert(user_path(conn, user), format)
+        users.append(user)
+
+    return users
+
+if __name__ == '__main__':
+    import argparse
+
+    desc = """Converts the wallets data of every user in a directory
+    between the csv and packed formats."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('conn', help="Directory holding the user data")
+    parser.add_argument('--format', choices=FORMATS, default='packed',
+                        help="Format to convert to")
+
+    args = parser.parse_args()
+
+    for user in convert_all(args.conn, args.format):
+        print('Converted {} to {}'.format(user, args.format))
@@ -0,0 +1,193 @@
+"""
+durable.py
+
+Durable file writes. A file is written to a temporary file, flushed
+to disk and renamed over the original so a crash never leaves a
+partially written file behind.
+
+Writes are committed in groups by a background thread. Writes that
+arrive within the commit window share a single flush cycle and only
+the latest data for each file is written.
+"""
+
+import os
+import time
+import atexit
+import threading
+from collections import OrderedDict
+
+def write_file(path, data, sync=True):
+    """replaces the file at path with data"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+
+    os.rename(tmp, path)
+
+def sync_directory(path):
+    """flushes the directory entries of path, e.g. after a rename"""
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class GroupCommitter(object):
+    """Commits file writes in groups.
+
+    window  seconds to wait for more writes before each flush cycle
+    sync    fsync the files and their directories when committing
+    wait    block writers until their data has been committed. When
+            it is not set writes return straight away and may be
+            lost in a crash until the next flush cycle completes.
+    """
+    def __init__(self, window=0.0, sync=True, wait=True):
+        self.window = window
+        self.sync = sync
+        self.wait = wait
+
+        self.writes = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.failures = 0
+
+        self._pending = OrderedDict()
+        self._batch = 1
+        self._committed = 0
+        self._errors = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def write(self, path, data):
+        with self._cond:
+            if path in self._pending:
+                self.coalesced += 1
+
+            self._pending[path] = data
+            self.writes += 1
+            batch = self._batch
+            self._start()
+            self._cond.notify_all()
+
+            if not self.wait:
+                return
+
+            while self._committed < batch:
+                self._cond.wait()
+
+            error = self._errors.get(batch)
+
+        if error is not None:
+            raise error
+
+    def flush(self):
+        """waits until every write made so far has been committed"""
+        with self._cond:
+            batch = self._batch if self._pending else self._batch - 1
+            while self._committed < batch:
+                self._cond.wait()
+
+    def stop(self):
+        """commits the pending writes and waits for the thread to
+        exit. A later write starts it again."""
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify_all()
+
+        if thread is not None:
+            thread.join()
+
+        with self._cond:
+            self._stopping = False
+            self._thread = None
+
+    def stats(self):
+        with self._cond:
+            return {
+                    'writes': self.writes,
+                    'coalesced': self.coalesced,
+                    'batches': self.batches,
+                    'largest_batch': self.largest_batch,
+                    'failures': self.failures,
+                    'mean_batch': (float(self.writes - self.coalesced) /
+                        self.batches if self.batches else 0.0)
+                    }
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+
+                if not self._pending:
+                    return
+                stopping = self._stopping
+
+            if self.window and not stopping:
+                time.sleep(self.window)
+
+            with self._cond:
+                pending, self._pending = self._pending, OrderedDict()
+                batch = self._batch
+                self._batch += 1
+
+            error = None
+            try:
+                self._commit(pending)
+            except Exception as e:
+                error = e
+
+            with self._cond:
+                self.batches += 1
+                self.largest_batch = max(self.largest_batch, len(pending))
+                if error is not None:
+                    self.failures += 1
+                    if self.wait:
+                        self._errors[batch] = error
+                self._committed = batch
+                self._cond.notify_all()
+
+    def _commit(self, pending):
+        directories = set()
+        for (path, data) in pending.iteritems():
+            write_file(path, data, self.sync)
+            directories.add(os.path.dirname(path))
+
+        if self.sync:
+            for d in directories:
+                sync_directory(d)
+
+committer = GroupCommitter()
+
+def configure(window=0.0, sync=True, wait=True):
+    """replaces the committer used for saving collections"""
+    global committer
+    committer.stop()
+    committer = GroupCommitter(window, sync, wait)
+    return committer
+
+def write(path, data):
+    committer.write(path, data)
+
+def flush():
+    committer.flush()
+
+def shutdown():
+    """commits the pending writes and stops the committer thread"""
+    committer.stop()
+
+# NOTE(steve): the thread is stopped before the interpreter starts
+# tearing down modules, which it would otherwise still be using.
+atexit.register(shutdown)
@@ -0,0 +1,163 @@
+"""
+export.py
+
+Exports the wallets, accounts and funding templates of every user
+as JSON Lines or csv. Records are generated one user at a time so
+memory use does not grow with the number of users.
+"""
+
+import os
+import sys
+import csv
+import json
+import gzip
+import zlib
+from cStringIO import StringIO
+
+from layout import encode, iter_users
+
+FORMATS = ['jsonl', 'csv']
+
+FIELDS = ['user', 'type', 'name', 'amount', 'frequency', 'account',
+        'wallet', 'allocation']
+
+def _app_class():
+    # NOTE(steve): inside the web app the flask package shadows
+    # app.py, which is loaded as wallets_app instead, see
+    # app/userdata.py.
+    module = sys.modules.get('wallets_app')
+    if module is None:
+        import app as module
+
+    return module.App
+
+def records(conn, users=None):
+    """yields a record for each wallet, account and funding template
+    allocation of the users, or of every user when none are given.
+    The collections of each user are loaded as they are reached and
+    nothing is written to their directories."""
+    App = _app_class()
+    if users is None:
+        users = iter_users(conn)
+
+    for user in users:
+        user = encode(user)
+        app = App(user, conn=conn, autocompact=False)
+
+        for (name, wallet) in app.wallets.items():
+            yield {'user': user, 'type': 'wallet', 'name': name,
+                    'amount': wallet.balance()}
+
+        for (name, account) in app.accounts.items():
+            yield {'user': user, 'type': 'account', 'name': name,
+                    'amount': account.balance()}
+
+        for (name, template) in app.funding_templates.items():
+            allocation = template.allocation()
+            for wallet in sorted(allocation):
+                yield {'user': user, 'type': 'funding', 'name': name,
+                        'amount': template.amount(),
+                        'frequency': template.frequency(),
+                        'account': template.account(),
+                        'wallet': wallet,
+                        'allocation': allocation[wallet]}
+
+def line(record, format='jsonl'):
+    """a single record as a line of text in the format"""
+    if format == 'jsonl':
+        return json.dumps(record, sort_keys=True) + '\n'
+
+    f = StringIO()
+    csv.DictWriter(f, FIELDS).writerow(record)
+    return f.getvalue()
+
+def header(format='jsonl'):
+    """the line a file in the format starts with, if any"""
+    if format == 'csv':
+        return line(dict(zip(FIELDS, FIELDS)), format)
+
+    return ''
+
+def lines(records, format='jsonl'):
+    """yields the records as lines of text in the format"""
+    if format not in FORMATS:
+        raise Exception('Invalid format: {}'.format(format))
+
+    if header(format):
+        yield header(format)
+
+    for record in records:
+        yield line(record, format)
+
+def compress(chunks):
+    """gzips a stream of strings as it is generated"""
+    z = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = z.compress(chunk)
+        if data:
+            yield data
+
+    yield z.flush()
+
+def shard(user, shards):
+    """the shard a user's records are written to"""
+    return (zlib.crc32(encode(user)) & 0xffffffff) % shards
+
+def shard_path(path, i, shards):
+    """path with the shard number added before its extensions, e.g.
+    export-002.jsonl.gz"""
+    if shards == 1:
+        return path
+
+    directory, name = os.path.split(path)
+    root, dot, ext = name.partition('.')
+    return os.path.join(directory, '{}-{:03d}{}{}'.format(root, i, dot, ext))
+
+def export(conn, path, format='jsonl', gzipped=False, shards=1,
+        users=None):
+    """writes the records of the users to path, split across a
+    number of shards by user. Returns the number of records."""
+    if format not in FORMATS:
+        raise Exception('Invalid format: {}'.format(format))
+
+    if shards < 1:
+        raise Exception('Invalid number of shards: {}'.format(shards))
+
+    files = []
+    for i in range(shards):
+        p = shard_path(path, i, shards)
+        files.append(gzip.open(p, 'wb') if gzipped else open(p, 'wb'))
+
+    n = 0
+    try:
+        for f in files:
+            f.write(header(format))
+
+        for record in records(conn, users):
+            files[shard(record['user'], shards)].write(line(record, format))
+            n += 1
+    finally:
+        for f in files:
+            f.close()
+
+    return n
+
+if __name__ == '__main__':
+    import argparse
+
+    desc = """Exports the wallets data of every user in a directory as
+    JSON Lines or csv."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('conn', help="Directory holding the user data")
+    parser.add_argument('output', help="File to write the export to")
+    parser.add_argument('--format', choices=FORMATS, default='jsonl',
+                        help="Format of the export")
+    parser.add_argument('--gzip', action='store_true',
+                        help="Compress the export")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Number of files to split the export into")
+
+    args = parser.parse_args()
+
+    n = export(args.conn, args.output, args.format, args.gzip, args.shards)
+    print('Exported {} records'.format(n))
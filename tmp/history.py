@@ -0,0 +1,232 @@
+"""
+history.py
+
+The transaction history of a user. Every change to the balance of a
+wallet or account is appended to history.csv as a timestamped
+posting of the amount in cents.
+
+Every so many postings the balances of all wallets and accounts are
+written to checkpoints.csv together with the position in the history
+they were taken at. The balance at any time is found from the last
+checkpoint before it and a scan of the postings that follow it, so
+queries stay fast however long the history grows.
+"""
+
+import os
+import csv
+import time
+import bisect
+import calendar
+import datetime
+
+import locks
+
+# postings between checkpoints
+CHECKPOINT_INTERVAL = 500
+
+class Checkpoint(object):
+    __slots__ = ('timestamp', 'offset', 'balances')
+
+    def __init__(self, timestamp, offset, balances):
+        self.timestamp = timestamp
+        self.offset = offset
+        self.balances = balances
+
+def timestamp(when, end_of_day=True):
+    """seconds since the epoch for a timestamp, datetime or date. A
+    date means the end of that day (UTC), or its start when
+    end_of_day is not set."""
+    if isinstance(when, datetime.datetime):
+        return calendar.timegm(when.utctimetuple()) + \
+                when.microsecond / 1e6
+    if isinstance(when, datetime.date):
+        day = calendar.timegm(when.timetuple())
+        if end_of_day:
+            return day + 24 * 60 * 60 - 1e-6
+        return day
+
+    return float(when)
+
+class History(object):
+    def __init__(self, conn, clock=time.time, interval=CHECKPOINT_INTERVAL):
+        self._conn = conn
+        self._data = os.path.join(conn, 'history.csv')
+        self._checkpoints = os.path.join(conn, 'checkpoints.csv')
+
+        self.clock = clock
+        self.interval = interval
+
+        # loaded on first use and again when another app has
+        # posted since, see _load()
+        self._index = None
+        self._balances = None
+        self._since = 0
+        self._last = 0.0
+        self._size = None
+
+    def started(self):
+        return os.path.isfile(self._checkpoints)
+
+    def start(self, balances):
+        """begins the history with the opening balances, a dictionary
+        of (kind, name) -> cents"""
+        if self.started():
+            raise Exception('History of {} already started'.format(
+                self._conn))
+
+        with locks.write(self._conn):
+            open(self._data, 'ab').close()
+            self._balances = dict(balances)
+            self._index = []
+            self._since = 0
+            self._last = self.clock()
+            self._size = 0
+            self._checkpoint(self._last)
+
+    def post(self, postings):
+        """appends a list of (kind, name, cents, op) postings with the
+        current time and returns the time they were posted at"""
+        if not postings:
+            return None
+
+        with locks.write(self._conn):
+            self._load()
+
+            # NOTE(steve): the history is kept in time order so the
+            # clock is not allowed to run backwards.
+            now = max(self.clock(), self._last)
+            with open(self._data, 'ab') as f:
+                writer = csv.writer(f)
+                for (kind, name, cents, op) in postings:
+                    writer.writerow([repr(now), kind, name, cents, op])
+                    key = (kind, name)
+                    self._balances[key] = self._balances.get(key, 0) + cents
+
+            self._last = now
+            self._since += len(postings)
+            self._size = os.path.getsize(self._data)
+            if self._since >= self.interval:
+                self._checkpoint(now)
+
+        return now
+
+    def balance(self, kind, name, when=None):
+        """the balance of a wallet or account at a time, see
+        timestamp(), or the current balance when no time is given"""
+        self._load()
+        key = (kind, name)
+        if when is None:
+            return self._balances.get(key, 0) / 100.0
+
+        end = timestamp(when)
+        checkpoint = self._checkpoint_before(end)
+        cents = checkpoint.balances.get(key, 0)
+        for (t, k, n, c, op) in self._scan(checkpoint.offset):
+            if t > end:
+                break
+            if (k, n) == key:
+                cents += c
+
+        return cents / 100.0
+
+    def balances(self, when=None):
+        """the balance of every wallet and account at a time as a
+        dictionary of (kind, name) -> balance. Wallets and accounts
+        without a balance, e.g. ones that were removed, are left out."""
+        self._load()
+        if when is None:
+            cents = dict(self._balances)
+        else:
+            end = timestamp(when)
+            checkpoint = self._checkpoint_before(end)
+            cents = dict(checkpoint.balances)
+            for (t, k, n, c, op) in self._scan(checkpoint.offset):
+                if t > end:
+                    break
+                cents[(k, n)] = cents.get((k, n), 0) + c
+
+        return dict((k, v / 100.0) for (k, v) in cents.iteritems() if v)
+
+    def postings(self, start=None, end=None):
+        """yields the (timestamp, kind, name, cents, op) postings from
+        start up to and including end. Dates include the whole day."""
+        self._load()
+        offset = 0
+        if start is not None:
+            start = timestamp(start, end_of_day=False)
+
+            # NOTE(steve): postings made at the time of a checkpoint
+            # may be on either side of it.
+            times = [c.timestamp for c in self._index]
+            i = bisect.bisect_left(times, start)
+            if i > 0:
+                offset = self._index[i - 1].offset
+
+        if end is not None:
+            end = timestamp(end)
+
+        for posting in self._scan(offset):
+            if end is not None and posting[0] > end:
+                break
+            if start is None or posting[0] >= start:
+                yield posting
+
+    def _checkpoint_before(self, when):
+        """the last checkpoint taken at or before when"""
+        i = bisect.bisect_right([c.timestamp for c in self._index], when)
+        if i == 0:
+            msg = 'No history before {}'.format(
+                    datetime.datetime.utcfromtimestamp(when))
+            raise Exception(msg)
+
+        return self._index[i - 1]
+
+    def _scan(self, offset):
+        with open(self._data, 'rb') as f:
+            f.seek(offset)
+            for row in csv.reader(f):
+                yield (float(row[0]), row[1], row[2], int(row[3]), row[4])
+
+    def _checkpoint(self, now):
+        offset = os.path.getsize(self._data)
+        row = [repr(now), offset]
+        for ((kind, name), cents) in sorted(self._balances.iteritems()):
+            # a missing balance is zero, e.g. a removed wallet
+            if cents:
+                row.extend([kind, name, cents])
+
+        with open(self._checkpoints, 'ab') as f:
+            csv.writer(f).writerow(row)
+
+        self._index.append(Checkpoint(now, offset, dict(self._balances)))
+        self._since = 0
+
+    def _load(self):
+        """reads the checkpoints and the postings after the last one"""
+        if not self.started():
+            raise Exception('History of {} not started'.format(self._conn))
+
+        size = os.path.getsize(self._data)
+        if self._index is not None and size == self._size:
+            return
+
+        index = []
+        with open(self._checkpoints, 'rb') as f:
+            for row in csv.reader(f):
+                balances = {}
+                for i in range(2, len(row), 3):
+                    balances[(row[i], row[i + 1])] = int(row[i + 2])
+                index.append(Checkpoint(float(row[0]), int(row[1]), balances))
+
+        last = index[-1]
+        self._balances = dict(last.balances)
+        self._last = last.timestamp
+        self._since = 0
+        for (t, kind, name, cents, op) in self._scan(last.offset):
+            key = (kind, name)
+            self._balances[key] = self._balances.get(key, 0) + cents
+            self._last = t
+            self._since += 1
+
+        self._index = index
+        self._size = size
@@ -0,0 +1,145 @@
+"""
+journal.py
+
+An append-only log of the operations performed on a user's
+collections. Each operation is stored as a single csv row
+whose first field is the name of the operation.
+
+The journal is periodically folded into a fresh snapshot of
+the collections (a checkpoint) so that loading a user only has
+to replay the operations since the last checkpoint.
+"""
+
+import os
+import csv
+
+import durable
+import locks
+
+MAX_RECORDS = 1000
+MAX_BYTES = 1024 * 1024
+
+CHECKPOINT = 'checkpoint'
+
+class Journal(object):
+    def __init__(self, conn, max_records=MAX_RECORDS, max_bytes=MAX_BYTES):
+        self._conn = conn
+        self._data = os.path.join(conn, 'journal.csv')
+        self._records = 0
+
+        # the size of the journal as last read or written, see check()
+        self._size = None
+
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+
+    def __iter__(self):
+        self._records = 0
+        self._size = self.size()
+        if not os.path.isfile(self._data):
+            return
+
+        with open(self._data, 'rb') as f:
+            for row in csv.reader(f):
+                self._records += 1
+                yield row
+
+    def __len__(self):
+        return self._records
+
+    def size(self):
+        if not os.path.isfile(self._data):
+            return 0
+
+        return os.path.getsize(self._data)
+
+    def check(self):
+        """raises if another app has written to the journal since
+        it was last read or written through this one"""
+        if self._size is not None and self.size() != self._size:
+            msg = '{} has changed since it was loaded'.format(self._data)
+            raise Exception(msg)
+
+    def unchanged(self):
+        """whether the journal is as it was last read or written
+        through this one"""
+        return self._size is None or self.size() == self._size
+
+    def append(self, *record):
+        """appends a single operation to the end of the journal"""
+        self.append_many([record])
+
+    def append_many(self, records):
+        """appends several operations with a single write"""
+        with locks.write(self._conn):
+            self.check()
+            with open(self._data, 'ab') as f:
+                writer = csv.writer(f)
+                writer.writerows(records)
+
+            self._size = self.size()
+
+        self._records += len(records)
+
+    def needs_compaction(self):
+        return (self._records >= self.max_records or
+                self.size() >= self.max_bytes)
+
+    def checkpoint(self, collections):
+        """folds the journal into a fresh snapshot of the collections"""
+        commit(self._conn, collections, journal=self)
+        self._records = 0
+
+def commit(conn, collections, journal=None):
+    """replaces the csv files of the collections with fresh snapshots
+    in a single step. The journal is emptied in the same step when
+    it is given.
+
+    The new files are staged next to the current ones and the
+    checkpoint marker is written once they are complete. From then
+    on the commit is rolled forward by recover() if it is
+    interrupted, so the journal is never applied twice.
+    """
+    with locks.write(conn):
+        names = []
+        for c in collections:
+            c.check()
+            c.save(c.path() + '.new')
+            names.append(os.path.basename(c.path()))
+
+        if journal is not None:
+            journal.check()
+            durable.write(journal._data + '.new', '')
+            names.append(os.path.basename(journal._data))
+
+        # NOTE(steve): the staged files must be on disk before the
+        # marker is, even when the committer does not wait for writes.
+        durable.flush()
+        durable.write_file(os.path.join(conn, CHECKPOINT), '\n'.join(names))
+        durable.sync_directory(conn)
+
+        recover(conn)
+        for c in collections:
+            c.refresh()
+        if journal is not None:
+            journal._size = 0
+
+def recover(conn):
+    """completes an interrupted commit and discards any files that
+    were staged without being committed"""
+    with locks.write(conn):
+        marker = os.path.join(conn, CHECKPOINT)
+        if os.path.isfile(marker):
+            with open(marker, 'rb') as f:
+                names = f.read().split('\n')
+
+            for name in names:
+                staged = os.path.join(conn, name + '.new')
+                if os.path.isfile(staged):
+                    os.rename(staged, os.path.join(conn, name))
+
+            os.remove(marker)
+
+        for name in os.listdir(conn):
+            if name.endswith('.new'):
+                os.remove(os.path.join(conn, name))
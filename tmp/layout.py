@@ -0,0 +1,151 @@
+"""
+layout.py
+
+Where the data directory of each user lives. Users are spread over
+two levels of subdirectories named after a hash of the user name,
+e.g. conn/_shards/3f/a2/steve, so no directory grows too large to
+list or search quickly.
+
+Users created before the sharded layout live directly in conn. They
+are still found there and can be moved with migrate() while the app
+is running.
+"""
+
+import os
+import hashlib
+
+import locks
+
+SHARDS = '_shards'
+
+def encode(user):
+    """the user name as it is stored and hashed. Names given as
+    unicode, e.g. by the web app, are encoded as utf-8."""
+    if isinstance(user, unicode):
+        return user.encode('utf-8')
+
+    return user
+
+def shard(user):
+    """the two levels of subdirectories holding the user"""
+    digest = hashlib.md5(encode(user)).hexdigest()
+    return (digest[:2], digest[2:4])
+
+def sharded_path(conn, user):
+    return os.path.join(conn, SHARDS, *(shard(user) + (encode(user),)))
+
+def flat_path(conn, user):
+    return os.path.join(conn, encode(user))
+
+def user_path(conn, user):
+    """the data directory of the user. Users that have not been moved
+    to the sharded layout are found in conn. New users get a sharded
+    path."""
+    path = sharded_path(conn, user)
+    if os.path.isdir(path):
+        return path
+
+    flat = flat_path(conn, user)
+    if os.path.isdir(flat):
+        return flat
+
+    return path
+
+def create_path(conn, user):
+    """creates the parent directories of a new user's data directory
+    and returns its path"""
+    if user == SHARDS:
+        raise Exception('Invalid user name: {}'.format(user))
+
+    path = sharded_path(conn, user)
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            # created by another process in the meantime
+            if not os.path.isdir(parent):
+                raise
+
+    return path
+
+def iter_flat_users(conn):
+    """the users in conn that have not been moved to the sharded
+    layout. Links left behind by migrate() are skipped."""
+    for name in sorted(os.listdir(conn)):
+        path = os.path.join(conn, name)
+        if name != SHARDS and os.path.isdir(path) and \
+                not os.path.islink(path):
+            yield name
+
+def iter_users(conn):
+    """yields the name of every user in conn. The flat users come
+    first and then the sharded users one shard at a time."""
+    for user in iter_flat_users(conn):
+        yield user
+
+    root = os.path.join(conn, SHARDS)
+    if not os.path.isdir(root):
+        return
+
+    for a in sorted(os.listdir(root)):
+        for b in sorted(os.listdir(os.path.join(root, a))):
+            for user in sorted(os.listdir(os.path.join(root, a, b))):
+                yield user
+
+def migrate(conn, link=True):
+    """moves every flat user into the sharded layout. Each user is
+    moved under their write lock with a single rename.
+
+    When link is set a link to the new directory is left in place of
+    the old one so apps that opened the user before the move keep
+    working. Remove them with prune() once those apps have gone."""
+    moved = []
+    for user in list(iter_flat_users(conn)):
+        old = flat_path(conn, user)
+        new = create_path(conn, user)
+        with locks.write(old):
+            if os.path.exists(new):
+                msg = 'User {} exists in both layouts'.format(user)
+                raise Exception(msg)
+
+            os.rename(old, new)
+            if link:
+                os.symlink(os.path.abspath(new), old)
+
+        moved.append(user)
+
+    return moved
+
+def prune(conn):
+    """removes the links left behind by migrate()"""
+    pruned = []
+    for name in sorted(os.listdir(conn)):
+        path = os.path.join(conn, name)
+        if os.path.islink(path) and \
+                os.path.realpath(path) == \
+                os.path.realpath(sharded_path(conn, name)):
+            os.remove(path)
+            pruned.append(name)
+
+    return pruned
+
+if __name__ == '__main__':
+    import argparse
+
+    desc = """Moves the users in a directory into the sharded layout."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('conn', help="Directory holding the user data")
+    parser.add_argument('--no-link', dest='link', action='store_false',
+                        help="Do not leave links at the old paths")
+    parser.add_argument('--prune', action='store_true',
+                        help="Remove links left by an earlier migration")
+
+    args = parser.parse_args()
+
+    if args.prune:
+        for user in prune(args.conn):
+            print('Removed link for {}'.format(user))
+    else:
+        for user in migrate(args.conn, args.link):
+            print('Moved {}'.format(user))
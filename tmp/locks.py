@@ -0,0 +1,92 @@
+"""
+locks.py
+
+Reader-writer locks on a user's data directory. The locks are
+flock(2) locks on a file in the directory so they coordinate
+separate processes, e.g. web workers, as well as threads.
+
+Locks are reentrant within a thread. A thread holding the write
+lock may take the read lock again but a read lock can not be
+upgraded to a write lock.
+"""
+
+import os
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+
+LOCK_FILE = '.lock'
+
+_held = threading.local()
+_stats_lock = threading.Lock()
+_stats = {}
+
+def _new_stats():
+    return {'acquisitions': 0, 'wait': 0.0, 'max_wait': 0.0}
+
+def _record(mode, wait):
+    with _stats_lock:
+        s = _stats.setdefault(mode, _new_stats())
+        s['acquisitions'] += 1
+        s['wait'] += wait
+        s['max_wait'] = max(s['max_wait'], wait)
+
+def stats():
+    """the number of acquisitions and the total and longest time
+    spent waiting for each kind of lock"""
+    with _stats_lock:
+        return dict((mode, dict(_stats.get(mode, _new_stats())))
+                for mode in ('read', 'write'))
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+@contextmanager
+def read(conn):
+    """holds a shared lock on the user's data directory"""
+    with _lock(conn, 'read'):
+        yield
+
+@contextmanager
+def write(conn):
+    """holds an exclusive lock on the user's data directory"""
+    with _lock(conn, 'write'):
+        yield
+
+@contextmanager
+def _lock(conn, mode):
+    path = os.path.abspath(os.path.join(conn, LOCK_FILE))
+    if not hasattr(_held, 'locks'):
+        _held.locks = {}
+
+    held = _held.locks.get(path)
+    if held is not None:
+        if held[0] == 'read' and mode == 'write':
+            msg = 'Can not upgrade read lock on {}'.format(conn)
+            raise Exception(msg)
+
+        held[1] += 1
+        try:
+            yield
+        finally:
+            held[1] -= 1
+        return
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+    try:
+        start = time.time()
+        if mode == 'write':
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+        _record(mode, time.time() - start)
+
+        _held.locks[path] = [mode, 1]
+        try:
+            yield
+        finally:
+            del _held.locks[path]
+    finally:
+        os.close(fd)
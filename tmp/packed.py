@@ -0,0 +1,117 @@
+"""
+packed.py
+
+A compact binary format for the per-user data files. Names are
+kept in a string table and amounts as little endian integer cents
+so that a file is decoded from a single read without parsing
+every field as text.
+
+balances:  magic | count | name lengths | names | cents
+templates: magic | string count | string lengths | strings |
+           template count | templates
+
+where each template is (name, amount, frequency, account,
+allocation count) followed by its (wallet, amount) pairs.
+"""
+
+import struct
+
+# NOTE(steve): the markers start with a NUL byte, which the csv
+# module refuses to read, so a csv file can never be taken for a
+# packed one whatever its first name is.
+BALANCES = '\x00WLB1\r\n\x1a'
+TEMPLATES = '\x00WLF1\r\n\x1a'
+MAGIC_SIZE = 8
+
+_COUNT = struct.Struct('<I')
+_TEMPLATE = struct.Struct('<IqIII')
+_ALLOCATION = struct.Struct('<Iq')
+
+def magic(path):
+    """the format marker at the start of the file, if any"""
+    with open(path, 'rb') as f:
+        return f.read(MAGIC_SIZE)
+
+def is_packed(path):
+    return magic(path) in (BALANCES, TEMPLATES)
+
+def _pack_strings(strings):
+    n = len(strings)
+    return (_COUNT.pack(n) +
+            struct.pack('<{}I'.format(n), *[len(s) for s in strings]) +
+            ''.join(strings))
+
+def _unpack_strings(data, offset):
+    (n,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+
+    lengths = struct.unpack_from('<{}I'.format(n), data, offset)
+    offset += 4 * n
+
+    strings = []
+    for length in lengths:
+        strings.append(data[offset:offset + length])
+        offset += length
+
+    return (strings, offset)
+
+def pack_balances(rows):
+    """packs a list of (name, cents) rows"""
+    names = [name for (name, cents) in rows]
+    cents = [cents for (name, cents) in rows]
+    return (BALANCES + _pack_strings(names) +
+            struct.pack('<{}q'.format(len(cents)), *cents))
+
+def unpack_balances(data):
+    if data[:MAGIC_SIZE] != BALANCES:
+        raise Exception('Not a packed balances file')
+
+    (names, offset) = _unpack_strings(data, MAGIC_SIZE)
+    cents = struct.unpack_from('<{}q'.format(len(names)), data, offset)
+    return zip(names, cents)
+
+def pack_templates(rows):
+    """packs a list of (name, amount, frequency, account, allocation)
+    rows where allocation is a list of (wallet, cents) pairs"""
+    strings = []
+    index = {}
+    def intern(s):
+        if s not in index:
+            index[s] = len(strings)
+            strings.append(s)
+        return index[s]
+
+    records = []
+    for (name, amount, frequency, account, allocation) in rows:
+        records.append(_TEMPLATE.pack(intern(name), amount,
+            intern(frequency), intern(account), len(allocation)))
+        for (wallet, cents) in allocation:
+            records.append(_ALLOCATION.pack(intern(wallet), cents))
+
+    return (TEMPLATES + _pack_strings(strings) + _COUNT.pack(len(rows)) +
+            ''.join(records))
+
+def unpack_templates(data):
+    if data[:MAGIC_SIZE] != TEMPLATES:
+        raise Exception('Not a packed funding templates file')
+
+    (strings, offset) = _unpack_strings(data, MAGIC_SIZE)
+    (n,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+
+    rows = []
+    for i in xrange(n):
+        (name, amount, frequency, account, count) = _TEMPLATE.unpack_from(
+                data, offset)
+        offset += _TEMPLATE.size
+
+        allocation = []
+        for j in xrange(count):
+            (wallet, cents) = _ALLOCATION.unpack_from(data, offset)
+            offset += _ALLOCATION.size
+            allocation.append((strings[wallet], cents))
+
+        rows.append((strings[name], amount, strings[frequency],
+            strings[account], allocation))
+
+    return rows
@@ -0,0 +1,208 @@
+"""
+projection.py
+
+Projects the balances of a user's wallets month by month from their
+funding templates and their spending. The templates are turned into
+a matrix of the cents paid into each wallet in each month and the
+balances are its cumulative sum, so a projection is a handful of
+numpy operations however many months it covers.
+
+Spending can be drawn at random for many scenarios at once, giving
+a spread of outcomes rather than a single guess. forecast() runs
+the scenarios for every user in a directory over a process pool.
+
+numpy is optional. Everything else works without it.
+"""
+
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from layout import encode, iter_users
+from rollups import Rollups, bucket
+from scheduler import parse
+from wallet import to_cents
+
+# months of spending used to estimate the spending to come
+SPENDING_MONTHS = 12
+
+# percentiles of the outcomes summarised by forecast()
+PERCENTILES = [5, 50, 95]
+
+def _require_numpy():
+    if np is None:
+        raise Exception('Projections need numpy')
+
+def runs(frequency, periods):
+    """the number of times a template of the frequency is run in each
+    of the months as an array"""
+    _require_numpy()
+    n = parse(frequency).per_year()
+
+    # NOTE(steve): the runs are spread over the year so e.g. a
+    # weekly template runs four or five times a month.
+    months = np.arange(periods + 1)
+    return np.diff(months * n // 12)
+
+def funding_matrix(templates, wallets, periods):
+    """the cents paid into each wallet in each month by the templates
+    as a periods x wallets array"""
+    _require_numpy()
+    index = dict((w, i) for (i, w) in enumerate(wallets))
+    matrix = np.zeros((periods, len(wallets)), dtype=np.int64)
+    for template in templates:
+        allocation = np.zeros(len(wallets), dtype=np.int64)
+        for (wallet, amount) in template.allocation().iteritems():
+            allocation[index[wallet]] = to_cents(amount)
+
+        matrix += np.outer(runs(template.frequency(), periods), allocation)
+
+    return matrix
+
+def project(balances, funding, spending=0):
+    """the balance in cents of each wallet at the end of each month.
+
+    balances holds the opening balance of each wallet and funding is
+    a periods x wallets matrix. spending is the cents spent from each
+    wallet each month and may have a leading axis of scenarios, in
+    which case the result has one too."""
+    _require_numpy()
+    return np.asarray(balances) + np.cumsum(funding - spending, axis=-2)
+
+def simulate(balances, funding, mean, std, scenarios, seed=None):
+    """projects the balances for a number of scenarios with the monthly
+    spending of each wallet drawn from a normal distribution. The
+    result is a scenarios x periods x wallets array."""
+    _require_numpy()
+    state = np.random.RandomState(seed)
+    shape = (scenarios,) + funding.shape
+    spending = np.maximum(state.normal(mean, std, shape), 0)
+    return project(balances, funding, np.rint(spending).astype(np.int64))
+
+def last_months(months, when=None):
+    """the rollup buckets of the last months up to and including the
+    month of when, oldest first"""
+    if when is None:
+        when = time.time()
+
+    (year, month) = map(int, bucket('month', when).split('-'))
+    end = year * 12 + month - 1
+    return ['{:04d}-{:02d}'.format(m // 12, m % 12 + 1)
+            for m in range(end - months + 1, end + 1)]
+
+def spending(conn, wallets, months=SPENDING_MONTHS, when=None):
+    """the mean and standard deviation of the cents spent from each
+    wallet in each of the last months, from the user's rollups. A
+    month without expenses counts as nothing spent."""
+    _require_numpy()
+    rollups = Rollups(conn)
+    buckets = dict((b, i) for (i, b) in enumerate(last_months(months, when)))
+    mean = np.zeros(len(wallets))
+    std = np.zeros(len(wallets))
+    for (i, wallet) in enumerate(wallets):
+        totals = np.zeros(months, dtype=np.int64)
+        for (b, op, amount, count) in rollups.report('month', 'wallet',
+                wallet):
+            if op == 'expense' and b in buckets:
+                totals[buckets[b]] -= to_cents(amount)
+
+        mean[i] = totals.mean()
+        std[i] = totals.std()
+
+    return (mean, std)
+
+def _app_class():
+    from export import _app_class
+    return _app_class()
+
+def _forecast_users(job):
+    """forecasts a chunk of users in a worker"""
+    (conn, users, periods, scenarios, seed) = job
+    App = _app_class()
+    results = []
+    for user in users:
+        app = App(user, conn=conn, autocompact=False)
+        path = app.conn
+
+        wallets = sorted(app.wallets)
+        balances = np.array([app.wallets[w].cents() for w in wallets],
+                dtype=np.int64)
+        funding = funding_matrix(app.funding_templates.values(), wallets,
+                periods)
+        (mean, std) = spending(path, wallets)
+
+        # NOTE(steve): each user gets their own seed so the results
+        # do not depend on how the users are spread over the workers.
+        user_seed = None
+        if seed is not None:
+            user_seed = (seed + zlib.crc32(encode(user))) & 0xffffffff
+
+        outcomes = simulate(balances, funding, mean, std, scenarios,
+                user_seed)
+        summary = np.percentile(outcomes, PERCENTILES, axis=0) / 100.0
+        results.append((user, {
+            'wallets': wallets,
+            'percentiles': dict(zip(PERCENTILES, summary)),
+            'overdrawn': (outcomes < 0).mean(axis=0)
+            }))
+
+    return results
+
+def forecast(conn, users=None, periods=12, scenarios=1000, processes=None,
+        chunk=20, seed=None):
+    """yields (user, forecast) for every user in conn, or the users
+    given, in the order they are finished. A forecast holds the sorted
+    wallet names, a periods x wallets array of the projected balances
+    for each of PERCENTILES and the share of scenarios in which each
+    wallet is overdrawn at the end of each month."""
+    _require_numpy()
+    import multiprocessing
+
+    if users is None:
+        users = iter_users(conn)
+
+    users = list(users)
+    jobs = [(conn, users[i:i + chunk], periods, scenarios, seed)
+            for i in range(0, len(users), chunk)]
+
+    if processes == 1:
+        for job in jobs:
+            for result in _forecast_users(job):
+                yield result
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for results in pool.imap_unordered(_forecast_users, jobs):
+            for result in results:
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == '__main__':
+    import argparse
+
+    desc = """Forecasts the balances of the wallets of every user in a
+    directory."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('conn', help="Directory holding the user data")
+    parser.add_argument('--months', type=int, default=12,
+                        help="Number of months to project")
+    parser.add_argument('--scenarios', type=int, default=1000,
+                        help="Number of spending scenarios to draw")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Number of worker processes")
+
+    args = parser.parse_args()
+
+    for (user, result) in forecast(args.conn, periods=args.months,
+            scenarios=args.scenarios, processes=args.processes):
+        median = result['percentiles'][50][-1]
+        for (i, wallet) in enumerate(result['wallets']):
+            print('{},{},{:.2f},{:.3f}'.format(user, wallet, median[i],
+                result['overdrawn'][-1][i]))
@@ -0,0 +1,166 @@
+"""
+rollups.py
+
+Totals of the postings to each wallet and account by month and by
+week. The totals are updated as the postings are made so a report
+only reads one total per bucket however many transactions there are.
+
+Updates are appended to rollups.csv and folded into a single row
+per total once enough of them have built up. The totals can be
+rebuilt from the transaction history, e.g. for a backfill.
+"""
+
+import os
+import csv
+import datetime
+from StringIO import StringIO
+
+import durable
+import locks
+from history import History
+
+PERIODS = ['month', 'week']
+
+# the operations that are rolled up
+OPS = ['expense', 'transfer', 'fund']
+
+# appended rows allowed beyond the number of totals before folding
+MIN_COMPACT = 1000
+
+def bucket(period, when):
+    """the name of the bucket of the period a timestamp falls in, e.g.
+    2017-03 or 2017-W09"""
+    day = datetime.datetime.utcfromtimestamp(when).date()
+    if period == 'month':
+        return '{:04d}-{:02d}'.format(day.year, day.month)
+
+    (year, week, weekday) = day.isocalendar()
+    return '{:04d}-W{:02d}'.format(year, week)
+
+class Rollups(object):
+    def __init__(self, conn):
+        self._conn = conn
+        self._data = os.path.join(conn, 'rollups.csv')
+
+        # (period, kind, name) -> {(bucket, op): [cents, count]}
+        self._totals = None
+        self._rows = 0
+        self._size = None
+
+    def add(self, postings, when):
+        """adds (kind, name, cents, op) postings made at a time"""
+        rows = []
+        for (kind, name, cents, op) in postings:
+            if op in OPS:
+                for period in PERIODS:
+                    rows.append([period, bucket(period, when), kind, name,
+                        op, cents, 1])
+
+        if not rows:
+            return
+
+        with locks.write(self._conn):
+            self._load()
+            with open(self._data, 'ab') as f:
+                csv.writer(f).writerows(rows)
+
+            for row in rows:
+                self._apply(self._totals, *row)
+
+            self._rows += len(rows)
+            self._size = os.path.getsize(self._data)
+            if self._rows > self._count() + MIN_COMPACT:
+                self._compact()
+
+    def report(self, period, kind, name):
+        """the totals of a wallet or account for each bucket of the
+        period as a sorted list of (bucket, op, amount, count)"""
+        if period not in PERIODS:
+            raise Exception('Invalid period: {}'.format(period))
+
+        with locks.read(self._conn):
+            self._load()
+
+        totals = self._totals.get((period, kind, name), {})
+        return [(b, op, cents / 100.0, count)
+                for ((b, op), (cents, count)) in sorted(totals.iteritems())]
+
+    def rebuild(self, history):
+        """recomputes every total from the postings in the history"""
+        totals = {}
+        for (t, kind, name, cents, op) in history.postings():
+            if op in OPS:
+                for period in PERIODS:
+                    self._apply(totals, period, bucket(period, t), kind, name,
+                            op, cents, 1)
+
+        with locks.write(self._conn):
+            self._totals = totals
+            self._compact()
+
+    @staticmethod
+    def _apply(totals, period, b, kind, name, op, cents, count):
+        total = totals.setdefault((period, kind, name), {}).setdefault(
+                (b, op), [0, 0])
+        total[0] += cents
+        total[1] += count
+
+    def _count(self):
+        return sum(len(t) for t in self._totals.itervalues())
+
+    def _compact(self):
+        """replaces the appended rows with a single row per total"""
+        rows = []
+        for ((period, kind, name), totals) in sorted(self._totals.iteritems()):
+            for ((b, op), (cents, count)) in sorted(totals.iteritems()):
+                rows.append([period, b, kind, name, op, cents, count])
+
+        f = StringIO()
+        csv.writer(f).writerows(rows)
+        durable.write_file(self._data, f.getvalue())
+
+        self._rows = len(rows)
+        self._size = os.path.getsize(self._data)
+
+    def _load(self):
+        """reads the totals unless they are up to date"""
+        size = 0
+        if os.path.isfile(self._data):
+            size = os.path.getsize(self._data)
+
+        if self._totals is not None and size == self._size:
+            return
+
+        totals = {}
+        rows = 0
+        if size:
+            with open(self._data, 'rb') as f:
+                for row in csv.reader(f):
+                    self._apply(totals, row[0], row[1], row[2], row[3],
+                            row[4], int(row[5]), int(row[6]))
+                    rows += 1
+
+        self._totals = totals
+        self._rows = rows
+        self._size = size
+
+def rebuild(conn):
+    """rebuilds the totals of a user's data directory"""
+    Rollups(conn).rebuild(History(conn))
+
+if __name__ == '__main__':
+    import argparse
+    from layout import iter_users, user_path
+
+    desc = """Rebuilds the monthly and weekly totals of every user in a
+    directory from their transaction history."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('conn', help="Directory holding the user data")
+
+    args = parser.parse_args()
+
+    for user in iter_users(args.conn):
+        path = user_path(args.conn, user)
+        if History(path).started():
+            rebuild(path)
+            print('Rebuilt {}'.format(user))
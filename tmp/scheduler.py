@@ -0,0 +1,569 @@
+"""
+scheduler.py
+
+Runs the funding templates of every user when they are due. The
+frequency of a template is parsed into a recurrence rule and the next
+run of every template of every user is kept in a heap, so finding the
+runs that are due does not mean looking at every template.
+
+The runs that are due are grouped by user and applied as a single
+batch, so a user is loaded and saved once however many of their
+templates are due. Runs that were missed, e.g. while the scheduler
+was stopped, are caught up with one funding of the template times
+the number of runs missed.
+
+The schedule of each user is kept in their schedule.csv, or in their
+database when they are stored in SQLite, and is committed together
+with the fundings it records. fund_all() runs the due templates of
+every user at once over a process pool, e.g. on payday.
+"""
+
+import os
+import re
+import csv
+import time
+import heapq
+import calendar
+import datetime
+from StringIO import StringIO
+from collections import OrderedDict
+
+import durable
+import locks
+from layout import iter_users, user_path
+from storage import DATABASE, flush
+from wallets import stamp
+
+# NOTE(steve): every frequency is a number of days, weeks or months
+# counted from the time the template was first scheduled.
+FREQUENCIES = {
+        'daily': ('day', 1),
+        'weekly': ('week', 1),
+        'fortnightly': ('week', 2),
+        'monthly': ('month', 1),
+        'quarterly': ('month', 3),
+        'yearly': ('month', 12),
+        'annually': ('month', 12)
+        }
+
+EVERY = re.compile(r'^every (\d+) (day|week|month|year)s?$')
+
+# seconds before a user whose runs failed is tried again
+RETRY_DELAY = 60 * 60
+
+# seconds between scans for new and changed templates in run()
+RESCAN_INTERVAL = 60 * 60
+
+# users given to a worker at a time by fund_all()
+FUND_CHUNK = 50
+
+SCHEDULE = 'schedule.csv'
+
+# the files a user's templates are loaded from, see _version()
+TEMPLATE_FILES = ['funding.csv', 'journal.csv', DATABASE]
+
+class Rule(object):
+    __slots__ = ('unit', 'interval')
+
+    def __init__(self, unit, interval):
+        self.unit = unit
+        self.interval = interval
+
+    def __eq__(self, other):
+        return isinstance(other, Rule) and \
+                (self.unit, self.interval) == (other.unit, other.interval)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Rule({!r}, {!r})'.format(self.unit, self.interval)
+
+    def occurrence(self, anchor, n):
+        """the time of the nth run of a schedule starting at anchor.
+        Monthly runs on days a month does not have fall on its last
+        day, e.g. the 31st runs on the 30th in April."""
+        start = datetime.datetime.utcfromtimestamp(anchor)
+        if self.unit == 'day':
+            when = start + datetime.timedelta(days=n * self.interval)
+        elif self.unit == 'week':
+            when = start + datetime.timedelta(weeks=n * self.interval)
+        else:
+            (year, month) = divmod(start.month - 1 + n * self.interval, 12)
+            year += start.year
+            month += 1
+            day = min(start.day, calendar.monthrange(year, month)[1])
+            when = start.replace(year=year, month=month, day=day)
+
+        return calendar.timegm(when.utctimetuple()) + when.microsecond / 1e6
+
+    def per_year(self):
+        """the number of runs in a year"""
+        days = {'day': 365, 'week': 52, 'month': 12}[self.unit]
+        return days // self.interval
+
+def parse(frequency):
+    """the rule of a frequency such as Monthly or every 3 weeks"""
+    text = frequency.strip().lower()
+    if text in FREQUENCIES:
+        return Rule(*FREQUENCIES[text])
+
+    match = EVERY.match(text)
+    if match and int(match.group(1)) > 0:
+        (interval, unit) = (int(match.group(1)), match.group(2))
+        if unit == 'year':
+            (interval, unit) = (interval * 12, 'month')
+        return Rule(unit, interval)
+
+    raise Exception('Invalid frequency: {}'.format(frequency))
+
+class Entry(object):
+    """the schedule of a template. Runs are counted from the anchor and
+    the next run is the one after the runs already made."""
+    __slots__ = ('frequency', 'anchor', 'runs')
+
+    def __init__(self, frequency, anchor, runs):
+        self.frequency = frequency
+        self.anchor = anchor
+        self.runs = runs
+
+    def next_run(self):
+        return parse(self.frequency).occurrence(self.anchor, self.runs)
+
+    def due(self, now):
+        """the number of runs due by now"""
+        rule = parse(self.frequency)
+        n = self.runs
+        while rule.occurrence(self.anchor, n) <= now:
+            n += 1
+
+        return n - self.runs
+
+class Schedule(object):
+    """the schedule of the templates of a user. It is saved like a
+    collection so it can be committed with them, see App.batch()."""
+    def __init__(self, conn):
+        self._data = os.path.join(conn, SCHEDULE)
+        self.entries = {}
+
+        # the templates added by the last sync()
+        self.added = []
+
+        # the version of the file that was loaded, see check()
+        self._stamp = None
+        self._load()
+
+    def _load(self):
+        with locks.read(os.path.dirname(self._data)):
+            if not os.path.isfile(self._data):
+                return
+
+            with open(self._data, 'rb') as f:
+                for (name, frequency, anchor, runs) in csv.reader(f):
+                    self.entries[name] = Entry(frequency, float(anchor),
+                            int(runs))
+            self._stamp = stamp(self._data)
+
+    def sync(self, templates, now, run_new=False):
+        """brings the schedule in line with the templates and returns
+        whether it changed. New templates are first run one period
+        from now, or straight away with run_new. A template whose
+        frequency has changed starts again from its last run. The
+        names of the new templates are kept in added."""
+        self.added = []
+        entries = {}
+        for template in templates:
+            name = template.name()
+            frequency = template.frequency()
+            entry = self.entries.get(name)
+            if entry is None:
+                parse(frequency)
+                entry = Entry(frequency, now, 0 if run_new else 1)
+                self.added.append(name)
+            elif entry.frequency != frequency:
+                parse(frequency)
+                last = parse(entry.frequency).occurrence(entry.anchor,
+                        entry.runs - 1)
+                entry = Entry(frequency, last, 1)
+
+            entries[name] = entry
+
+        changed = set(entries) != set(self.entries) or \
+                any(entries[k] is not self.entries[k] for k in entries)
+        self.entries = entries
+        return changed
+
+    def path(self):
+        return self._data
+
+    def check(self):
+        """raises if the schedule has been replaced since it was loaded"""
+        if self._stamp is not None and stamp(self._data) != self._stamp:
+            msg = '{} has changed since it was loaded'.format(self._data)
+            raise Exception(msg)
+
+    def save(self, path=None):
+        """saves the schedule, or writes it to path when it is given"""
+        f = StringIO()
+        writer = csv.writer(f)
+        for (name, entry) in sorted(self.entries.iteritems()):
+            writer.writerow([name, entry.frequency, repr(entry.anchor),
+                entry.runs])
+
+        with locks.write(os.path.dirname(self._data)):
+            if path is None:
+                self.check()
+
+            durable.write(path or self._data, f.getvalue())
+            if path is None:
+                self.refresh()
+
+    def refresh(self):
+        """records the file on disk as the loaded version"""
+        self._stamp = None
+        if durable.committer.wait and os.path.isfile(self._data):
+            self._stamp = stamp(self._data)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedule (
+    name TEXT PRIMARY KEY,
+    frequency TEXT NOT NULL,
+    anchor REAL NOT NULL,
+    runs INTEGER NOT NULL
+)
+"""
+
+SELECT_ENTRIES = 'SELECT name, frequency, anchor, runs FROM schedule'
+DELETE_ENTRIES = 'DELETE FROM schedule'
+INSERT_ENTRY = ('INSERT INTO schedule (name, frequency, anchor, runs) '
+        'VALUES (?, ?, ?, ?)')
+
+class SqliteSchedule(Schedule):
+    """the schedule of a user stored in SQLite, kept in their database
+    so it is written in the same transaction as their collections"""
+    def __init__(self, db):
+        self._db = db
+        super(SqliteSchedule, self).__init__(db.conn)
+
+    def _load(self):
+        self._db.execute(SCHEMA)
+        for (name, frequency, anchor, runs) in \
+                self._db.execute(SELECT_ENTRIES):
+            self.entries[name] = Entry(frequency, anchor, runs)
+
+    def path(self):
+        return self._db.path
+
+    def check(self):
+        pass
+
+    def save(self, path=None):
+        if path is not None:
+            msg = '{} can only be saved to its database'.format(self._data)
+            raise Exception(msg)
+
+        flush(self._db, [self])
+
+    def refresh(self):
+        pass
+
+    def _flush(self):
+        self._db.execute(DELETE_ENTRIES)
+        self._db.executemany(INSERT_ENTRY,
+                [(name, entry.frequency, entry.anchor, entry.runs)
+                    for (name, entry) in sorted(self.entries.iteritems())])
+
+    def _resync(self):
+        pass
+
+def open_schedule(app):
+    """the schedule of the user of an app, kept where its storage
+    engine keeps their collections"""
+    if app.storage.name == 'sqlite':
+        return SqliteSchedule(app.storage.db)
+
+    return Schedule(app.conn)
+
+def _version(conn):
+    """identifies the version of the files the templates of the user
+    in conn are loaded from. It changes whenever they are saved."""
+    version = []
+    for name in TEMPLATE_FILES:
+        path = os.path.join(conn, name)
+        version.append(stamp(path) if os.path.isfile(path) else None)
+
+    return tuple(version)
+
+def _app_class():
+    from export import _app_class
+    return _app_class()
+
+class Scheduler(object):
+    def __init__(self, conn, clock=time.time, run_new=False):
+        self.conn = conn
+        self.clock = clock
+
+        # NOTE(steve): a template that is not scheduled yet, e.g. of a
+        # new user, is first run one period after it is found. With
+        # run_new it is run as soon as it is found instead.
+        self.run_new = run_new
+
+        # (next_run, user, template) of every template of every user.
+        # Entries that no longer match _scheduled are stale and are
+        # skipped when they come up.
+        self._heap = []
+        self._scheduled = {}
+
+        # user -> version of their template files when last scheduled
+        self._versions = {}
+
+        # (user, error) of the runs that failed
+        self.failures = []
+
+        # (user, template) of the templates added to the schedule
+        self.unscheduled = []
+
+    def load(self):
+        """schedules the templates of every user. Users whose templates
+        have not been saved since they were last scheduled keep their
+        entries without being loaded again."""
+        users = set()
+        for user in iter_users(self.conn):
+            users.add(user)
+            version = _version(user_path(self.conn, user))
+            if self._versions.get(user) != version:
+                self.add_user(user)
+                self._versions[user] = version
+
+        for (user, template) in self._scheduled.keys():
+            if user not in users:
+                del self._scheduled[(user, template)]
+        for user in self._versions.keys():
+            if user not in users:
+                del self._versions[user]
+
+    def add_user(self, user):
+        """schedules the templates of a user, e.g. after they have been
+        changed. Only the templates of the user are loaded and the
+        schedule is only saved when it has changed."""
+        now = self.clock()
+        with locks.write(user_path(self.conn, user)):
+            (app, schedule, changed) = self._open(user, now)
+            if changed:
+                schedule.save()
+
+        for key in self._scheduled.keys():
+            if key[0] == user and key[1] not in schedule.entries:
+                del self._scheduled[key]
+        for (name, entry) in schedule.entries.iteritems():
+            self._push(entry.next_run(), user, name)
+
+    def next_run(self):
+        """the time of the next run, or None when nothing is scheduled"""
+        while self._heap:
+            (when, user, template) = self._heap[0]
+            if self._scheduled.get((user, template)) == when:
+                return when
+            heapq.heappop(self._heap)
+
+        return None
+
+    def run_due(self):
+        """runs the templates that are due and returns the
+        (user, template, times) of the fundings that were made"""
+        now = self.clock()
+        users = OrderedDict()
+        while self._heap and self._heap[0][0] <= now:
+            (when, user, template) = heapq.heappop(self._heap)
+            if self._scheduled.get((user, template)) == when:
+                del self._scheduled[(user, template)]
+                users.setdefault(user, set()).add(template)
+
+        funded = []
+        for (user, templates) in users.iteritems():
+            try:
+                funded.extend(self._run_user(user, templates, now))
+            except Exception as e:
+                self.failures.append((user, e))
+                for template in templates:
+                    self._push(now + RETRY_DELAY, user, template)
+
+        return funded
+
+    def run(self, sleep=time.sleep, stop=lambda: False):
+        """runs the templates as they become due until stop() is set"""
+        scanned = None
+        while not stop():
+            now = self.clock()
+            if scanned is None or now - scanned >= RESCAN_INTERVAL:
+                self.load()
+                scanned = now
+
+            self.run_due()
+
+            wake = scanned + RESCAN_INTERVAL
+            if self.next_run() is not None:
+                wake = min(wake, self.next_run())
+            sleep(max(wake - self.clock(), 0))
+
+    def _open(self, user, now):
+        """the app and synced schedule of a user, and whether syncing
+        changed the schedule. The user is opened in their own mode."""
+        App = _app_class()
+        app = App(user, conn=self.conn)
+        schedule = open_schedule(app)
+        changed = schedule.sync(app.funding_templates.values(), now,
+                self.run_new)
+        self.unscheduled.extend((user, name) for name in schedule.added)
+        return (app, schedule, changed)
+
+    def run_user(self, user):
+        """runs every template of a user that is due"""
+        return self._run_user(user, None, self.clock())
+
+    def _run_user(self, user, templates, now):
+        """funds the due templates of a user, or all of them when
+        templates is None, in a single batch"""
+        with locks.write(user_path(self.conn, user)):
+            (app, schedule, changed) = self._open(user, now)
+            if templates is None:
+                templates = schedule.entries.keys()
+
+            # NOTE(steve): the schedule may have changed since the
+            # entries were pushed, e.g. a template was removed or
+            # another scheduler already ran it.
+            due = []
+            for template in sorted(templates):
+                entry = schedule.entries.get(template)
+                times = entry.due(now) if entry is not None else 0
+                if times:
+                    due.append((template, times))
+
+            # NOTE(steve): the runs are committed in the same step as
+            # the fundings they made, so a crash can not leave a
+            # template funded without its run recorded.
+            if due:
+                with app.batch(schedule):
+                    for (template, times) in due:
+                        app.fund_wallets(template, times)
+                        schedule.entries[template].runs += times
+            elif changed:
+                schedule.save()
+
+        for template in templates:
+            entry = schedule.entries.get(template)
+            if entry is not None:
+                self._push(entry.next_run(), user, template)
+
+        return [(user, template, times) for (template, times) in due]
+
+    def _push(self, when, user, template):
+        if self._scheduled.get((user, template)) != when:
+            self._scheduled[(user, template)] = when
+            heapq.heappush(self._heap, (when, user, template))
+
+def _fund_chunk(job):
+    """runs the due templates of a chunk of users in a worker"""
+    (conn, users, now, run_new) = job
+    scheduler = Scheduler(conn, clock=lambda: now, run_new=run_new)
+    start = time.time()
+    funded, failed = [], []
+    for user in users:
+        try:
+            funded.extend(scheduler.run_user(user))
+        except Exception as e:
+            failed.append((user, str(e)))
+
+    return (os.getpid(), len(users), funded, failed, scheduler.unscheduled,
+            time.time() - start)
+
+def fund_all(conn, processes=None, chunk=FUND_CHUNK, now=None,
+        run_new=False):
+    """runs the due templates of every user in conn over a pool of
+    processes. Every user is loaded and saved once. The time the runs
+    are due by is fixed when the run starts.
+
+    Templates that were not scheduled yet, e.g. in a directory the
+    scheduler has never scanned, are scheduled from now and returned
+    as unscheduled. They are only funded in this run with run_new."""
+    import multiprocessing
+
+    if now is None:
+        now = time.time()
+
+    users = list(iter_users(conn))
+    chunks = [(conn, users[i:i + chunk], now, run_new)
+            for i in range(0, len(users), chunk)]
+
+    pool = None
+    if processes == 1:
+        results = (_fund_chunk(c) for c in chunks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_fund_chunk, chunks)
+
+    start = time.time()
+    funded, failed, unscheduled, workers = [], [], [], {}
+    try:
+        for (pid, n, f, errors, new, seconds) in results:
+            funded.extend(f)
+            failed.extend(errors)
+            unscheduled.extend(new)
+            worker = workers.setdefault(pid, {'users': 0, 'seconds': 0.0})
+            worker['users'] += n
+            worker['seconds'] += seconds
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for worker in workers.itervalues():
+        worker['users_per_second'] = worker['users'] / worker['seconds'] \
+                if worker['seconds'] else 0.0
+
+    return {'users': len(users), 'funded': funded, 'failed': failed,
+            'unscheduled': unscheduled, 'workers': workers,
+            'seconds': time.time() - start}
+
+if __name__ == '__main__':
+    import argparse
+
+    desc = """Runs the funding templates of every user in a directory
+    as they become due."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('conn', help="Directory holding the user data")
+    parser.add_argument('--once', action='store_true',
+                        help="Run the templates that are due and exit")
+    parser.add_argument('--all', action='store_true',
+                        help="Run the due templates of every user over a "
+                        "pool of processes and exit")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Number of worker processes for --all")
+    parser.add_argument('--run-new', action='store_true',
+                        help="Run templates that are not scheduled yet "
+                        "straight away rather than one period later")
+
+    args = parser.parse_args()
+
+    scheduler = Scheduler(args.conn, run_new=args.run_new)
+    if args.all:
+        result = fund_all(args.conn, args.processes, run_new=args.run_new)
+        for (user, error) in result['failed']:
+            print('Failed to fund {}: {}'.format(user, error))
+        for (user, template) in result['unscheduled']:
+            print('Scheduled {} {}'.format(user, template))
+        for (pid, worker) in sorted(result['workers'].iteritems()):
+            print('Worker {}: {} users ({:.0f} users/s)'.format(pid,
+                worker['users'], worker['users_per_second']))
+        print('Funded {} templates of {} users in {:.1f}s'.format(
+            len(result['funded']), result['users'], result['seconds']))
+    elif args.once:
+        scheduler.load()
+        for (user, template, times) in scheduler.run_due():
+            print('Funded {} {} x{}'.format(user, template, times))
+        for (user, error) in scheduler.failures:
+            print('Failed to fund {}: {}'.format(user, error))
+        for (user, template) in scheduler.unscheduled:
+            print('Scheduled {} {}'.format(user, template))
+    else:
+        scheduler.run()
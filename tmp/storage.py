@@ -0,0 +1,476 @@
+"""
+storage.py
+
+Storage engines for a user's collections. An engine opens the
+collections of a user's data directory and commits changes made
+to several of them in a single step.
+
+csv     the csv (or packed) data files, see wallets.py
+memory  collections kept in memory for the life of the process.
+        They are seeded from the data files the first time they
+        are opened.
+sqlite  a SQLite database in the user's data directory. Saving
+        only writes the rows that have changed so its cost does
+        not grow with the size of the collection.
+"""
+
+import os
+import abc
+import copy
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from wallet import Wallet, FundingTemplate, to_cents
+from wallets import Collection, Wallets, Accounts, FundingTemplates
+from wallets import ColumnarWallets, ColumnarAccounts
+from journal import Journal, commit, recover
+
+ENGINES = ['csv', 'memory', 'sqlite']
+
+COLLECTIONS = ['wallets', 'accounts', 'funding_templates']
+
+DATABASE = 'wallets.db'
+
+# seconds to wait for another process to release the database
+TIMEOUT = 30.0
+
+def connect(conn, engine=None, columnar=False):
+    """the storage engine for the user's data directory. The engine
+    is detected from the directory when it is not given."""
+    if engine is None:
+        engine = detect(conn)
+
+    if engine not in ENGINES:
+        raise Exception('Invalid storage: {}'.format(engine))
+
+    if engine == 'csv':
+        return CsvStorage(conn, columnar)
+
+    if columnar:
+        raise Exception('Columnar collections need csv storage')
+
+    if engine == 'memory':
+        return MemoryStorage(conn)
+
+    return SqliteStorage(conn)
+
+def detect(conn):
+    """users that have been moved to SQLite keep their database in
+    their data directory, every other user is stored in csv files"""
+    if os.path.isfile(os.path.join(conn, DATABASE)):
+        return 'sqlite'
+
+    return 'csv'
+
+def copy_user(conn, source, target):
+    """copies the collections of a user from one engine to another,
+    e.g. to move a user with a large number of wallets to sqlite.
+    The data in the source engine is left as it is."""
+    if Journal(conn).size():
+        msg = 'Journal of {} must be compacted before copying'.format(conn)
+        raise Exception(msg)
+
+    source = connect(conn, source)
+    target = connect(conn, target)
+    source.recover()
+    target.recover()
+
+    collections = []
+    for name in COLLECTIONS:
+        c = target.open(name, autosave=False)
+        c.restore(source.open(name, autosave=False).snapshot())
+        collections.append(c)
+
+    target.commit(collections)
+
+class Storage(object):
+    __metaclass__ = abc.ABCMeta
+
+    name = None
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @abc.abstractmethod
+    def open(self, name, autosave=True):
+        """loads the named collection"""
+
+    @abc.abstractmethod
+    def commit(self, collections):
+        """saves the collections in a single step"""
+
+    def recover(self):
+        """completes a commit that was interrupted"""
+        pass
+
+class CsvStorage(Storage):
+    name = 'csv'
+
+    def __init__(self, conn, columnar=False):
+        super(CsvStorage, self).__init__(conn)
+
+        # NOTE(steve): the columnar collections keep balances in
+        # arrays which suits users with a large number of wallets.
+        wallets, accounts = Wallets, Accounts
+        if columnar:
+            wallets, accounts = ColumnarWallets, ColumnarAccounts
+
+        self._classes = {
+                'wallets': wallets,
+                'accounts': accounts,
+                'funding_templates': FundingTemplates
+                }
+
+    def open(self, name, autosave=True):
+        return self._classes[name](self.conn, autosave)
+
+    def commit(self, collections):
+        commit(self.conn, collections)
+
+    def recover(self):
+        recover(self.conn)
+
+# (user directory, data file) -> snapshot of the collection
+_memory = {}
+_memory_lock = threading.Lock()
+
+def clear_memory():
+    """drops every collection held by the memory engine"""
+    with _memory_lock:
+        _memory.clear()
+
+class MemoryCollection(Collection):
+    """saves to a snapshot held in memory rather than to disk"""
+    def _key(self):
+        return (os.path.abspath(os.path.dirname(self._data)),
+                os.path.basename(self._data))
+
+    def _load(self):
+        with _memory_lock:
+            snapshot = _memory.get(self._key())
+
+        # the snapshot loaded or saved last, see unchanged()
+        self._snapshot = snapshot
+        if snapshot is None:
+            super(MemoryCollection, self)._load()
+        else:
+            self.restore(copy.deepcopy(snapshot))
+
+    def save(self, path=None):
+        snapshot = self.snapshot()
+        with _memory_lock:
+            _memory[self._key()] = snapshot
+        self._snapshot = snapshot
+
+    def unchanged(self):
+        with _memory_lock:
+            snapshot = _memory.get(self._key())
+
+        if snapshot is None:
+            return super(MemoryCollection, self).unchanged()
+
+        return snapshot is self._snapshot
+
+class MemoryWallets(MemoryCollection, Wallets):
+    pass
+
+class MemoryAccounts(MemoryCollection, Accounts):
+    pass
+
+class MemoryFundingTemplates(MemoryCollection, FundingTemplates):
+    pass
+
+class MemoryStorage(Storage):
+    name = 'memory'
+
+    _classes = {
+            'wallets': MemoryWallets,
+            'accounts': MemoryAccounts,
+            'funding_templates': MemoryFundingTemplates
+            }
+
+    def open(self, name, autosave=True):
+        return self._classes[name](self.conn, autosave)
+
+    def commit(self, collections):
+        for c in collections:
+            c.save()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS balances (
+    collection TEXT NOT NULL,
+    name TEXT NOT NULL,
+    cents INTEGER NOT NULL,
+    PRIMARY KEY (collection, name)
+);
+CREATE TABLE IF NOT EXISTS templates (
+    name TEXT PRIMARY KEY,
+    amount INTEGER NOT NULL,
+    frequency TEXT NOT NULL,
+    account TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS allocations (
+    template TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    cents INTEGER NOT NULL,
+    PRIMARY KEY (template, wallet)
+);
+"""
+
+# NOTE(steve): rows are kept in insertion order by their rowid.
+# The statements are parameterised so that sqlite3 reuses the
+# prepared statement from its cache each time they are run.
+SELECT_BALANCES = ('SELECT name, cents FROM balances '
+        'WHERE collection = ? ORDER BY rowid')
+INSERT_BALANCE = ('INSERT INTO balances (collection, name, cents) '
+        'VALUES (?, ?, ?)')
+ADJUST_BALANCE = ('UPDATE balances SET cents = cents + ? '
+        'WHERE collection = ? AND name = ?')
+DELETE_BALANCE = 'DELETE FROM balances WHERE collection = ? AND name = ?'
+
+SELECT_TEMPLATES = ('SELECT t.name, t.amount, t.frequency, t.account, '
+        'a.wallet, a.cents FROM templates t '
+        'LEFT JOIN allocations a ON a.template = t.name '
+        'ORDER BY t.rowid, a.rowid')
+SELECT_TEMPLATE_NAMES = 'SELECT name FROM templates'
+INSERT_TEMPLATE = ('INSERT INTO templates (amount, frequency, account, name) '
+        'VALUES (?, ?, ?, ?)')
+UPDATE_TEMPLATE = ('UPDATE templates SET amount = ?, frequency = ?, '
+        'account = ? WHERE name = ?')
+DELETE_TEMPLATE = 'DELETE FROM templates WHERE name = ?'
+INSERT_ALLOCATION = ('INSERT INTO allocations (template, wallet, cents) '
+        'VALUES (?, ?, ?)')
+DELETE_ALLOCATIONS = 'DELETE FROM allocations WHERE template = ?'
+
+class Database(object):
+    """a connection to a user's SQLite database"""
+    def __init__(self, conn):
+        self.conn = conn
+        self.path = os.path.join(conn, DATABASE)
+
+        # NOTE(steve): an App may be handed between threads by the
+        # app cache but is never used by two at once.
+        self._db = sqlite3.connect(self.path, timeout=TIMEOUT,
+                check_same_thread=False)
+        self._db.text_factory = str
+        self._db.executescript(SCHEMA)
+        self._depth = 0
+
+    def execute(self, sql, parameters=()):
+        return self._db.execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self._db.executemany(sql, parameters)
+
+    @contextmanager
+    def transaction(self):
+        """commits the statements run in the block together. Nested
+        blocks join the outermost one."""
+        self._depth += 1
+        try:
+            yield self
+        except Exception:
+            self._depth -= 1
+            if not self._depth:
+                self._db.rollback()
+            raise
+        else:
+            self._depth -= 1
+            if not self._depth:
+                self._db.commit()
+
+    def data_version(self):
+        """a number that changes when another connection commits"""
+        return self._db.execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+def flush(db, collections):
+    """writes the changes to the collections in one transaction. If
+    it fails the collections compare themselves with the database
+    again so the next flush writes everything that is missing."""
+    try:
+        with db.transaction():
+            for c in collections:
+                c._flush()
+    except Exception:
+        for c in collections:
+            c._resync()
+        raise
+
+class SqliteCollection(Collection):
+    """tracks the keys that have changed since the last save"""
+    def __init__(self, db, autosave=True):
+        self._db = db
+        self._touched = OrderedDict()
+        self._removed = set()
+        super(SqliteCollection, self).__init__(db.conn, autosave)
+
+    def path(self):
+        return self._db.path
+
+    def __delitem__(self, key):
+        super(SqliteCollection, self).__delitem__(key)
+        self._touched.pop(key, None)
+        self._removed.add(key)
+
+    def restore(self, snapshot):
+        super(SqliteCollection, self).restore(snapshot)
+        self._removed = set(self._saved) - set(self._items)
+
+    def save(self, path=None):
+        if path is not None:
+            msg = '{} can only be saved to its database'.format(self._data)
+            raise Exception(msg)
+
+        flush(self._db, [self])
+
+    def unchanged(self):
+        # NOTE(steve): commits made through this connection do not
+        # change the data version, only those made by other apps.
+        return self._db.data_version() == self._version
+
+    def _resync(self):
+        self._load_saved()
+        self._touched = OrderedDict((k, None) for k in self._items)
+        self._removed = set(self._saved) - set(self._items)
+
+class SqliteBalances(SqliteCollection):
+    """balances in the balances table. Changes to a balance are
+    written as adjustments so concurrent writers do not lose each
+    other's changes."""
+    def _kind(self):
+        return os.path.splitext(os.path.basename(self._data))[0]
+
+    def _load(self):
+        self._version = self._db.data_version()
+        for (name, cents) in self._db.execute(SELECT_BALANCES,
+                (self._kind(),)):
+            self._insert(name, Wallet.from_cents(cents))
+
+        self._saved = dict(self.snapshot())
+        self._touched = OrderedDict()
+
+    def _load_saved(self):
+        self._saved = dict(self._db.execute(SELECT_BALANCES,
+                (self._kind(),)))
+
+    def __getitem__(self, key):
+        # NOTE(steve): an item can be changed through the reference
+        # that is returned so it is saved if its balance differs.
+        value = super(SqliteBalances, self).__getitem__(key)
+        self._touched[key] = None
+        return value
+
+    def _insert(self, key, value):
+        super(SqliteBalances, self)._insert(key, value)
+        self._touched[key] = None
+
+    def _flush(self):
+        kind = self._kind()
+        for key in self._removed:
+            if key in self._saved:
+                self._db.execute(DELETE_BALANCE, (kind, key))
+                del self._saved[key]
+
+        for key in self._touched:
+            if key not in self._items:
+                continue
+
+            cents = self._items[key].cents()
+            if key not in self._saved:
+                self._db.execute(INSERT_BALANCE, (kind, key, cents))
+            elif cents != self._saved[key]:
+                self._db.execute(ADJUST_BALANCE,
+                        (cents - self._saved[key], kind, key))
+            self._saved[key] = cents
+
+        self._touched = OrderedDict()
+        self._removed = set()
+
+class SqliteWallets(SqliteBalances, Wallets):
+    pass
+
+class SqliteAccounts(SqliteBalances, Accounts):
+    pass
+
+class SqliteFundingTemplates(SqliteCollection, FundingTemplates):
+    """templates in the templates and allocations tables"""
+    def _load(self):
+        self._version = self._db.data_version()
+        for (name, amount, frequency, account, wallet, cents) in \
+                self._db.execute(SELECT_TEMPLATES):
+            template = self._items.get(name)
+            if template is None:
+                template = FundingTemplate(name, amount / 100.0, account,
+                        frequency)
+                self._items[name] = template
+
+            if wallet is not None:
+                template.add_wallet_to_allocation(wallet, cents / 100.0)
+
+        for v in self.values():
+            if not v.valid():
+                raise Exception("Invalid template: {}".format(v))
+            self._attach(v)
+
+        self._saved = set(self._items)
+        self._touched = OrderedDict()
+
+    def _load_saved(self):
+        self._saved = set(name for (name,) in
+                self._db.execute(SELECT_TEMPLATE_NAMES))
+
+    def _attach(self, value):
+        super(SqliteFundingTemplates, self)._attach(value)
+        self._touched[value.name()] = None
+
+    def _flush(self):
+        for name in self._removed:
+            if name in self._saved:
+                self._db.execute(DELETE_ALLOCATIONS, (name,))
+                self._db.execute(DELETE_TEMPLATE, (name,))
+                self._saved.discard(name)
+
+        for name in self._touched:
+            if name not in self._items:
+                continue
+
+            template = self._items[name]
+            row = (to_cents(template.amount()), template.frequency(),
+                    template.account(), name)
+            if name in self._saved:
+                self._db.execute(UPDATE_TEMPLATE, row)
+                self._db.execute(DELETE_ALLOCATIONS, (name,))
+            else:
+                self._db.execute(INSERT_TEMPLATE, row)
+
+            self._db.executemany(INSERT_ALLOCATION,
+                    [(name, k, to_cents(v))
+                        for (k, v) in template.allocation().iteritems()])
+            self._saved.add(name)
+
+        self._touched = OrderedDict()
+        self._removed = set()
+
+class SqliteStorage(Storage):
+    name = 'sqlite'
+
+    _classes = {
+            'wallets': SqliteWallets,
+            'accounts': SqliteAccounts,
+            'funding_templates': SqliteFundingTemplates
+            }
+
+    def __init__(self, conn):
+        super(SqliteStorage, self).__init__(conn)
+        self.db = Database(conn)
+
+    def open(self, name, autosave=True):
+        return self._classes[name](self.db, autosave)
+
+    def commit(self, collections):
+        flush(self.db, collections)
@@ -7,6 +7,7 @@ import unittest
 import os
 
 from app import App
+import layout
 import utils
 
 class AppLoginTestCases(unittest.TestCase):
@@ -32,7 +33,7 @@ class AppLoginTestCases(unittest.TestCase):
         user = 'mary'
         App.create_user(user, conn=self.temp_path)
 
-        path = os.path.join(self.temp_path, user)
+        path = layout.sharded_path(self.temp_path, user)
         self.assertTrue(os.path.isdir(path))
         files = ['accounts.csv','wallets.csv','funding.csv']
         for f in files:
@@ -447,6 +448,37 @@ class AppAddFundingTemplateTestCases(unittest.TestCase):
         msg = 'Funding does not contain template {}.'.format(template)
         self.assertTrue(msg in context.exception)
 
+    def test_fund_wallets_several_times(self):
+        self.app.fund_wallets('salary', 3)
+
+        new_app = App(self.user, self.temp_path)
+        self.assertAlmostEquals(new_app.accounts['bank account'].balance(),
+                11475.0)
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 4100.0)
+        self.assertAlmostEquals(new_app.wallets['shares'].balance(), 7600.0)
+
+    def test_fund_wallets_saves_both_or_neither(self):
+        def fail(path=None):
+            raise IOError('disk full')
+        self.app.wallets.save = fail
+
+        with self.assertRaises(IOError):
+            self.app.fund_wallets('salary')
+
+        new_app = App(self.user, self.temp_path)
+        self.assertAlmostEquals(new_app.accounts['bank account'].balance(),
+                2475.0)
+        self.assertEquals(os.listdir(self.app.conn).count('accounts.csv.new'),
+                0)
+
+    def test_fund_wallets_invalid_times(self):
+        for times in [0, -1, 1.5]:
+            with self.assertRaises(Exception) as context:
+                self.app.fund_wallets('salary', times)
+
+            msg = 'Invalid number of times: {}'.format(times)
+            self.assertTrue(msg in context.exception)
+
     def test_create_existing_funding_template(self):
         template = 'salary'
         with self.assertRaises(Exception) as context:
@@ -595,5 +627,172 @@ class AppUpdateFundingTemplateTestCases(unittest.TestCase):
         self.assertAlmostEquals(update_alloc['savings'], 1250.0)
         self.assertAlmostEquals(update_alloc['shares'], 2750.0)
 
+class AppBatchTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+
+        self.user = 'steve'
+        self.app = App(self.user, conn=self.temp_path)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def data(self, name):
+        with open(os.path.join(self.temp_path, self.user, name), 'rb') as f:
+            return f.read()
+
+    def test_batch_persists_on_exit(self):
+        before = self.data('wallets.csv')
+        with self.app.batch():
+            self.app.add_expense('mobile', 'cash', 50.0)
+            self.app.create_wallet('mortgage', 10.0)
+            self.assertEquals(self.data('wallets.csv'), before)
+
+        new_app = App(self.user, conn=self.temp_path)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+        self.assertAlmostEquals(new_app.wallets['mortgage'].balance(), 10.0)
+        self.assertAlmostEquals(new_app.accounts['cash'].balance(), 275.0)
+
+    def test_batch_rolls_back_on_failure(self):
+        before = self.data('wallets.csv')
+        with self.assertRaises(Exception):
+            with self.app.batch():
+                self.app.add_expense('mobile', 'cash', 50.0)
+                self.app.create_wallet('mortgage', 10.0)
+                self.app.remove_wallet('shares', transfer='savings')
+                self.app.transfer_funds(5000.0, from_acct='savings',
+                        to_acct='mobile', transfer_type='wallet')
+
+        self.assertEquals(self.data('wallets.csv'), before)
+        self.assertEquals(list(self.app.wallets),
+                ['mobile', 'savings', 'shares'])
+        self.assertAlmostEquals(self.app.wallets['mobile'].balance(), 100.0)
+        self.assertAlmostEquals(self.app.wallets.balance(verify=True), 2800.0)
+        self.assertAlmostEquals(self.app.accounts['cash'].balance(), 325.0)
+        alloc = self.app.funding_templates['salary'].allocation()
+        self.assertAlmostEquals(alloc['shares'], 1750.0)
+
+    def test_autosave_restored_after_batch(self):
+        with self.app.batch():
+            pass
+
+        self.app.create_wallet('mortgage', 10.0)
+        new_app = App(self.user, conn=self.temp_path)
+        self.assertTrue('mortgage' in new_app.wallets)
+
+    def test_nested_batch(self):
+        with self.app.batch():
+            self.app.add_expense('mobile', 'cash', 10.0)
+            with self.app.batch():
+                self.app.add_expense('mobile', 'cash', 10.0)
+
+        new_app = App(self.user, conn=self.temp_path)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 80.0)
+
+    def test_apply_operations(self):
+        self.app.apply_operations([
+            ('expense', 'mobile', 'cash', 50.0),
+            ('transfer', 100.0, 'savings', 'shares', 'wallet'),
+            ('fund', 'salary')
+            ])
+
+        new_app = App(self.user, conn=self.temp_path)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 1500.0)
+        self.assertAlmostEquals(new_app.wallets['shares'].balance(), 4200.0)
+        self.assertAlmostEquals(new_app.accounts['bank account'].balance(),
+                5475.0)
+
+    def test_apply_invalid_operation(self):
+        with self.assertRaises(Exception) as context:
+            self.app.apply_operations([
+                ('expense', 'mobile', 'cash', 50.0),
+                ('refund', 'mobile', 'cash', 50.0)
+                ])
+
+        msg = 'Invalid operation: {}'.format('refund')
+        self.assertTrue(msg in context.exception)
+        self.assertAlmostEquals(self.app.wallets['mobile'].balance(), 100.0)
+
+    def test_journaled_batch_appends_records(self):
+        app = App(self.user, conn=self.temp_path, journaled=True)
+        app.apply_operations([
+            ('expense', 'mobile', 'cash', 50.0),
+            ('fund', 'salary')
+            ])
+
+        self.assertEquals(len(list(app.journal)), 2)
+        new_app = App(self.user, conn=self.temp_path, journaled=True)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+        self.assertAlmostEquals(new_app.accounts['cash'].balance(), 275.0)
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 1600.0)
+
+    def test_journaled_batch_rolls_back(self):
+        app = App(self.user, conn=self.temp_path, journaled=True)
+        with self.assertRaises(Exception):
+            app.apply_operations([
+                ('expense', 'mobile', 'cash', 50.0),
+                ('fund', 'bonus')
+                ])
+
+        self.assertEquals(list(app.journal), [])
+        self.assertAlmostEquals(app.wallets['mobile'].balance(), 100.0)
+
+class AppLazyLoadingTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+
+        self.user = 'steve'
+        self.conn = os.path.join(self.temp_path, self.user)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_collections_load_on_first_access(self):
+        app = App(self.user, conn=self.temp_path)
+        os.remove(os.path.join(self.conn, 'funding.csv'))
+
+        app.add_expense('mobile', 'cash', 50.0)
+        self.assertAlmostEquals(app.wallets['mobile'].balance(), 50.0)
+
+        with self.assertRaises(IOError):
+            app.funding_templates
+
+    def test_preload_named_collections(self):
+        app = App(self.user, conn=self.temp_path)
+        app.preload('wallets')
+        os.remove(os.path.join(self.conn, 'wallets.csv'))
+        os.remove(os.path.join(self.conn, 'accounts.csv'))
+
+        self.assertEquals(len(app.wallets), 3)
+        with self.assertRaises(IOError):
+            app.accounts
+
+    def test_preload_all_collections(self):
+        app = App(self.user, conn=self.temp_path)
+        app.preload()
+        for f in ['accounts.csv', 'wallets.csv', 'funding.csv']:
+            os.remove(os.path.join(self.conn, f))
+
+        self.assertEquals(len(app.accounts), 2)
+        self.assertEquals(len(app.funding_templates), 1)
+
+    def test_journaled_app_loads_every_collection(self):
+        app = App(self.user, conn=self.temp_path, journaled=True)
+        app.wallets
+        os.remove(os.path.join(self.conn, 'funding.csv'))
+
+        self.assertEquals(len(app.funding_templates), 1)
+
+    def test_batch_drops_collections_loaded_during_failed_batch(self):
+        app = App(self.user, conn=self.temp_path)
+        with self.assertRaises(Exception):
+            with app.batch():
+                app.add_expense('mobile', 'cash', 50.0)
+                app.fund_wallets('bonus')
+
+        self.assertAlmostEquals(app.wallets['mobile'].balance(), 100.0)
+        self.assertAlmostEquals(app.accounts['cash'].balance(), 325.0)
+
 if __name__ == '__main__':
     unittest.main()
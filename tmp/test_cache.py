@@ -0,0 +1,164 @@
+"""
+A set of tests for the cache module
+"""
+
+import unittest
+
+import threading
+
+from app import App
+from cache import AppCache
+import utils
+
+class AppCacheTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+        self.cache = AppCache(maxsize=2)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_second_get_is_a_hit(self):
+        app = self.cache.get(self.user, self.temp_path)
+
+        self.assertTrue(self.cache.get(self.user, self.temp_path) is app)
+        self.assertEquals(self.cache.misses, 1)
+        self.assertEquals(self.cache.hits, 1)
+        self.assertAlmostEquals(self.cache.stats()['hit_rate'], 0.5)
+
+    def test_options_are_cached_separately(self):
+        app = self.cache.get(self.user, self.temp_path)
+        journaled = self.cache.get(self.user, self.temp_path, journaled=True)
+
+        self.assertFalse(app is journaled)
+        self.assertEquals(len(self.cache), 2)
+
+    def test_changes_through_cached_app_keep_entry(self):
+        app = self.cache.get(self.user, self.temp_path)
+        app.create_wallet('mortgage', 10.0)
+
+        self.assertTrue(self.cache.get(self.user, self.temp_path) is app)
+        self.assertEquals(self.cache.invalidations, 0)
+
+    def test_changes_by_another_writer_invalidate_entry(self):
+        app = self.cache.get(self.user, self.temp_path)
+        app.wallets
+
+        other = App(self.user, self.temp_path)
+        other.create_wallet('mortgage', 10.0)
+
+        new_app = self.cache.get(self.user, self.temp_path)
+        self.assertFalse(new_app is app)
+        self.assertTrue('mortgage' in new_app.wallets)
+        self.assertEquals(self.cache.invalidations, 1)
+
+    def test_unsaved_changes_do_not_hide_another_writer(self):
+        app = self.cache.get(self.user, self.temp_path)
+        app.add_expense('mobile', 'cash', 10.0)
+
+        other = App(self.user, self.temp_path)
+        other.create_wallet('mortgage', 10.0)
+
+        new_app = self.cache.get(self.user, self.temp_path)
+        self.assertFalse(new_app is app)
+        self.assertTrue('mortgage' in new_app.wallets)
+
+        # the reloaded app can save over the other writer's files
+        new_app.create_wallet('car', 5.0)
+        self.assertTrue('car' in App(self.user, self.temp_path).wallets)
+
+    def test_saved_changes_keep_entry(self):
+        app = self.cache.get(self.user, self.temp_path)
+        app.add_expense('mobile', 'cash', 10.0)
+
+        self.assertTrue(self.cache.get(self.user, self.temp_path) is app)
+        self.assertAlmostEquals(App(self.user, self.temp_path).wallets[
+            'mobile'].balance(), 90.0)
+
+    def test_unsaved_changes_invalidate_entry(self):
+        app = self.cache.get(self.user, self.temp_path)
+        def fail(path=None):
+            raise IOError('disk full')
+        app.wallets.save = fail
+
+        with self.assertRaises(IOError):
+            app.add_expense('mobile', 'cash', 10.0)
+        self.assertAlmostEquals(app.wallets['mobile'].balance(), 90.0)
+
+        new_app = self.cache.get(self.user, self.temp_path)
+        self.assertFalse(new_app is app)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 100.0)
+        self.assertEquals(self.cache.invalidations, 1)
+
+    def test_failed_batch_keeps_entry(self):
+        app = self.cache.get(self.user, self.temp_path)
+        with self.assertRaises(Exception):
+            with app.batch():
+                app.add_expense('mobile', 'cash', 10.0)
+                app.add_expense('captain', 'cash', 10.0)
+
+        self.assertTrue(self.cache.get(self.user, self.temp_path) is app)
+
+    def test_sqlite_writer_invalidates_entry(self):
+        app = self.cache.get(self.user, self.temp_path, storage='sqlite')
+        app.create_wallet('mortgage', 10.0)
+        self.assertTrue(self.cache.get(self.user, self.temp_path,
+            storage='sqlite') is app)
+
+        other = App(self.user, self.temp_path, storage='sqlite')
+        other.create_wallet('car', 5.0)
+
+        new_app = self.cache.get(self.user, self.temp_path, storage='sqlite')
+        self.assertFalse(new_app is app)
+        self.assertTrue('car' in new_app.wallets)
+
+    def test_checkout_holds_entry(self):
+        with self.cache.checkout(self.user, self.temp_path) as app:
+            app.create_wallet('mortgage', 10.0)
+            (entry, lock) = self.cache._entries.values()[0]
+            self.assertTrue(entry is app)
+
+            # another thread has to wait for the block to end
+            acquired = []
+            thread = threading.Thread(
+                    target=lambda: acquired.append(lock.acquire(False)))
+            thread.start()
+            thread.join()
+            self.assertEquals(acquired, [False])
+
+        with self.cache.checkout(self.user, self.temp_path) as new_app:
+            self.assertTrue(new_app is app)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        App.create_user('mary', conn=self.temp_path)
+        App.create_user('john', conn=self.temp_path)
+
+        steve = self.cache.get('steve', self.temp_path)
+        self.cache.get('mary', self.temp_path)
+        self.cache.get('steve', self.temp_path)
+        self.cache.get('john', self.temp_path)
+
+        self.assertEquals(self.cache.evictions, 1)
+        self.assertTrue(self.cache.get('steve', self.temp_path) is steve)
+        self.assertEquals(self.cache.stats()['misses'], 3)
+
+    def test_invalidate(self):
+        app = self.cache.get(self.user, self.temp_path)
+        self.cache.invalidate(self.user, self.temp_path)
+
+        self.assertFalse(self.cache.get(self.user, self.temp_path) is app)
+        self.assertEquals(self.cache.invalidations, 1)
+
+    def test_removed_user(self):
+        self.cache.get(self.user, self.temp_path)
+        App.remove_user(self.user, conn=self.temp_path)
+
+        with self.assertRaises(Exception) as context:
+            self.cache.get(self.user, self.temp_path)
+
+        msg = 'User {} does not exist'.format(self.user)
+        self.assertTrue(msg in context.exception)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+A set of tests for the durable module
+"""
+
+import unittest
+
+import os
+import shutil
+import tempfile
+import threading
+
+import durable
+
+class WriteFileTestCases(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.data = os.path.join(self.path, 'wallets.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read(self):
+        with open(self.data, 'rb') as f:
+            return f.read()
+
+    def test_write_file_replaces_contents(self):
+        durable.write_file(self.data, 'mobile,100.0\r\n')
+        durable.write_file(self.data, 'savings,350.0\r\n')
+
+        self.assertEquals(self.read(), 'savings,350.0\r\n')
+        self.assertEquals(os.listdir(self.path), ['wallets.csv'])
+
+    def test_failed_write_keeps_original(self):
+        durable.write_file(self.data, 'mobile,100.0\r\n')
+        os.mkdir(self.data + '.tmp')
+
+        with self.assertRaises(IOError):
+            durable.write_file(self.data, 'savings,350.0\r\n')
+
+        self.assertEquals(self.read(), 'mobile,100.0\r\n')
+
+class GroupCommitterTestCases(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read(self, name):
+        with open(os.path.join(self.path, name), 'rb') as f:
+            return f.read()
+
+    def test_write_waits_for_commit(self):
+        committer = durable.GroupCommitter()
+        committer.write(os.path.join(self.path, 'a'), 'data')
+
+        self.assertEquals(self.read('a'), 'data')
+        self.assertEquals(committer.stats()['batches'], 1)
+
+    def test_writes_in_window_are_coalesced(self):
+        committer = durable.GroupCommitter(window=0.05, wait=False)
+        for i in range(10):
+            committer.write(os.path.join(self.path, 'a'), str(i))
+        committer.write(os.path.join(self.path, 'b'), 'b')
+        committer.flush()
+
+        self.assertEquals(self.read('a'), '9')
+        self.assertEquals(self.read('b'), 'b')
+
+        stats = committer.stats()
+        self.assertEquals(stats['writes'], 11)
+        self.assertEquals(stats['coalesced'], 9)
+        self.assertEquals(stats['batches'], 1)
+        self.assertEquals(stats['largest_batch'], 2)
+
+    def test_concurrent_writers_share_batches(self):
+        committer = durable.GroupCommitter(window=0.02)
+        def write(i):
+            committer.write(os.path.join(self.path, str(i)), str(i))
+
+        threads = [threading.Thread(target=write, args=(i,))
+                for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for i in range(8):
+            self.assertEquals(self.read(str(i)), str(i))
+        self.assertTrue(committer.stats()['batches'] < 8)
+
+    def test_failed_commit_raises(self):
+        committer = durable.GroupCommitter()
+        path = os.path.join(self.path, 'missing', 'a')
+
+        with self.assertRaises(IOError):
+            committer.write(path, 'data')
+
+        self.assertEquals(committer.stats()['failures'], 1)
+
+    def test_flush_without_writes(self):
+        committer = durable.GroupCommitter()
+        committer.flush()
+
+        self.assertEquals(committer.stats()['batches'], 0)
+
+    def test_stop_commits_and_ends_thread(self):
+        committer = durable.GroupCommitter(window=0.05, wait=False)
+        committer.write(os.path.join(self.path, 'a'), 'data')
+        thread = committer._thread
+        committer.stop()
+
+        self.assertEquals(self.read('a'), 'data')
+        self.assertFalse(thread.is_alive())
+
+        committer.write(os.path.join(self.path, 'b'), 'b')
+        committer.flush()
+        self.assertEquals(self.read('b'), 'b')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+A set of tests for the export module
+"""
+
+import unittest
+
+import os
+import csv
+import gzip
+import json
+import zlib
+
+from app import App
+import export
+import utils
+
+class ExportTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.output = os.path.join(self.temp_path, 'export.jsonl')
+        App.create_user('mary', conn=self.temp_path)
+        app = App('mary', conn=self.temp_path)
+        app.create_wallet('mobile', 20.0)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def read(self, path, opener=open):
+        with opener(path, 'rb') as f:
+            return [json.loads(l) for l in f]
+
+    def test_records(self):
+        records = list(export.records(self.temp_path))
+
+        self.assertEquals([r['user'] for r in records],
+                ['steve'] * 7 + ['mary'])
+        self.assertEquals(records[-1], {'user': 'mary', 'type': 'wallet',
+            'name': 'mobile', 'amount': 20.0})
+        self.assertEquals(records[-2]['wallet'], 'shares')
+        self.assertEquals(records[-2]['allocation'], 1750.0)
+
+    def test_records_replay_journal(self):
+        app = App('steve', conn=self.temp_path, journaled=True)
+        app.add_expense('mobile', 'cash', 50.0)
+
+        records = export.records(self.temp_path, ['steve'])
+        self.assertEquals(next(records)['amount'], 50.0)
+
+    def test_records_do_not_compact(self):
+        app = App('steve', conn=self.temp_path, journaled=True,
+                autocompact=False)
+        with app.batch():
+            for i in range(app.journal.max_records):
+                app.add_expense('mobile', 'cash', 0.01)
+        size = app.journal.size()
+
+        records = list(export.records(self.temp_path, ['steve']))
+        self.assertEquals(records[0]['amount'], 90.0)
+        self.assertEquals(app.journal.size(), size)
+
+    def test_unicode_user_name(self):
+        App.create_user(u'zo\xeb', conn=self.temp_path)
+        App(u'zo\xeb', conn=self.temp_path).create_wallet('mobile', 5.0)
+
+        records = list(export.records(self.temp_path, [u'zo\xeb']))
+        self.assertEquals(records[0]['user'], 'zo\xc3\xab')
+        self.assertEquals(export.shard(u'zo\xeb', 4),
+                export.shard('zo\xc3\xab', 4))
+
+        output = os.path.join(self.temp_path, 'export.csv')
+        export.export(self.temp_path, output, 'csv', users=[u'zo\xeb'])
+        with open(output, 'rb') as f:
+            self.assertEquals(list(csv.reader(f))[1][:3],
+                    ['zo\xc3\xab', 'wallet', 'mobile'])
+
+    def test_records_are_generated_lazily(self):
+        records = export.records(self.temp_path, ['mary', 'john'])
+        self.assertEquals(next(records)['user'], 'mary')
+
+        with self.assertRaises(Exception) as context:
+            next(records)
+
+        self.assertTrue('User john does not exist' in context.exception)
+
+    def test_export_jsonl(self):
+        n = export.export(self.temp_path, self.output)
+
+        self.assertEquals(n, 8)
+        records = self.read(self.output)
+        self.assertEquals(records[-1]['name'], 'mobile')
+        self.assertEquals(records[-1]['user'], 'mary')
+
+    def test_export_csv(self):
+        path = os.path.join(self.temp_path, 'export.csv')
+        export.export(self.temp_path, path, format='csv')
+
+        with open(path, 'rb') as f:
+            rows = list(csv.DictReader(f))
+
+        self.assertEquals(len(rows), 8)
+        self.assertEquals(rows[-2]['frequency'], 'Monthly')
+        self.assertEquals(rows[0]['account'], '')
+
+    def test_export_gzip(self):
+        path = self.output + '.gz'
+        export.export(self.temp_path, path, gzipped=True)
+
+        self.assertEquals(len(self.read(path, gzip.open)), 8)
+
+    def test_export_shards(self):
+        path = os.path.join(self.temp_path, 'export.csv.gz')
+        export.export(self.temp_path, path, format='csv', gzipped=True,
+                shards=4)
+
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.temp_path, 'export-003.csv.gz')))
+
+        users = {}
+        for i in range(4):
+            shard = export.shard_path(path, i, 4)
+            with gzip.open(shard, 'rb') as f:
+                for row in csv.DictReader(f):
+                    users.setdefault(row['user'], set()).add(i)
+
+        self.assertEquals(users, {
+            'mary': set([export.shard('mary', 4)]),
+            'steve': set([export.shard('steve', 4)])
+            })
+
+    def test_compress_stream(self):
+        lines = export.lines(export.records(self.temp_path), 'jsonl')
+        data = ''.join(export.compress(lines))
+
+        text = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        self.assertEquals(len(text.splitlines()), 8)
+
+    def test_invalid_format(self):
+        with self.assertRaises(Exception) as context:
+            export.export(self.temp_path, self.output, format='xml')
+
+        msg = 'Invalid format: {}'.format('xml')
+        self.assertTrue(msg in context.exception)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+"""
+A set of tests for the history module
+"""
+
+import unittest
+
+import datetime
+import calendar
+
+from app import App
+import history
+import utils
+
+DAY = 24 * 60 * 60
+
+class Clock(object):
+    """a clock that only moves when it is told to"""
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class HistoryTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+        self.start = calendar.timegm(datetime.date(2017, 3, 1).timetuple())
+        self.clock = Clock(self.start + 9 * 60 * 60)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def app(self, **options):
+        return App(self.user, conn=self.temp_path, history=True,
+                clock=self.clock, **options)
+
+    def test_opening_balances(self):
+        app = self.app()
+
+        self.assertAlmostEquals(app.history.balance('wallet', 'mobile'), 100.0)
+        self.assertAlmostEquals(app.history.balance('account', 'cash',
+            datetime.date(2017, 3, 1)), 325.0)
+
+    def test_balance_as_of_date(self):
+        app = self.app()
+        app.history.interval = 4
+        for day in range(10):
+            self.clock.advance(DAY)
+            app.add_expense('mobile', 'cash', 5.0)
+
+        h = app.history
+        self.assertAlmostEquals(h.balance('wallet', 'mobile'), 50.0)
+        self.assertAlmostEquals(h.balance('wallet', 'mobile',
+            datetime.date(2017, 3, 1)), 100.0)
+        self.assertAlmostEquals(h.balance('wallet', 'mobile',
+            datetime.date(2017, 3, 4)), 85.0)
+        self.assertAlmostEquals(h.balance('account', 'cash',
+            datetime.datetime(2017, 3, 11, 8)), 280.0)
+        self.assertAlmostEquals(h.balance('account', 'cash',
+            self.clock.now), 275.0)
+
+        # one opening checkpoint and one every four postings
+        self.assertEquals(len(h._index), 6)
+
+    def test_balance_before_history(self):
+        app = self.app()
+
+        with self.assertRaises(Exception) as context:
+            app.history.balance('wallet', 'mobile',
+                    datetime.date(2017, 2, 28))
+
+        msg = 'No history before 2017-02-28 23:59:59.999999'
+        self.assertTrue(msg in context.exception)
+
+    def test_history_is_kept_between_apps(self):
+        app = self.app()
+        app.history.interval = 2
+        app.fund_wallets('salary')
+        self.clock.advance(DAY)
+        app.remove_wallet('shares', 'savings')
+
+        self.clock.advance(DAY)
+        new_app = self.app()
+        new_app.history.interval = 2
+        new_app.transfer_funds(100.0, 'savings', 'mobile', 'wallet')
+
+        h = self.app().history
+        self.assertAlmostEquals(h.balance('wallet', 'shares'), 0.0)
+        self.assertAlmostEquals(h.balance('wallet', 'savings'), 5600.0)
+        self.assertAlmostEquals(h.balance('wallet', 'shares',
+            datetime.date(2017, 3, 1)), 4100.0)
+        self.assertEquals(h.balances(datetime.date(2017, 3, 2)), {
+            ('wallet', 'mobile'): 100.0,
+            ('wallet', 'savings'): 5700.0,
+            ('account', 'cash'): 325.0,
+            ('account', 'bank account'): 5475.0
+            })
+
+    def test_postings_in_range(self):
+        app = self.app()
+        for day in range(5):
+            self.clock.advance(DAY)
+            app.add_expense('mobile', 'cash', 1.0 + day)
+
+        postings = list(app.history.postings(datetime.date(2017, 3, 3),
+            datetime.date(2017, 3, 4)))
+        self.assertEquals([(k, n, c) for (t, k, n, c, op) in postings], [
+            ('wallet', 'mobile', -200), ('account', 'cash', -200),
+            ('wallet', 'mobile', -300), ('account', 'cash', -300)])
+        self.assertEquals(postings[0][4], 'expense')
+
+    def test_batch_posts_on_commit(self):
+        app = self.app()
+        with self.assertRaises(Exception):
+            app.apply_operations([
+                ('fund', 'salary'),
+                ('transfer', 10000.0, 'cash', 'bank account', 'account')
+                ])
+
+        self.assertEquals(list(app.history.postings()), [])
+
+        app.apply_operations([('fund', 'salary'), ('fund', 'salary')])
+        self.assertEquals(len(list(app.history.postings())), 6)
+        self.assertAlmostEquals(app.history.balance('wallet', 'savings'),
+                2850.0)
+
+    def test_failed_save_is_not_posted(self):
+        app = self.app()
+        def fail(path=None):
+            raise IOError('disk full')
+        app.wallets.save = fail
+
+        with self.assertRaises(IOError):
+            app.fund_wallets('salary')
+
+        self.assertEquals(list(app.history.postings()), [])
+        self.assertAlmostEquals(app.history.balance('wallet', 'savings'),
+                350.0)
+
+    def test_history_matches_saved_balances(self):
+        app = self.app()
+        app.add_expense('mobile', 'cash', 10.0)
+        app.transfer_funds(5.0, 'mobile', 'shares', 'wallet')
+
+        new_app = self.app()
+        for (kind, name) in [('wallet', 'mobile'), ('wallet', 'savings'),
+                ('wallet', 'shares'), ('account', 'cash'),
+                ('account', 'bank account')]:
+            collection = new_app.wallets if kind == 'wallet' else \
+                    new_app.accounts
+            self.assertAlmostEquals(new_app.history.balance(kind, name),
+                    collection[name].balance())
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 85.0)
+        self.assertEquals(new_app.rollups.report('month', 'wallet',
+            'mobile'), [('2017-03', 'expense', -10.0, 1),
+                ('2017-03', 'transfer', -5.0, 1)])
+
+    def test_journal_replay_is_not_posted(self):
+        app = self.app(journaled=True)
+        app.add_expense('mobile', 'cash', 50.0)
+
+        new_app = self.app(journaled=True)
+        new_app.preload()
+        self.assertEquals(len(list(new_app.history.postings())), 2)
+        self.assertAlmostEquals(new_app.history.balance('wallet', 'mobile'),
+                50.0)
+
+    def test_clock_does_not_run_backwards(self):
+        app = self.app()
+        app.add_expense('mobile', 'cash', 5.0)
+        self.clock.advance(-DAY)
+        app.add_expense('mobile', 'cash', 5.0)
+
+        times = [p[0] for p in app.history.postings()]
+        self.assertEquals(times, sorted(times))
+
+    def test_timestamp_of_date(self):
+        t = history.timestamp(datetime.date(2017, 3, 1))
+        self.assertTrue(self.start + DAY - 1 < t < self.start + DAY)
+
+if __name__ == '__main__':
+    unittest.main()
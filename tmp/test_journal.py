@@ -0,0 +1,233 @@
+"""
+A set of tests for the journal module
+"""
+
+import unittest
+
+import os
+
+from app import App
+from journal import Journal
+import utils
+
+class JournalTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.conn = os.path.join(self.temp_path, 'steve')
+        self.journal = Journal(self.conn)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_empty_journal(self):
+        self.assertEquals(list(self.journal), [])
+
+    def test_append_records(self):
+        self.journal.append('expense', 'mobile', 'cash', 50.0)
+        self.journal.append('transfer', 'wallet', 'savings', 'shares', 10.0)
+
+        records = list(Journal(self.conn))
+        self.assertEquals(len(records), 2)
+        self.assertEquals(records[0], ['expense', 'mobile', 'cash', '50.0'])
+
+class JournaledAppTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+        self.app = App(self.user, conn=self.temp_path, journaled=True)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def reload(self):
+        return App(self.user, conn=self.temp_path, journaled=True)
+
+    def snapshot(self, name):
+        with open(os.path.join(self.temp_path, self.user, name), 'rb') as f:
+            return f.read()
+
+    def test_create_wallet_does_not_rewrite_snapshot(self):
+        before = self.snapshot('wallets.csv')
+        self.app.create_wallet('mortgage', 10.0)
+
+        self.assertEquals(self.snapshot('wallets.csv'), before)
+        self.assertAlmostEquals(self.reload().wallets['mortgage'].balance(),
+                10.0)
+
+    def test_create_account_persists(self):
+        self.app.create_account('joint account', 100.0)
+
+        new_app = self.reload()
+        self.assertEquals(len(new_app.accounts), 3)
+        self.assertAlmostEquals(new_app.accounts['joint account'].balance(),
+                100.0)
+
+    def test_expense_persists(self):
+        self.app.add_expense('mobile', 'cash', 50.0)
+
+        new_app = self.reload()
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+        self.assertAlmostEquals(new_app.accounts['cash'].balance(), 275.0)
+
+    def test_transfer_persists(self):
+        self.app.transfer_funds(200, from_acct='savings',
+                to_acct='shares', transfer_type='wallet')
+
+        new_app = self.reload()
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 150.0)
+        self.assertAlmostEquals(new_app.wallets['shares'].balance(), 2550.0)
+
+    def test_fund_wallets_does_not_rewrite_snapshot(self):
+        before = self.snapshot('accounts.csv')
+        self.app.fund_wallets('salary')
+
+        self.assertEquals(self.snapshot('accounts.csv'), before)
+        new_app = self.reload()
+        self.assertAlmostEquals(new_app.accounts['bank account'].balance(),
+                5475.0)
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 1600.0)
+
+    def test_fund_replays_amounts_applied(self):
+        self.app.fund_wallets('salary')
+        self.app.update_funding_template('salary', 4000.0, 'bank account',
+                'Monthly', {'savings': 2250.0, 'shares': 1750.0})
+
+        new_app = self.reload()
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 1600.0)
+        funding = new_app.funding_templates['salary']
+        self.assertAlmostEquals(funding.amount(), 4000.0)
+
+    def test_create_funding_template_persists(self):
+        self.app.create_funding_template('wife', 1000.0, 'bank account',
+                'Monthly', {'mobile': 100.0, 'savings': 900.0})
+
+        new_app = self.reload()
+        self.assertTrue('wife' in new_app.funding_templates)
+        alloc = new_app.funding_templates['wife'].allocation()
+        self.assertAlmostEquals(alloc['savings'], 900.0)
+
+    def test_remove_wallet_persists(self):
+        self.app.remove_wallet('shares', transfer='savings')
+
+        new_app = self.reload()
+        self.assertTrue('shares' not in new_app.wallets)
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 2700.0)
+        alloc = new_app.funding_templates['salary'].allocation()
+        self.assertAlmostEquals(alloc['savings'], 3000.0)
+
+    def test_failed_operation_is_not_logged(self):
+        with self.assertRaises(Exception):
+            self.app.add_expense('captain', 'cash', 50.0)
+
+        self.assertEquals(list(self.app.journal), [])
+
+class CompactionTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+        self.conn = os.path.join(self.temp_path, self.user)
+        self.app = App(self.user, conn=self.temp_path, journaled=True)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def reload(self):
+        return App(self.user, conn=self.temp_path, journaled=True)
+
+    def test_compact_folds_journal_into_snapshot(self):
+        self.app.add_expense('mobile', 'cash', 50.0)
+        self.app.compact()
+
+        self.assertEquals(len(self.app.journal), 0)
+        self.assertEquals(self.app.journal.size(), 0)
+
+        new_app = App(self.user, conn=self.temp_path)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+        self.assertAlmostEquals(new_app.accounts['cash'].balance(), 275.0)
+
+    def test_compaction_triggered_by_record_count(self):
+        self.app.journal.max_records = 2
+        self.app.add_expense('mobile', 'cash', 10.0)
+        self.assertEquals(len(self.app.journal), 1)
+
+        self.app.add_expense('mobile', 'cash', 10.0)
+        self.assertEquals(len(self.app.journal), 0)
+        self.assertAlmostEquals(self.reload().wallets['mobile'].balance(),
+                80.0)
+
+    def test_compaction_triggered_by_size(self):
+        self.app.journal.max_bytes = 1
+        self.app.add_expense('mobile', 'cash', 10.0)
+
+        self.assertEquals(self.app.journal.size(), 0)
+        self.assertAlmostEquals(self.reload().wallets['mobile'].balance(),
+                90.0)
+
+    def test_loading_without_autocompact(self):
+        self.app.add_expense('mobile', 'cash', 10.0)
+        size = self.app.journal.size()
+
+        reader = App(self.user, conn=self.temp_path, autocompact=False)
+        reader.journal.max_bytes = 1
+        reader.preload()
+
+        self.assertEquals(reader.journal.size(), size)
+        self.assertAlmostEquals(reader.wallets['mobile'].balance(), 90.0)
+
+    def test_recover_interrupted_checkpoint(self):
+        self.app.add_expense('mobile', 'cash', 50.0)
+
+        # stage the snapshot and commit the checkpoint marker
+        # without renaming the files or truncating the journal.
+        collections = [self.app.wallets, self.app.accounts,
+                self.app.funding_templates]
+        for c in collections:
+            c.save(c.path() + '.new')
+        open(os.path.join(self.conn, 'journal.csv.new'), 'wb').close()
+        with open(os.path.join(self.conn, 'checkpoint'), 'wb') as f:
+            f.write('\n'.join(['wallets.csv', 'accounts.csv',
+                'funding.csv', 'journal.csv']))
+
+        new_app = self.reload()
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+        self.assertAlmostEquals(new_app.accounts['cash'].balance(), 275.0)
+        self.assertEquals(len(new_app.journal), 0)
+        self.assertFalse(os.path.isfile(os.path.join(self.conn,
+            'checkpoint')))
+
+    def test_discard_uncommitted_snapshot(self):
+        self.app.add_expense('mobile', 'cash', 50.0)
+        self.app.wallets.save(self.app.wallets.path() + '.new')
+
+        new_app = self.reload()
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+        self.assertFalse(os.path.isfile(os.path.join(self.conn,
+            'wallets.csv.new')))
+
+    def test_user_with_journal_is_opened_journaled(self):
+        self.app.create_wallet('mortgage', 10.0)
+
+        app = App(self.user, conn=self.temp_path)
+        self.assertTrue(app.journal is not None)
+        self.assertAlmostEquals(app.wallets['mortgage'].balance(), 10.0)
+
+        # the change is journaled rather than saved to the snapshot
+        app.fund_wallets('salary')
+        new_app = self.reload()
+        self.assertAlmostEquals(new_app.wallets['mortgage'].balance(), 10.0)
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 1600.0)
+
+        # once compacted the user is opened without a journal again
+        new_app.compact()
+        self.assertTrue(App(self.user, conn=self.temp_path).journal is None)
+
+    def test_compact_app_without_journal(self):
+        app = App(self.user, conn=self.temp_path)
+        with self.assertRaises(Exception) as context:
+            app.compact()
+
+        msg = 'Only a journaled app can be compacted'
+        self.assertTrue(msg in context.exception)
+
+if __name__ == '__main__':
+    unittest.main()
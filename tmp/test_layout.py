@@ -0,0 +1,96 @@
+"""
+A set of tests for the layout module
+"""
+
+import unittest
+
+import os
+
+from app import App
+import layout
+import utils
+
+class LayoutTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_sharded_path(self):
+        (a, b) = layout.shard('mary')
+        path = layout.sharded_path(self.temp_path, 'mary')
+
+        self.assertEquals(path, os.path.join(self.temp_path, layout.SHARDS,
+            a, b, 'mary'))
+        self.assertEquals(len(a + b), 4)
+
+    def test_unicode_user_name(self):
+        name = u'zo\xeb'
+        self.assertEquals(layout.shard(name), layout.shard('zo\xc3\xab'))
+
+        App.create_user(name, conn=self.temp_path)
+        path = layout.user_path(self.temp_path, name)
+        self.assertEquals(path, layout.sharded_path(self.temp_path,
+            'zo\xc3\xab'))
+        self.assertTrue(os.path.isdir(path))
+        self.assertTrue('zo\xc3\xab' in layout.iter_users(self.temp_path))
+
+    def test_user_path_finds_flat_users(self):
+        self.assertEquals(layout.user_path(self.temp_path, 'steve'),
+                os.path.join(self.temp_path, 'steve'))
+        self.assertEquals(layout.user_path(self.temp_path, 'mary'),
+                layout.sharded_path(self.temp_path, 'mary'))
+
+    def test_new_users_are_sharded(self):
+        App.create_user('mary', conn=self.temp_path)
+        app = App('mary', conn=self.temp_path)
+        app.create_wallet('mobile', 20.0)
+
+        path = layout.sharded_path(self.temp_path, 'mary')
+        self.assertEquals(app.conn, path)
+        self.assertEquals(list(layout.iter_users(self.temp_path)),
+                ['steve', 'mary'])
+
+        with self.assertRaises(Exception) as context:
+            App.create_user('mary', conn=self.temp_path)
+
+        self.assertTrue('User already exists: mary' in context.exception)
+
+        App.remove_user('mary', conn=self.temp_path)
+        self.assertEquals(list(layout.iter_users(self.temp_path)), ['steve'])
+
+    def test_reserved_user_name(self):
+        with self.assertRaises(Exception) as context:
+            App.create_user(layout.SHARDS, conn=self.temp_path)
+
+        msg = 'Invalid user name: {}'.format(layout.SHARDS)
+        self.assertTrue(msg in context.exception)
+
+    def test_migrate_flat_users(self):
+        app = App('steve', conn=self.temp_path)
+        app.preload()
+
+        self.assertEquals(layout.migrate(self.temp_path), ['steve'])
+        self.assertEquals(list(layout.iter_users(self.temp_path)), ['steve'])
+        self.assertEquals(layout.user_path(self.temp_path, 'steve'),
+                layout.sharded_path(self.temp_path, 'steve'))
+
+        # the app opened before the move saves through the link
+        app.create_wallet('mortgage', 10.0)
+        new_app = App('steve', conn=self.temp_path)
+        self.assertAlmostEquals(new_app.wallets['mortgage'].balance(), 10.0)
+
+        self.assertEquals(layout.prune(self.temp_path), ['steve'])
+        self.assertFalse(os.path.lexists(os.path.join(self.temp_path,
+            'steve')))
+        self.assertEquals(layout.migrate(self.temp_path), [])
+
+    def test_remove_migrated_user_removes_link(self):
+        layout.migrate(self.temp_path)
+        App.remove_user('steve', conn=self.temp_path)
+
+        self.assertEquals(os.listdir(self.temp_path), [layout.SHARDS])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+A set of tests for the locks module
+"""
+
+import unittest
+
+import os
+import shutil
+import tempfile
+import threading
+
+from app import App
+import locks
+import utils
+
+class LocksTestCases(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        locks.reset_stats()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def hold(self, lock, held, release):
+        def run():
+            with lock(self.path):
+                held.set()
+                release.wait()
+
+        t = threading.Thread(target=run)
+        t.start()
+        held.wait()
+        return t
+
+    def test_writer_blocks_reader(self):
+        held, release = threading.Event(), threading.Event()
+        t = self.hold(locks.write, held, release)
+
+        timer = threading.Timer(0.05, release.set)
+        timer.start()
+        with locks.read(self.path):
+            self.assertTrue(release.is_set())
+        t.join()
+
+        stats = locks.stats()
+        self.assertEquals(stats['read']['acquisitions'], 1)
+        self.assertTrue(stats['read']['max_wait'] >= 0.04)
+
+    def test_readers_share_lock(self):
+        held, release = threading.Event(), threading.Event()
+        t = self.hold(locks.read, held, release)
+
+        with locks.read(self.path):
+            self.assertFalse(release.is_set())
+        release.set()
+        t.join()
+
+        self.assertEquals(locks.stats()['read']['acquisitions'], 2)
+
+    def test_locks_are_reentrant(self):
+        with locks.write(self.path):
+            with locks.write(self.path):
+                with locks.read(self.path):
+                    pass
+
+        self.assertEquals(locks.stats()['write']['acquisitions'], 1)
+        self.assertEquals(locks.stats()['read']['acquisitions'], 0)
+
+    def test_read_lock_can_not_be_upgraded(self):
+        with self.assertRaises(Exception) as context:
+            with locks.read(self.path):
+                with locks.write(self.path):
+                    pass
+
+        msg = 'Can not upgrade read lock on {}'.format(self.path)
+        self.assertTrue(msg in context.exception)
+
+        # the read lock has been released
+        with locks.write(self.path):
+            pass
+
+class StaleSaveTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_save_over_newer_data_raises(self):
+        app = App(self.user, conn=self.temp_path)
+        other = App(self.user, conn=self.temp_path)
+        app.preload()
+        other.preload()
+
+        other.create_wallet('mortgage', 10.0)
+        with self.assertRaises(Exception) as context:
+            app.create_wallet('car', 20.0)
+
+        path = os.path.join(self.temp_path, self.user, 'wallets.csv')
+        msg = '{} has changed since it was loaded'.format(path)
+        self.assertTrue(msg in context.exception)
+
+        new_app = App(self.user, conn=self.temp_path)
+        self.assertTrue('mortgage' in new_app.wallets)
+        self.assertFalse('car' in new_app.wallets)
+
+    def test_repeated_saves_from_one_app(self):
+        app = App(self.user, conn=self.temp_path)
+        app.create_wallet('mortgage', 10.0)
+        app.fund_wallets('salary')
+
+        with app.batch():
+            app.add_expense('mobile', 'cash', 5.0)
+        app.fund_wallets('salary')
+
+        new_app = App(self.user, conn=self.temp_path)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 95.0)
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 2850.0)
+
+    def test_journal_append_after_other_app_raises(self):
+        app = App(self.user, conn=self.temp_path, journaled=True)
+        other = App(self.user, conn=self.temp_path, journaled=True)
+        app.preload()
+        other.preload()
+
+        other.add_expense('mobile', 'cash', 50.0)
+        with self.assertRaises(Exception) as context:
+            app.add_expense('mobile', 'cash', 25.0)
+
+        path = os.path.join(self.temp_path, self.user, 'journal.csv')
+        msg = '{} has changed since it was loaded'.format(path)
+        self.assertTrue(msg in context.exception)
+
+if __name__ == '__main__':
+    unittest.main()
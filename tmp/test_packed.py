@@ -0,0 +1,124 @@
+"""
+A set of tests for the packed format and the convert module
+"""
+
+import unittest
+
+import os
+
+from app import App
+import convert
+import packed
+import utils
+
+class PackedFormatTestCases(unittest.TestCase):
+    def test_balances_round_trip(self):
+        rows = [('mobile', 10000), ('savings', -35), ('shares', 0)]
+        data = packed.pack_balances(rows)
+
+        self.assertEquals(data[:packed.MAGIC_SIZE], packed.BALANCES)
+        self.assertEquals(packed.unpack_balances(data), rows)
+
+    def test_empty_balances(self):
+        self.assertEquals(packed.unpack_balances(packed.pack_balances([])), [])
+
+    def test_templates_round_trip(self):
+        rows = [
+                ('salary', 300000, 'Monthly', 'bank account',
+                    [('savings', 125000), ('shares', 175000)]),
+                ('wife', 100000, 'Monthly', 'bank account',
+                    [('savings', 100000)])
+                ]
+        data = packed.pack_templates(rows)
+
+        self.assertEquals(data[:packed.MAGIC_SIZE], packed.TEMPLATES)
+        self.assertEquals(packed.unpack_templates(data), rows)
+
+    def test_unpack_wrong_format(self):
+        with self.assertRaises(Exception) as context:
+            packed.unpack_templates(packed.pack_balances([]))
+
+        msg = 'Not a packed funding templates file'
+        self.assertTrue(msg in context.exception)
+
+class ConvertTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+        self.conn = os.path.join(self.temp_path, self.user)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_convert_user_to_packed(self):
+        convert.convert(self.conn)
+
+        for f in ['accounts.csv', 'wallets.csv', 'funding.csv']:
+            self.assertTrue(packed.is_packed(os.path.join(self.conn, f)))
+
+        app = App(self.user, conn=self.temp_path)
+        self.assertEquals(list(app.wallets), ['mobile', 'savings', 'shares'])
+        self.assertAlmostEquals(app.wallets.balance(), 2800.0)
+        self.assertAlmostEquals(app.accounts['cash'].balance(), 325.0)
+        alloc = app.funding_templates['salary'].allocation()
+        self.assertAlmostEquals(alloc['savings'], 1250.0)
+
+    def test_packed_user_saves_packed(self):
+        convert.convert(self.conn)
+
+        app = App(self.user, conn=self.temp_path)
+        app.create_wallet('mortgage', 10.0)
+        app.fund_wallets('salary')
+
+        path = os.path.join(self.conn, 'wallets.csv')
+        self.assertTrue(packed.is_packed(path))
+        new_app = App(self.user, conn=self.temp_path, columnar=True)
+        self.assertAlmostEquals(new_app.wallets['mortgage'].balance(), 10.0)
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 1600.0)
+
+    def test_csv_named_like_old_marker_is_csv(self):
+        with open(os.path.join(self.conn, 'wallets.csv'), 'wb') as f:
+            f.write('WLB1 groceries,10.0\nmobile,100.0\n')
+        with open(os.path.join(self.conn, 'funding.csv'), 'wb') as f:
+            f.write('WLF1 rent,10.0,Monthly,cash,mobile,10.0\n')
+
+        app = App(self.user, conn=self.temp_path)
+        self.assertEquals(list(app.wallets), ['WLB1 groceries', 'mobile'])
+        self.assertEquals(app.wallets.format, 'csv')
+        self.assertTrue('WLF1 rent' in app.funding_templates)
+
+    def test_convert_back_to_csv(self):
+        with open(os.path.join(self.conn, 'funding.csv'), 'rb') as f:
+            before = f.read()
+
+        convert.convert(self.conn)
+        convert.convert(self.conn, 'csv')
+
+        with open(os.path.join(self.conn, 'funding.csv'), 'rb') as f:
+            self.assertEquals(sorted(f.read().splitlines()),
+                    sorted(before.splitlines()))
+
+    def test_convert_keeps_journal(self):
+        app = App(self.user, conn=self.temp_path, journaled=True)
+        app.add_expense('mobile', 'cash', 50.0)
+        convert.convert(self.conn)
+
+        new_app = App(self.user, conn=self.temp_path, journaled=True)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+
+    def test_convert_all_users(self):
+        App.create_user('mary', conn=self.temp_path)
+
+        users = convert.convert_all(self.temp_path)
+        self.assertEquals(users, ['steve', 'mary'])
+        self.assertEquals(len(App('mary', conn=self.temp_path).wallets), 0)
+
+    def test_convert_invalid_format(self):
+        with self.assertRaises(Exception) as context:
+            convert.convert(self.conn, 'xml')
+
+        msg = 'Invalid format: {}'.format('xml')
+        self.assertTrue(msg in context.exception)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+A set of tests for the projection module
+"""
+
+import unittest
+
+import datetime
+import calendar
+
+from app import App
+import projection
+import utils
+
+DAY = 24 * 60 * 60
+
+@unittest.skipIf(projection.np is None, 'numpy is not installed')
+class ProjectionTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_runs(self):
+        self.assertEquals(list(projection.runs('Monthly', 3)), [1, 1, 1])
+        self.assertEquals(list(projection.runs('Quarterly', 6)),
+                [0, 0, 1, 0, 0, 1])
+        self.assertEquals(sum(projection.runs('Weekly', 12)), 52)
+
+        with self.assertRaises(Exception) as context:
+            projection.runs('Hourly', 12)
+
+        self.assertTrue('Invalid frequency: Hourly' in context.exception)
+
+    def test_funding_matrix(self):
+        app = App(self.user, conn=self.temp_path)
+        app.create_funding_template('groceries', 100.0, 'cash', 'Weekly',
+                {'mobile': 100.0})
+        wallets = ['mobile', 'savings', 'shares']
+
+        matrix = projection.funding_matrix(app.funding_templates.values(),
+                wallets, 2)
+        self.assertEquals(matrix.tolist(), [
+            [40000, 125000, 175000],
+            [40000, 125000, 175000]])
+
+    def test_project(self):
+        funding = projection.np.array([[100, 0], [100, 0], [100, 50]])
+        balances = projection.project([10, 20], funding, [30, 10])
+        self.assertEquals(balances.tolist(), [[80, 10], [150, 0], [220, 40]])
+
+    def test_simulate(self):
+        funding = projection.np.zeros((12, 2), dtype=projection.np.int64)
+        outcomes = projection.simulate([1000, 1000], funding, [100, 0],
+                [10, 0], 500, seed=1)
+
+        self.assertEquals(outcomes.shape, (500, 12, 2))
+        self.assertTrue((outcomes[:, :, 1] == 1000).all())
+        self.assertAlmostEquals(outcomes[:, -1, 0].mean(), -200, delta=20)
+
+    def test_last_months(self):
+        when = calendar.timegm(datetime.date(2017, 2, 10).timetuple())
+        self.assertEquals(projection.last_months(3, when),
+                ['2016-12', '2017-01', '2017-02'])
+        self.assertEquals(projection.last_months(1, when), ['2017-02'])
+
+    def test_spending_from_rollups(self):
+        now = [calendar.timegm(datetime.date(2017, 3, 1).timetuple())]
+        app = App(self.user, conn=self.temp_path, history=True,
+                clock=lambda: now[0])
+        app.add_expense('mobile', 'cash', 10.0)
+        now[0] += 31 * DAY
+        app.add_expense('mobile', 'cash', 30.0)
+
+        (mean, std) = projection.spending(app.conn, ['mobile', 'savings'],
+                months=2, when=now[0])
+        self.assertEquals(mean.tolist(), [2000, 0])
+        self.assertEquals(std.tolist(), [1000, 0])
+
+    def test_spending_counts_months_without_expenses(self):
+        now = [calendar.timegm(datetime.date(2016, 12, 1).timetuple())]
+        app = App(self.user, conn=self.temp_path, history=True,
+                clock=lambda: now[0])
+        # too old to be counted
+        app.add_expense('mobile', 'cash', 50.0)
+        now[0] += 31 * DAY
+        app.add_expense('mobile', 'cash', 10.0)
+        app.add_expense('mobile', 'cash', 20.0)
+        now[0] += 59 * DAY
+        app.add_expense('mobile', 'cash', 30.0)
+
+        # 2017-01, 2017-02 and 2017-03 spent 3000, 0 and 3000 cents
+        (mean, std) = projection.spending(app.conn, ['mobile'], months=3,
+                when=now[0])
+        self.assertEquals(mean.tolist(), [2000])
+        self.assertAlmostEquals(std[0], 2000000 ** 0.5)
+
+    def test_forecast(self):
+        App.create_user('mary', conn=self.temp_path)
+        App('mary', conn=self.temp_path).create_wallet('mobile', 20.0)
+
+        results = dict(projection.forecast(self.temp_path, periods=6,
+            scenarios=10, processes=1, seed=1))
+
+        self.assertEquals(sorted(results), ['mary', 'steve'])
+        steve = results['steve']
+        self.assertEquals(steve['wallets'], ['mobile', 'savings', 'shares'])
+        self.assertEquals(steve['percentiles'][50].shape, (6, 3))
+        self.assertAlmostEquals(steve['percentiles'][50][-1][1], 7850.0)
+        self.assertFalse(steve['overdrawn'].any())
+
+    def test_forecast_over_pool(self):
+        results = list(projection.forecast(self.temp_path, periods=3,
+            scenarios=10, processes=2, seed=1))
+        serial = list(projection.forecast(self.temp_path, periods=3,
+            scenarios=10, processes=1, seed=1))
+
+        self.assertEquals([u for (u, r) in results], ['steve'])
+        self.assertEquals(results[0][1]['percentiles'][5].tolist(),
+                serial[0][1]['percentiles'][5].tolist())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+A set of tests for the rollups module
+"""
+
+import unittest
+
+import datetime
+import calendar
+
+from app import App
+from history import History
+import rollups
+import utils
+
+DAY = 24 * 60 * 60
+
+class Clock(object):
+    """a clock that only moves when it is told to"""
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class RollupsTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+        start = calendar.timegm(datetime.date(2017, 3, 1).timetuple())
+        self.clock = Clock(start + 9 * 60 * 60)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def app(self, **options):
+        return App(self.user, conn=self.temp_path, history=True,
+                clock=self.clock, **options)
+
+    def test_bucket(self):
+        t = calendar.timegm(datetime.date(2017, 1, 1).timetuple())
+        self.assertEquals(rollups.bucket('month', t), '2017-01')
+        self.assertEquals(rollups.bucket('week', t), '2016-W52')
+
+    def test_monthly_totals(self):
+        app = self.app()
+        for day in range(40):
+            app.add_expense('mobile', 'cash', 1.0)
+            self.clock.advance(DAY)
+        app.fund_wallets('salary')
+
+        self.assertEquals(app.rollups.report('month', 'wallet', 'mobile'), [
+            ('2017-03', 'expense', -31.0, 31),
+            ('2017-04', 'expense', -9.0, 9)])
+        self.assertEquals(app.rollups.report('month', 'account', 'cash'), [
+            ('2017-03', 'expense', -31.0, 31),
+            ('2017-04', 'expense', -9.0, 9)])
+        self.assertEquals(app.rollups.report('month', 'wallet', 'savings'),
+                [('2017-04', 'fund', 1250.0, 1)])
+
+    def test_weekly_totals(self):
+        app = self.app()
+        app.transfer_funds(100.0, 'savings', 'mobile', 'wallet')
+        self.clock.advance(7 * DAY)
+        app.transfer_funds(50.0, 'savings', 'mobile', 'wallet')
+        app.create_wallet('mortgage', 10.0)
+
+        self.assertEquals(app.rollups.report('week', 'wallet', 'mobile'), [
+            ('2017-W09', 'transfer', 100.0, 1),
+            ('2017-W10', 'transfer', 50.0, 1)])
+        self.assertEquals(app.rollups.report('week', 'wallet', 'mortgage'),
+                [])
+
+    def test_invalid_period(self):
+        app = self.app()
+
+        with self.assertRaises(Exception) as context:
+            app.rollups.report('year', 'wallet', 'mobile')
+
+        self.assertTrue('Invalid period: year' in context.exception)
+
+    def test_totals_are_kept_between_apps(self):
+        app = self.app()
+        app.add_expense('mobile', 'cash', 5.0)
+
+        # a second app adds to the first app's totals, which the
+        # first app sees
+        new_app = self.app()
+        new_app.add_expense('mobile', 'cash', 5.0)
+
+        self.assertEquals(app.rollups.report('month', 'wallet', 'mobile'),
+                [('2017-03', 'expense', -10.0, 2)])
+        self.assertEquals(self.app().rollups.report('month', 'wallet',
+            'mobile'), [('2017-03', 'expense', -10.0, 2)])
+
+    def test_appended_rows_are_folded(self):
+        app = self.app()
+        for i in range(rollups.MIN_COMPACT):
+            app.add_expense('mobile', 'cash', 0.01)
+
+        # four rows appended by each expense, two periods for both the
+        # wallet and the account
+        self.assertTrue(app.rollups._rows <= rollups.MIN_COMPACT + 4)
+        self.assertEquals(self.app().rollups.report('month', 'account',
+            'cash'), [('2017-03', 'expense', -10.0, rollups.MIN_COMPACT)])
+
+    def test_batch_is_rolled_up_on_commit(self):
+        app = self.app()
+        with self.assertRaises(Exception):
+            app.apply_operations([
+                ('fund', 'salary'),
+                ('transfer', 10000.0, 'cash', 'bank account', 'account')
+                ])
+
+        self.assertEquals(app.rollups.report('month', 'wallet', 'savings'),
+                [])
+
+    def test_rebuild(self):
+        # a history made before the rollups were kept
+        History(self.temp_path + '/steve', self.clock).start({})
+        app = self.app()
+        app.history.post([('wallet', 'mobile', -500, 'expense'),
+            ('account', 'cash', -500, 'expense')])
+        self.assertEquals(app.rollups.report('month', 'wallet', 'mobile'), [])
+
+        rollups.rebuild(app.conn)
+        self.assertEquals(self.app().rollups.report('month', 'wallet',
+            'mobile'), [('2017-03', 'expense', -5.0, 1)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,348 @@
+"""
+A set of tests for the scheduler module
+"""
+
+import unittest
+
+import os
+import datetime
+import calendar
+import multiprocessing
+
+from app import App
+from journal import Journal
+from wallets import stamp
+import layout
+import scheduler
+import storage
+import utils
+
+DAY = 24 * 60 * 60
+
+class BrokenPool(object):
+    """a pool whose results fail part way through"""
+    pools = []
+
+    def __init__(self, processes):
+        self.closed = self.joined = False
+        self.pools.append(self)
+
+    def imap_unordered(self, func, chunks):
+        yield func(chunks[0])
+        raise IOError('worker died')
+
+    def close(self):
+        self.closed = True
+
+    def join(self):
+        self.joined = True
+
+class Clock(object):
+    """a clock that only moves when it is told to"""
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+def timestamp(*date):
+    return calendar.timegm(datetime.datetime(*date).timetuple())
+
+class RuleTestCases(unittest.TestCase):
+    def test_parse(self):
+        self.assertEquals(scheduler.parse('Monthly'), scheduler.Rule('month', 1))
+        self.assertEquals(scheduler.parse('fortnightly'),
+                scheduler.Rule('week', 2))
+        self.assertEquals(scheduler.parse('every 10 days'),
+                scheduler.Rule('day', 10))
+        self.assertEquals(scheduler.parse('Every 2 years'),
+                scheduler.Rule('month', 24))
+
+    def test_parse_invalid_frequency(self):
+        for frequency in ['Hourly', 'every 0 weeks', 'every week']:
+            with self.assertRaises(Exception) as context:
+                scheduler.parse(frequency)
+
+            msg = 'Invalid frequency: {}'.format(frequency)
+            self.assertTrue(msg in context.exception)
+
+    def test_monthly_occurrences_keep_their_day(self):
+        rule = scheduler.parse('Monthly')
+        anchor = timestamp(2017, 1, 31, 9)
+
+        self.assertEquals(rule.occurrence(anchor, 1), timestamp(2017, 2, 28, 9))
+        self.assertEquals(rule.occurrence(anchor, 2), timestamp(2017, 3, 31, 9))
+        self.assertEquals(rule.occurrence(anchor, 12),
+                timestamp(2018, 1, 31, 9))
+
+    def test_per_year(self):
+        self.assertEquals(scheduler.parse('Weekly').per_year(), 52)
+        self.assertEquals(scheduler.parse('Quarterly').per_year(), 4)
+
+class SchedulerTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+        self.clock = Clock(timestamp(2017, 3, 1, 9))
+        self.scheduler = scheduler.Scheduler(self.temp_path, self.clock)
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def app(self):
+        return App(self.user, conn=self.temp_path)
+
+    def conn(self):
+        return os.path.join(self.temp_path, self.user)
+
+    def test_new_templates_run_one_period_later(self):
+        self.scheduler.load()
+
+        self.assertEquals(self.scheduler.next_run(), timestamp(2017, 4, 1, 9))
+        self.assertEquals(self.scheduler.run_due(), [])
+        self.assertTrue(os.path.isfile(os.path.join(self.temp_path,
+            self.user, 'schedule.csv')))
+
+    def test_due_templates_are_funded(self):
+        self.scheduler.load()
+        self.clock.advance(31 * DAY)
+
+        self.assertEquals(self.scheduler.run_due(),
+                [('steve', 'salary', 1)])
+        self.assertAlmostEquals(self.app().wallets['savings'].balance(),
+                1600.0)
+        self.assertEquals(self.scheduler.next_run(), timestamp(2017, 5, 1, 9))
+        self.assertEquals(self.scheduler.run_due(), [])
+
+    def test_missed_runs_are_caught_up(self):
+        self.scheduler.load()
+
+        # the scheduler is stopped for three months
+        self.clock.advance(95 * DAY)
+        new_scheduler = scheduler.Scheduler(self.temp_path, self.clock)
+        new_scheduler.load()
+
+        self.assertEquals(new_scheduler.run_due(), [('steve', 'salary', 3)])
+        self.assertAlmostEquals(self.app().wallets['shares'].balance(),
+                7600.0)
+        self.assertEquals(new_scheduler.next_run(), timestamp(2017, 7, 1, 9))
+
+    def test_templates_of_a_user_are_batched(self):
+        app = self.app()
+        app.create_funding_template('phone', 20.0, 'cash', 'Weekly',
+                {'mobile': 20.0})
+        self.scheduler.load()
+        self.clock.advance(31 * DAY)
+
+        self.assertEquals(self.scheduler.run_due(),
+                [('steve', 'phone', 4), ('steve', 'salary', 1)])
+        new_app = self.app()
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 180.0)
+        self.assertAlmostEquals(new_app.accounts['cash'].balance(), 405.0)
+
+    def test_changed_frequency_starts_from_last_run(self):
+        self.scheduler.load()
+        self.clock.advance(31 * DAY)
+        self.scheduler.run_due()
+
+        app = self.app()
+        with app.batch():
+            app.update_funding_template('salary', 3000.0, 'bank account',
+                    'Weekly', {'savings': 1250.0, 'shares': 1750.0})
+        self.scheduler.add_user(self.user)
+
+        self.assertEquals(self.scheduler.next_run(), timestamp(2017, 4, 8, 9))
+
+    def test_removed_templates_are_skipped(self):
+        self.scheduler.load()
+        app = self.app()
+        with app.batch():
+            app.remove_funding_template('salary')
+        self.clock.advance(31 * DAY)
+
+        self.assertEquals(self.scheduler.run_due(), [])
+        self.assertEquals(self.scheduler.next_run(), None)
+
+    def test_failed_runs_are_retried(self):
+        self.scheduler.load()
+        with open(os.path.join(self.temp_path, self.user, 'wallets.csv'),
+                'wb') as f:
+            f.write('mobile,not a balance\n')
+        self.clock.advance(31 * DAY)
+
+        self.assertEquals(self.scheduler.run_due(), [])
+        self.assertEquals(len(self.scheduler.failures), 1)
+        self.assertEquals(self.scheduler.next_run(),
+                self.clock.now + scheduler.RETRY_DELAY)
+
+    def test_users_are_opened_in_their_own_mode(self):
+        self.scheduler.load()
+        self.clock.advance(31 * DAY)
+        self.scheduler.run_due()
+        self.assertEquals(Journal(self.conn()).size(), 0)
+
+        app = App(self.user, conn=self.temp_path, journaled=True)
+        app.add_expense('mobile', 'cash', 50.0)
+        self.clock.advance(31 * DAY)
+        self.scheduler.run_due()
+
+        # the journal is folded into the snapshot with the funding
+        self.assertEquals(Journal(self.conn()).size(), 0)
+        new_app = self.app()
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 2850.0)
+
+    def test_runs_are_committed_with_fundings(self):
+        self.scheduler.load()
+        self.clock.advance(31 * DAY)
+
+        save = scheduler.Schedule.save
+        def fail(schedule, path=None):
+            raise IOError('disk full')
+        scheduler.Schedule.save = fail
+        try:
+            self.assertEquals(self.scheduler.run_due(), [])
+        finally:
+            scheduler.Schedule.save = save
+
+        self.assertEquals(scheduler.Schedule(self.conn()).entries[
+            'salary'].runs, 1)
+        self.assertAlmostEquals(self.app().wallets['savings'].balance(),
+                350.0)
+
+        self.clock.advance(scheduler.RETRY_DELAY)
+        self.assertEquals(self.scheduler.run_due(),
+                [('steve', 'salary', 1)])
+        self.assertEquals(scheduler.Schedule(self.conn()).entries[
+            'salary'].runs, 2)
+        self.assertAlmostEquals(self.app().wallets['savings'].balance(),
+                1600.0)
+
+    def test_unchanged_users_are_not_loaded_again(self):
+        self.scheduler.load()
+        path = os.path.join(self.conn(), scheduler.SCHEDULE)
+        before = stamp(path)
+
+        added = []
+        add_user = self.scheduler.add_user
+        self.scheduler.add_user = lambda user: added.append(user)
+        self.scheduler.load()
+        self.assertEquals(added, [])
+        self.assertEquals(self.scheduler.next_run(), timestamp(2017, 4, 1, 9))
+
+        self.scheduler.add_user = add_user
+        self.scheduler.load()
+        self.assertEquals(stamp(path), before)
+
+        self.app().create_funding_template('phone', 20.0, 'cash', 'Weekly',
+                {'mobile': 20.0})
+        self.scheduler.load()
+        self.assertEquals(self.scheduler.next_run(), timestamp(2017, 3, 8, 9))
+
+    def test_sqlite_schedule_is_kept_in_database(self):
+        storage.copy_user(self.conn(), 'csv', 'sqlite')
+        self.scheduler.load()
+        self.clock.advance(31 * DAY)
+
+        self.assertEquals(self.scheduler.run_due(),
+                [('steve', 'salary', 1)])
+        self.assertFalse(os.path.isfile(os.path.join(self.conn(),
+            scheduler.SCHEDULE)))
+
+        app = self.app()
+        self.assertAlmostEquals(app.wallets['savings'].balance(), 1600.0)
+        self.assertEquals(scheduler.open_schedule(app).entries[
+            'salary'].runs, 2)
+
+class FundAllTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.now = timestamp(2017, 3, 1, 9)
+
+        App.create_user('mary', conn=self.temp_path)
+        app = App('mary', conn=self.temp_path)
+        app.create_account('bank account', 0.0)
+        app.create_wallet('rent', 0.0)
+        app.create_funding_template('pay', 1000.0, 'bank account',
+                'Weekly', {'rent': 1000.0})
+
+        # both users were first scheduled a month ago
+        scheduler.Scheduler(self.temp_path, lambda: self.now).load()
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def fund_all(self, processes):
+        return scheduler.fund_all(self.temp_path, processes, chunk=1,
+                now=self.now + 31 * DAY)
+
+    def test_fund_all(self):
+        result = self.fund_all(1)
+
+        self.assertEquals(result['users'], 2)
+        self.assertEquals(sorted(result['funded']),
+                [('mary', 'pay', 4), ('steve', 'salary', 1)])
+        self.assertEquals(result['failed'], [])
+        self.assertEquals(result['unscheduled'], [])
+        self.assertEquals(len(result['workers']), 1)
+        self.assertEquals(result['workers'].values()[0]['users'], 2)
+
+        app = App('mary', conn=self.temp_path)
+        self.assertAlmostEquals(app.wallets['rent'].balance(), 4000.0)
+
+        # nothing is due when run again
+        self.assertEquals(self.fund_all(1)['funded'], [])
+
+    def test_unscheduled_templates_are_reported(self):
+        for user in ['steve', 'mary']:
+            os.remove(os.path.join(layout.user_path(self.temp_path, user),
+                scheduler.SCHEDULE))
+
+        result = self.fund_all(1)
+        self.assertEquals(result['funded'], [])
+        self.assertEquals(sorted(result['unscheduled']),
+                [('mary', 'pay'), ('steve', 'salary')])
+
+        # they are first due one period after they were found
+        self.assertEquals(self.fund_all(1)['unscheduled'], [])
+
+    def test_unscheduled_templates_run_new(self):
+        os.remove(os.path.join(self.temp_path, 'steve', scheduler.SCHEDULE))
+
+        result = scheduler.fund_all(self.temp_path, 1, now=self.now + DAY,
+                run_new=True)
+        self.assertEquals(result['funded'], [('steve', 'salary', 1)])
+        self.assertEquals(result['unscheduled'], [('steve', 'salary')])
+
+        app = App('steve', conn=self.temp_path)
+        self.assertAlmostEquals(app.wallets['savings'].balance(), 1600.0)
+
+    def test_fund_all_over_pool(self):
+        with open(os.path.join(self.temp_path, 'steve', 'wallets.csv'),
+                'wb') as f:
+            f.write('mobile,not a balance\n')
+
+        result = self.fund_all(2)
+
+        self.assertEquals(result['funded'], [('mary', 'pay', 4)])
+        self.assertEquals([u for (u, e) in result['failed']], ['steve'])
+        self.assertEquals(sum(w['users'] for w in
+            result['workers'].itervalues()), 2)
+
+    def test_pool_is_joined_when_results_fail(self):
+        pool = multiprocessing.Pool
+        multiprocessing.Pool = BrokenPool
+        try:
+            with self.assertRaises(IOError):
+                self.fund_all(2)
+        finally:
+            multiprocessing.Pool = pool
+
+        self.assertTrue(BrokenPool.pools[-1].closed)
+        self.assertTrue(BrokenPool.pools[-1].joined)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+"""
+A set of tests for the storage engines
+"""
+
+import unittest
+
+import os
+
+from app import App
+import storage
+import utils
+
+class StorageTestCases(unittest.TestCase):
+    """runs the same operations through an App on each engine"""
+    engine = 'memory'
+
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+        self.conn = os.path.join(self.temp_path, self.user)
+        storage.copy_user(self.conn, 'csv', self.engine)
+
+    def tearDown(self):
+        storage.clear_memory()
+        utils.remove_test_data(self.temp_path)
+
+    def app(self):
+        return App(self.user, conn=self.temp_path, storage=self.engine)
+
+    def test_load(self):
+        app = self.app()
+
+        self.assertEquals(app.storage.name, self.engine)
+        self.assertEquals(list(app.wallets), ['mobile', 'savings', 'shares'])
+        self.assertEquals(list(app.accounts), ['cash', 'bank account'])
+        self.assertAlmostEquals(app.wallets.balance(), 2800.0)
+        alloc = app.funding_templates['salary'].allocation()
+        self.assertAlmostEquals(alloc['shares'], 1750.0)
+
+    def test_changes_are_saved(self):
+        app = self.app()
+        app.create_wallet('mortgage', 10.0)
+        app.create_account('credit card', -50.0)
+        app.fund_wallets('salary')
+        with app.batch():
+            app.remove_wallet('shares', 'mortgage')
+            app.remove_account('cash', 'bank account')
+
+        new_app = self.app()
+        self.assertEquals(list(new_app.wallets),
+                ['mobile', 'savings', 'mortgage'])
+        self.assertAlmostEquals(new_app.wallets['mortgage'].balance(),
+                4110.0)
+        self.assertAlmostEquals(new_app.accounts['bank account'].balance(),
+                5800.0)
+        self.assertEquals(new_app.funding_templates.templates_for_wallet(
+            'mortgage'), ['salary'])
+
+    def test_funding_templates_are_saved(self):
+        app = self.app()
+        app.create_funding_template('bonus', 100.0, 'cash', 'Yearly',
+                {'mobile': 40.0, 'savings': 60.0})
+        with app.batch():
+            app.update_funding_template('salary', 2000.0, 'cash', 'Monthly',
+                    {'shares': 2000.0})
+
+        new_app = self.app()
+        self.assertEquals(list(new_app.funding_templates),
+                ['salary', 'bonus'])
+        salary = new_app.funding_templates['salary']
+        self.assertEquals(salary.account(), 'cash')
+        self.assertEquals(salary.allocation(), {'shares': 2000.0})
+
+        with app.batch():
+            app.remove_funding_template('bonus')
+        self.assertEquals(list(self.app().funding_templates), ['salary'])
+
+    def test_failed_batch_is_not_saved(self):
+        app = self.app()
+        with self.assertRaises(Exception):
+            app.apply_operations([
+                ('fund', 'salary'),
+                ('transfer', 10000.0, 'cash', 'bank account', 'account')
+                ])
+
+        app.fund_wallets('salary')
+        new_app = self.app()
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 1600.0)
+
+class SqliteStorageTestCases(StorageTestCases):
+    engine = 'sqlite'
+
+    def test_detected_from_data_directory(self):
+        app = App(self.user, conn=self.temp_path)
+        self.assertEquals(app.storage.name, 'sqlite')
+
+    def test_save_writes_changed_rows(self):
+        app = self.app()
+        app.preload()
+        db = app.storage.db._db
+
+        before = db.total_changes
+        app.fund_wallets('salary')
+        # the account and the two wallets in the template
+        self.assertEquals(db.total_changes - before, 3)
+
+        before = db.total_changes
+        app.create_wallet('mortgage', 10.0)
+        self.assertEquals(db.total_changes - before, 1)
+
+    def test_concurrent_adjustments_are_kept(self):
+        app = self.app()
+        other = self.app()
+        app.preload()
+        other.preload()
+
+        app.fund_wallets('salary')
+        other.fund_wallets('salary')
+
+        new_app = self.app()
+        self.assertAlmostEquals(new_app.wallets['savings'].balance(), 2850.0)
+
+class CsvStorageTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.user = 'steve'
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_default_engine(self):
+        app = App(self.user, conn=self.temp_path)
+        self.assertEquals(app.storage.name, 'csv')
+
+    def test_invalid_engine(self):
+        with self.assertRaises(Exception) as context:
+            App(self.user, conn=self.temp_path, storage='xml')
+
+        msg = 'Invalid storage: {}'.format('xml')
+        self.assertTrue(msg in context.exception)
+
+    def test_engine_must_implement_open_and_commit(self):
+        class Partial(storage.Storage):
+            def open(self, name, autosave=True):
+                pass
+
+        with self.assertRaises(TypeError):
+            Partial(self.temp_path)
+
+    def test_only_csv_is_journaled(self):
+        with self.assertRaises(Exception) as context:
+            App(self.user, conn=self.temp_path, journaled=True,
+                    storage='sqlite')
+
+        msg = 'Only csv storage can be journaled'
+        self.assertTrue(msg in context.exception)
+        path = os.path.join(self.temp_path, self.user, storage.DATABASE)
+        self.assertFalse(os.path.isfile(path))
+
+    def test_copy_needs_compacted_journal(self):
+        app = App(self.user, conn=self.temp_path, journaled=True)
+        app.add_expense('mobile', 'cash', 50.0)
+
+        conn = os.path.join(self.temp_path, self.user)
+        with self.assertRaises(Exception) as context:
+            storage.copy_user(conn, 'csv', 'sqlite')
+
+        msg = 'Journal of {} must be compacted before copying'.format(conn)
+        self.assertTrue(msg in context.exception)
+
+        app.compact()
+        storage.copy_user(conn, 'csv', 'sqlite')
+        new_app = App(self.user, conn=self.temp_path)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 50.0)
+
+if __name__ == '__main__':
+    unittest.main()
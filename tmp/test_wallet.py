@@ -46,5 +46,47 @@ class WalletAddTestCases(unittest.TestCase):
         msg = 'could not convert string to float: {}'.format(add)
         self.assertTrue(msg in context.exception)
 
+class WalletCentsTestCases(unittest.TestCase):
+    def test_wallet_has_no_instance_dict(self):
+        a = Wallet(50.0)
+
+        self.assertFalse(hasattr(a, '__dict__'))
+
+    def test_balance_stored_in_cents(self):
+        a = Wallet(12.34)
+
+        self.assertEquals(a.cents(), 1234)
+        self.assertEquals(a.balance(), 12.34)
+
+    def test_add_is_exact(self):
+        a = Wallet(0.1)
+        a.add(0.2)
+
+        self.assertEquals(a.cents(), 30)
+        self.assertEquals(a.balance(), 0.3)
+
+class FundingTemplateValidTestCases(unittest.TestCase):
+    def setUp(self):
+        self.template = FundingTemplate('salary', 0.3, 'bank account',
+                'Monthly')
+
+    def test_valid_allocation_is_exact(self):
+        self.template.add_wallet_to_allocation('mobile', 0.1)
+        self.template.add_wallet_to_allocation('savings', 0.2)
+
+        self.assertTrue(self.template.valid())
+
+    def test_invalid_allocation_by_one_cent(self):
+        self.template.add_wallet_to_allocation('mobile', 0.1)
+        self.template.add_wallet_to_allocation('savings', 0.19)
+
+        self.assertFalse(self.template.valid())
+
+    def test_allocation_returns_amounts(self):
+        self.template.add_wallet_to_allocation('mobile', 0.1)
+
+        self.assertEquals(self.template.allocation(), {'mobile': 0.1})
+        self.assertEquals(type(self.template.amount()), float)
+
 if __name__ == '__main__':
     unittest.main()
@@ -4,7 +4,11 @@ A set of tests for the wallets module
 
 import unittest
 
+import os
+
 from app import App
+from wallets import FundingTemplates
+import wallets
 import utils
 
 class AccountsTestCases(unittest.TestCase):
@@ -119,5 +123,348 @@ class FundingTemplateRemoveWalletTestCases(unittest.TestCase):
         self.assertTrue(self.transfer in new_alloc)
         self.assertAlmostEquals(new_alloc[self.transfer], bal)
 
+class CollectionIterationTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+
+        self.app = App('steve', conn=self.temp_path)
+        self.wallets = self.app.wallets
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_iterates_in_insertion_order(self):
+        self.app.create_wallet('mortgage', 0.0)
+        self.app.create_wallet('holiday', 0.0)
+
+        self.assertEquals(list(self.wallets),
+                ['mobile', 'savings', 'shares', 'mortgage', 'holiday'])
+
+    def test_nested_iteration(self):
+        pairs = [(a, b) for a in self.wallets for b in self.wallets]
+        self.assertEquals(len(pairs), 9)
+
+    def test_items_and_values(self):
+        items = list(self.wallets.items())
+        self.assertEquals([k for (k, v) in items],
+                ['mobile', 'savings', 'shares'])
+        self.assertAlmostEquals(items[0][1].balance(), 100.0)
+
+        balances = [v.balance() for v in self.wallets.values()]
+        self.assertAlmostEquals(sum(balances), 2800.0)
+
+    def test_saved_order_is_preserved(self):
+        self.app.create_wallet('mortgage', 0.0)
+
+        new_app = App('steve', conn=self.temp_path)
+        self.assertEquals(list(new_app.wallets),
+                ['mobile', 'savings', 'shares', 'mortgage'])
+
+class CollectionBalanceTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+
+        self.app = App('steve', conn=self.temp_path)
+        self.wallets = self.app.wallets
+        self.accounts = self.app.accounts
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_balance_after_expense(self):
+        self.app.add_expense('mobile', 'cash', 50.0)
+
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 2750.0)
+        self.assertAlmostEquals(self.accounts.balance(verify=True), 2750.0)
+
+    def test_balance_after_transfer(self):
+        self.app.transfer_funds(200, from_acct='savings',
+                to_acct='shares', transfer_type='wallet')
+
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 2800.0)
+
+    def test_balance_after_create_and_remove(self):
+        self.app.create_wallet('mortgage', 150.0)
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 2950.0)
+
+        self.app.remove_wallet('shares', transfer='savings')
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 2950.0)
+
+        del self.wallets['mortgage']
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 2800.0)
+
+    def test_balance_after_funding(self):
+        self.app.fund_wallets('salary')
+
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 5800.0)
+        self.assertAlmostEquals(self.accounts.balance(verify=True), 5800.0)
+
+    def test_removed_wallet_no_longer_updates_balance(self):
+        wallet = self.wallets['mobile']
+        del self.wallets['mobile']
+        wallet.add(100.0)
+
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 2700.0)
+
+    def test_verify_detects_mismatch(self):
+        self.wallets._total += 100
+
+        with self.assertRaises(Exception) as context:
+            self.wallets.balance(verify=True)
+
+        msg = 'Running balance {} does not match recount {}'.format(2801.0,
+                2800.0)
+        self.assertTrue(msg in context.exception)
+
+class ColumnarCollectionTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+
+        self.app = App('steve', conn=self.temp_path, columnar=True)
+        self.wallets = self.app.wallets
+        self.accounts = self.app.accounts
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def test_loaded_balances(self):
+        self.assertEquals(len(self.wallets), 3)
+        self.assertAlmostEquals(self.wallets['mobile'].balance(), 100.0)
+        self.assertAlmostEquals(self.wallets.balance(), 2800.0)
+        self.assertAlmostEquals(self.accounts.balance(), 2800.0)
+
+    def test_add_through_item(self):
+        self.app.add_expense('mobile', 'cash', 50.0)
+
+        self.assertAlmostEquals(self.wallets['mobile'].balance(), 50.0)
+        self.assertAlmostEquals(self.accounts['cash'].balance(), 275.0)
+        self.assertAlmostEquals(self.wallets.balance(), 2750.0)
+
+    def test_fund_wallets(self):
+        self.app.fund_wallets('salary')
+
+        self.assertAlmostEquals(self.wallets['savings'].balance(), 1600.0)
+        self.assertAlmostEquals(self.wallets['shares'].balance(), 4100.0)
+        self.assertAlmostEquals(self.wallets.balance(), 5800.0)
+
+    def test_add_many_to_missing_key(self):
+        with self.assertRaises(Exception) as context:
+            self.wallets.add_many({'savings': 1.0, 'bonds': 1.0})
+
+        msg = 'collection does not contain key {}.'.format('bonds')
+        self.assertTrue(msg in context.exception)
+        self.assertAlmostEquals(self.wallets['savings'].balance(), 350.0)
+
+    def test_remove_wallet_keeps_order(self):
+        self.app.create_wallet('mortgage', 10.0)
+        self.app.remove_wallet('savings', transfer='mortgage')
+
+        self.assertEquals(list(self.wallets), ['mobile', 'shares', 'mortgage'])
+        self.assertAlmostEquals(self.wallets['mortgage'].balance(), 360.0)
+        self.assertAlmostEquals(self.wallets['shares'].balance(), 2350.0)
+        self.assertTrue('savings' not in self.wallets)
+
+    def test_removed_slots_are_packed(self):
+        for i in range(10):
+            self.app.create_wallet('w{}'.format(i), float(i))
+        for i in range(0, 10, 3):
+            self.app.remove_wallet('w{}'.format(i), transfer='mobile')
+
+        self.assertEquals(list(self.wallets), ['mobile', 'savings', 'shares',
+            'w1', 'w2', 'w4', 'w5', 'w7', 'w8'])
+        self.assertAlmostEquals(self.wallets['w5'].balance(), 5.0)
+
+        # more than half of the slots are empty once the rest go
+        for i in [1, 2, 4]:
+            self.app.remove_wallet('w{}'.format(i), transfer='mobile')
+
+        self.assertEquals(self.wallets._items._names, ['mobile', 'savings',
+            'shares', 'w5', 'w7', 'w8'])
+        self.assertAlmostEquals(self.wallets['mobile'].balance(), 125.0)
+        self.assertAlmostEquals(self.wallets['w8'].balance(), 8.0)
+        self.assertAlmostEquals(self.wallets.balance(), 2845.0)
+
+    def test_items_are_not_copied(self):
+        self.assertTrue(self.wallets['mobile'] is self.wallets['mobile'])
+
+    def test_add_many_repeated_position(self):
+        self.app.create_wallet('w', 0.0)
+        column = self.wallets._items
+        column.add_at([column.position('w')] * 3, [100, 200, 300])
+
+        self.assertAlmostEquals(self.wallets['w'].balance(), 6.0)
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 2806.0)
+
+    def test_column_grows(self):
+        for i in range(20):
+            self.app.create_wallet('w{}'.format(i), 1.0)
+
+        self.assertEquals(len(self.wallets), 23)
+        self.assertAlmostEquals(self.wallets['mobile'].balance(), 100.0)
+        self.assertAlmostEquals(self.wallets['w19'].balance(), 1.0)
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 2820.0)
+
+    def test_verify(self):
+        self.app.fund_wallets('salary')
+
+        self.assertAlmostEquals(self.wallets.balance(verify=True), 5800.0)
+        self.assertAlmostEquals(self.accounts.balance(verify=True), 5800.0)
+
+    def test_verify_detects_mismatch(self):
+        # a balance past the end of the names is not counted by a cell
+        self.app.create_wallet('mortgage', 0.0)
+        column = self.wallets._items
+        column._names.pop()
+        column._index.pop('mortgage')
+        column.cents[3] = 100
+
+        with self.assertRaises(Exception) as context:
+            self.wallets.balance(verify=True)
+
+        msg = 'Column balance {} does not match recount {}'.format(2801.0,
+                2800.0)
+        self.assertTrue(msg in context.exception)
+
+    @unittest.skipIf(wallets.np is None, 'numpy is not installed')
+    def test_numpy_column(self):
+        self.assertEquals(self.wallets._items.cents.dtype, wallets.np.int64)
+        self.assertTrue(isinstance(self.wallets['mobile'].cents(), int))
+
+    def test_create_wallet_persists(self):
+        self.app.create_wallet('mortgage', 10.0)
+
+        new_app = App('steve', conn=self.temp_path)
+        self.assertAlmostEquals(new_app.wallets['mortgage'].balance(), 10.0)
+        self.assertAlmostEquals(new_app.wallets['mobile'].balance(), 100.0)
+
+class FundingTemplatesIndexTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+
+        self.app = App('steve', conn=self.temp_path)
+        self.funding = self.app.funding_templates
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def create_wife_template(self):
+        self.app.create_funding_template('wife', 1000.0, 'cash', 'Monthly',
+                {'mobile': 100.0, 'savings': 900.0})
+
+    def test_loaded_indexes(self):
+        self.assertEquals(self.funding.templates_for_wallet('savings'),
+                ['salary'])
+        self.assertEquals(self.funding.templates_for_account('bank account'),
+                ['salary'])
+        self.assertEquals(self.funding.templates_for_wallet('mobile'), [])
+
+    def test_create_template_updates_indexes(self):
+        self.create_wife_template()
+
+        self.assertEquals(self.funding.templates_for_wallet('savings'),
+                ['salary', 'wife'])
+        self.assertEquals(self.funding.templates_for_wallet('mobile'),
+                ['wife'])
+        self.assertEquals(self.funding.templates_for_account('cash'),
+                ['wife'])
+
+    def test_update_template_updates_indexes(self):
+        self.app.update_funding_template('salary', 3000.0, 'cash', 'Monthly',
+                {'mobile': 3000.0})
+
+        self.assertEquals(self.funding.templates_for_wallet('mobile'),
+                ['salary'])
+        self.assertEquals(self.funding.templates_for_wallet('savings'), [])
+        self.assertEquals(self.funding.templates_for_account('bank account'),
+                [])
+
+    def test_remove_template_updates_indexes(self):
+        self.app.remove_funding_template('salary')
+
+        self.assertEquals(self.funding.templates_for_wallet('savings'), [])
+        self.assertEquals(self.funding.templates_for_account('bank account'),
+                [])
+
+    def test_remove_wallet_only_touches_templates_using_it(self):
+        self.create_wife_template()
+        self.app.remove_wallet('shares', transfer='mobile')
+
+        self.assertEquals(self.funding.templates_for_wallet('shares'), [])
+        self.assertEquals(self.funding.templates_for_wallet('mobile'),
+                ['salary', 'wife'])
+        self.assertAlmostEquals(self.funding['wife'].allocation()['mobile'],
+                100.0)
+        self.assertAlmostEquals(self.funding['salary'].allocation()['mobile'],
+                1750.0)
+
+    def test_remove_account_updates_indexes(self):
+        self.create_wife_template()
+        self.app.remove_account('bank account', transfer='cash')
+
+        self.assertEquals(self.funding.templates_for_account('cash'),
+                ['salary', 'wife'])
+        self.assertEquals(self.funding['salary'].account(), 'cash')
+
+    def test_rollback_restores_indexes(self):
+        with self.assertRaises(Exception):
+            with self.app.batch():
+                self.app.remove_wallet('shares', transfer='mobile')
+                self.app.fund_wallets('bonus')
+
+        self.assertEquals(self.funding.templates_for_wallet('shares'),
+                ['salary'])
+        self.assertEquals(self.funding.templates_for_wallet('mobile'), [])
+
+class FundingTemplatesLoaderTestCases(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = utils.create_test_data()
+        self.conn = os.path.join(self.temp_path, 'steve')
+
+    def tearDown(self):
+        utils.remove_test_data(self.temp_path)
+
+    def write(self, rows):
+        with open(os.path.join(self.conn, 'funding.csv'), 'wb') as f:
+            f.write('\n'.join(rows))
+
+    def test_load_stats(self):
+        funding = FundingTemplates(self.conn)
+
+        self.assertEquals(funding.load_stats['rows'], 2)
+        self.assertTrue(funding.load_stats['rows_per_second'] >= 0.0)
+
+    def test_empty_file(self):
+        self.write([])
+        funding = FundingTemplates(self.conn)
+
+        self.assertEquals(len(funding), 0)
+        self.assertEquals(funding.load_stats['rows'], 0)
+
+    def test_invalid_template(self):
+        self.write([
+            'salary,3000.0,Monthly,bank account,savings,1250.0',
+            'salary,3000.0,Monthly,bank account,shares,1000.0',
+            'wife,100.0,Monthly,bank account,shares,100.0'
+            ])
+
+        with self.assertRaises(Exception) as context:
+            FundingTemplates(self.conn)
+
+        self.assertTrue('Invalid template' in context.exception.message)
+
+    def test_template_rows_split_up(self):
+        self.write([
+            'salary,3000.0,Monthly,bank account,savings,1250.0',
+            'wife,100.0,Monthly,bank account,shares,100.0',
+            'salary,3000.0,Monthly,bank account,shares,1750.0'
+            ])
+        funding = FundingTemplates(self.conn)
+
+        self.assertEquals(list(funding), ['salary', 'wife'])
+        self.assertAlmostEquals(funding['salary'].allocation()['shares'],
+                1750.0)
+        self.assertEquals(funding.templates_for_wallet('shares'),
+                ['salary', 'wife'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,26 +2,52 @@
 wallet.py
 """
 
+def to_cents(amount):
+    """converts an amount to integer minor units"""
+    return int(round(float(amount) * 100))
+
 class Wallet(object):
+    # NOTE(steve): balances are kept as integer cents so that
+    # adding amounts is exact and a wallet only needs the space
+    # for its two slots.
+    __slots__ = ('_cents', '_owner')
+
     def __init__(self, open_balance):
         try:
-            self._balance = float(open_balance)
+            self._cents = to_cents(open_balance)
         except ValueError as e:
             raise e
 
+        # the collection holding the wallet. It is told about every
+        # change so that it can keep a running total of its balance.
+        self._owner = None
+
+    @classmethod
+    def from_cents(cls, cents):
+        wallet = cls(0)
+        wallet._cents = cents
+        return wallet
+
     def balance(self):
-        return self._balance
+        return self._cents / 100.0
+
+    def cents(self):
+        return self._cents
 
     def add(self, amount):
         try:
-            self._balance += float(amount)
+            cents = to_cents(amount)
         except ValueError as e:
             raise e
 
+        self._cents += cents
+        if self._owner is not None:
+            self._owner._adjust(cents)
+
 class FundingTemplate(object):
     def __init__(self, template, amount, account, frequency):
         try:
-            self._amount = float(amount)
+            self._amount = to_cents(amount)
         except ValueError as e:
             raise e
 
@@ -36,7 +62,7 @@ class FundingTemplate(object):
             raise Exception(msg)
 
         try:
-            self._allocation[wallet] = float(amount)
+            self._allocation[wallet] = to_cents(amount)
         except ValueError as e:
             raise e
 
@@ -46,18 +72,18 @@ class FundingTemplate(object):
             raise Exception(msg)
 
         if transfer not in self._allocation:
-            self._allocation[transfer] = float(0)
-
-        amount = self._allocation[wallet]
-        self._allocation[transfer] += float(amount)
+            self._allocation[transfer] = 0
 
-        del self._allocation[wallet]
+        self._allocation[transfer] += self._allocation.pop(wallet)
 
     def update_account(self, account):
         self._account = account
 
+    def name(self):
+        return self._template
+
     def amount(self):
-        return self._amount
+        return self._amount / 100.0
 
     def account(self):
         return self._account
@@ -66,10 +92,8 @@ class FundingTemplate(object):
         return self._frequency
 
     def allocation(self):
-        return self._allocation.copy()
+        return dict((k, v / 100.0) for (k, v) in self._allocation.iteritems())
 
     def valid(self):
         """Check if the funding template is valid"""
-        alloc_amount = sum([v for (k, v) in self._allocation.iteritems()])
-        return (abs(alloc_amount - self._amount) < 1e-10)
-
+        return sum(self._allocation.itervalues()) == self._amount
@@ -5,37 +5,109 @@ collections.py
 import os
 import shutil
 import csv
-
-from wallet import Wallet, FundingTemplate
+import copy
+import time
+from array import array
+from collections import OrderedDict
+from cStringIO import StringIO
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from wallet import Wallet, FundingTemplate, to_cents
+import packed
+import durable
+import locks
+
+def stamp(path):
+    """identifies the version of the file at path. A durable write
+    replaces the file so the inode changes with every save."""
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime, st.st_size)
 
 class Collection(object):
-    def __init__(self):
-        self._i = 0
-        self._n = 0
+    def __init__(self, autosave=True):
+        self._items = OrderedDict()
+        self.autosave = autosave
+        self._total = 0
+
+        # the format of the data file, 'csv' or 'packed'. Saving
+        # keeps the format the data was loaded in.
+        self.format = 'csv'
 
-        self._items = {}
+        # the version of the data file that was loaded, see save()
+        self._stamp = None
 
     def __iter__(self):
-        self._i = 0
-        self._n = len(self._items)
-        return self
-
-    def next(self):
-        if self._i < self._n:
-            i = self._i
-            self._i += 1
-            return self._items.keys()[i]
-        else:
-            raise StopIteration()
+        return iter(self._items)
 
-    def balance(self):
-        return sum([x.balance() for x in self._items.values()])
+    def __contains__(self, key):
+        return key in self._items
+
+    def items(self):
+        """a view of the (key, item) pairs in insertion order"""
+        return self._items.viewitems()
+
+    def values(self):
+        """a view of the items in insertion order"""
+        return self._items.viewvalues()
+
+    def balance(self, verify=False):
+        """the running total of the balances in the collection. It
+        is checked against a full recount when verify is set."""
+        if verify:
+            total = self.recount()
+            if total != self._total:
+                msg = 'Running balance {} does not match recount {}'.format(
+                        self._total / 100.0, total / 100.0)
+                raise Exception(msg)
+
+        return self._total / 100.0
+
+    def recount(self):
+        """the total balance in cents counted from every item"""
+        return sum([x.cents() for x in self.values()])
+
+    def _adjust(self, cents):
+        self._total += cents
+
+    def _attach(self, value):
+        value._owner = self
+        self._total += value.cents()
+
+    def _detach(self, value):
+        value._owner = None
+        self._total -= value.cents()
+
+    def _insert(self, key, value):
+        self._items[key] = value
+        self._attach(value)
+
+    def add_many(self, amounts):
+        """adds each amount in a dictionary of key -> amount"""
+        for (k, v) in amounts.iteritems():
+            self[k].add(v)
+
+    def snapshot(self):
+        """a copy of the balances that restore() can roll back to"""
+        return [(k, v.cents()) for (k, v) in self.items()]
+
+    def restore(self, snapshot):
+        for v in self.values():
+            self._detach(v)
+
+        self._items = type(self._items)()
+        self._total = 0
+        for (k, cents) in snapshot:
+            self._insert(k, Wallet.from_cents(cents))
 
     def __len__(self):
         return len(self._items)
 
     def __delitem__(self, key):
-        del self._items[key]
+        self._detach(self._items.pop(key))
 
     def __getitem__(self, key):
         if key not in self._items:
@@ -49,9 +121,17 @@ class Collection(object):
             msg = 'Item {} already exists'.format(key)
             raise Exception(msg)
 
-        self._items[key] = value
+        self._insert(key, value)
 
-        self.save()
+        if self.autosave:
+            self.save()
+
+    def _load(self):
+        """loads the data file under a shared lock on the user's
+        directory so that it is never read part way through a save"""
+        with locks.read(os.path.dirname(self._data)):
+            self._load_collection_data()
+            self._stamp = stamp(self._data)
 
     def _load_collection_data(self):
         """loads data into a dictionary object"""
@@ -59,33 +139,85 @@ class Collection(object):
         if not os.path.isfile(self._data):
             raise IOError('No such file: {}'.format(self._data))
 
+        if packed.magic(self._data) == packed.BALANCES:
+            self.format = 'packed'
+            with open(self._data, 'rb') as f:
+                for (k, cents) in packed.unpack_balances(f.read()):
+                    self._insert(k, Wallet.from_cents(cents))
+            return
+
         try:
             with open(self._data, 'rb') as f:
                 reader = csv.reader(f)
                 for row in reader:
-                    self._items[row[0]] = Wallet(float(row[1]))
+                    self._insert(row[0], Wallet(float(row[1])))
         except Exception as e:
             raise e
 
-    def save(self):
-        """saves collection data to a csv"""
+    def path(self):
+        return self._data
+
+    def save(self, path=None):
+        """saves collection data to a csv. The data is written
+        to path instead when it is given. The file is replaced
+        through the durable module so a crash part way through
+        never leaves it half written."""
         if not os.path.isfile(self._data):
             raise IOError('No such file: {}'.format(self._data))
 
+        if self.format == 'packed':
+            data = packed.pack_balances([(k, v.cents())
+                for (k, v) in self.items()])
+        else:
+            f = StringIO()
+            writer = csv.writer(f)
+            for (k, v) in self.items():
+                writer.writerow([k, v.balance()])
+            data = f.getvalue()
+
+        self._write(path, data)
+
+    def _write(self, path, data):
+        """writes data under an exclusive lock on the user's directory.
+        Saving over a data file that another app has saved since it
+        was loaded raises rather than losing the other app's changes."""
+        with locks.write(os.path.dirname(self._data)):
+            if path is None:
+                self.check()
+
+            durable.write(path or self._data, data)
+            if path is None:
+                self.refresh()
+
+    def check(self):
+        """raises if the data file has been replaced since it was loaded"""
+        if self._stamp is not None and stamp(self._data) != self._stamp:
+            msg = '{} has changed since it was loaded'.format(self._data)
+            raise Exception(msg)
+
+    def unchanged(self):
+        """whether the data file is still the version that was loaded
+        or last saved through this collection"""
         try:
-            with open(self._data, 'wb') as f:
-                writer = csv.writer(f)
-                for (k, v) in self._items.iteritems():
-                    writer.writerow([k, v.balance()])
-        except Exception as e:
-            raise e
+            return self._stamp is not None and stamp(self._data) == self._stamp
+        except OSError:
+            return False
+
+    def refresh(self):
+        """records the data file on disk as the loaded version"""
+        # NOTE(steve): a committer that does not wait returns before
+        # the file is replaced so its version is not known. Checking
+        # is skipped for these collections.
+        self._stamp = None
+        if durable.committer.wait:
+            self._stamp = stamp(self._data)
 
 class Accounts(Collection):
-    def __init__(self, conn):
-        super(Accounts, self).__init__()
+    def __init__(self, conn, autosave=True):
+        super(Accounts, self).__init__(autosave)
 
         self._data = os.path.join(conn, 'accounts.csv')
-        self._load_collection_data()
+        self._load()
 
     def __getitem__(self, key):
         if key not in self._items:
@@ -95,11 +227,11 @@ class Accounts(Collection):
         return self._items[key]
 
 class Wallets(Collection):
-    def __init__(self, conn):
-        super(Wallets, self).__init__()
+    def __init__(self, conn, autosave=True):
+        super(Wallets, self).__init__(autosave)
 
         self._data = os.path.join(conn, 'wallets.csv')
-        self._load_collection_data()
+        self._load()
 
     def __getitem__(self, key):
         if key not in self._items:
@@ -109,11 +241,15 @@ class Wallets(Collection):
         return self._items[key]
 
 class FundingTemplates(Collection):
-    def __init__(self, conn):
-        super(FundingTemplates, self).__init__()
+    def __init__(self, conn, autosave=True):
+        super(FundingTemplates, self).__init__(autosave)
+
+        # wallet/account -> names of the templates that use it
+        self._by_wallet = {}
+        self._by_account = {}
 
         self._data = os.path.join(conn, 'funding.csv')
-        self._load_collection_data()
+        self._load()
 
     def __getitem__(self, key):
         if key not in self._items:
@@ -127,44 +263,357 @@ class FundingTemplates(Collection):
             msg = 'Funding templates does not contain {}'.format(key)
             raise Exception(msg)
 
+        self._detach(self._items[key])
         self._items[key] = value
+        self._attach(value)
+
+    def templates_for_wallet(self, wallet):
+        """the names of the templates that allocate to the wallet"""
+        return sorted(self._by_wallet.get(wallet, []))
+
+    def templates_for_account(self, account):
+        """the names of the templates that fund from the account"""
+        return sorted(self._by_account.get(account, []))
+
+    def replace_wallet(self, wallet, transfer):
+        """moves the allocation of the wallet to the transfer wallet
+        in every template that uses it"""
+        for name in self.templates_for_wallet(wallet):
+            template = self._items[name]
+            self._detach(template)
+            template.remove_wallet_from_allocation(wallet, transfer=transfer)
+            self._attach(template)
+
+    def replace_account(self, account, transfer):
+        """funds every template that uses the account from the
+        transfer account instead"""
+        for name in self.templates_for_account(account):
+            template = self._items[name]
+            self._detach(template)
+            template.update_account(transfer)
+            self._attach(template)
+
+    def snapshot(self):
+        return [(k, copy.deepcopy(v)) for (k, v) in self.items()]
+
+    def restore(self, snapshot):
+        self._items = OrderedDict(snapshot)
+        self._by_wallet = {}
+        self._by_account = {}
+        for v in self.values():
+            self._attach(v)
+
+    # NOTE(steve): rather than a running total funding templates
+    # keep indexes of the wallets and accounts they use.
+    def _attach(self, value):
+        name = value.name()
+        self._by_account.setdefault(value.account(), set()).add(name)
+        for wallet in value.allocation():
+            self._by_wallet.setdefault(wallet, set()).add(name)
+
+    def _detach(self, value):
+        name = value.name()
+        self._unindex(self._by_account, value.account(), name)
+        for wallet in value.allocation():
+            self._unindex(self._by_wallet, wallet, name)
+
+    @staticmethod
+    def _unindex(index, key, name):
+        names = index.get(key)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del index[key]
 
     def _load_collection_data(self):
         if not os.path.isfile(self._data):
             raise IOError('No such file: {}'.format(self._data))
 
-        try:
-            with open(self._data, 'rb') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    template = row[0]
-                    if template not in self._items:
-                        amount = row[1]
-                        frequency = row[2]
-                        account = row[3]
-                        self._items[template] = FundingTemplate(template,
-                                amount, account, frequency)
-
-                    self._items[template].add_wallet_to_allocation(row[4],
-                            float(row[5]))
-        except Exception as e:
-            raise e
-
-        for (k, v) in self._items.iteritems():
-            if not v.valid():
-                raise Exception("Invalid template: {}".format(v))
-
-    def save(self):
+        start = time.time()
+        if packed.magic(self._data) == packed.TEMPLATES:
+            rows = self._load_packed_data()
+        else:
+            rows = self._load_csv_data()
+
+        for v in self.values():
+            self._attach(v)
+
+        # NOTE(steve): kept so that loading can be sized for
+        # users with very large funding files.
+        seconds = time.time() - start
+        self.load_stats = {
+                'rows': rows,
+                'seconds': seconds,
+                'rows_per_second': rows / seconds if seconds else 0.0
+                }
+
+    def _load_packed_data(self):
+        self.format = 'packed'
+        with open(self._data, 'rb') as f:
+            rows = packed.unpack_templates(f.read())
+
+        n = 0
+        for (name, amount, frequency, account, allocation) in rows:
+            template = FundingTemplate(name, amount / 100.0, account,
+                    frequency)
+            for (wallet, cents) in allocation:
+                template.add_wallet_to_allocation(wallet, cents / 100.0)
+                n += 1
+
+            if not template.valid():
+                raise Exception("Invalid template: {}".format(template))
+
+            self._items[name] = template
+
+        return n
+
+    def _load_csv_data(self):
+        """streams the rows of the funding file. The rows of a template
+        are written together so each template is checked as soon as
+        its last row has been read. Templates whose rows are split up
+        are checked again at the end."""
+        n = 0
+        current = None
+        pending = set()
+        with open(self._data, 'rb') as f:
+            for row in csv.reader(f):
+                n += 1
+                template = row[0]
+                if template != current:
+                    if (current is not None and
+                            not self._items[current].valid()):
+                        pending.add(current)
+                    if template in self._items:
+                        pending.add(template)
+                    current = template
+
+                if template not in self._items:
+                    amount = row[1]
+                    frequency = row[2]
+                    account = row[3]
+                    self._items[template] = FundingTemplate(template,
+                            amount, account, frequency)
+
+                self._items[template].add_wallet_to_allocation(row[4],
+                        float(row[5]))
+
+        if current is not None:
+            pending.add(current)
+        for template in pending:
+            if not self._items[template].valid():
+                msg = "Invalid template: {}".format(self._items[template])
+                raise Exception(msg)
+
+        return n
+
+    def save(self, path=None):
         if not os.path.isfile(self._data):
             raise IOError('No such file: {}'.format(self._data))
 
+        if self.format == 'packed':
+            rows = []
+            for (name, template) in self.items():
+                allocation = [(k, to_cents(v))
+                        for (k, v) in template.allocation().iteritems()]
+                rows.append((name, to_cents(template.amount()),
+                    template.frequency(), template.account(), allocation))
+
+            self._write(path, packed.pack_templates(rows))
+            return
+
+        f = StringIO()
+        writer = csv.writer(f)
+        for (name, template) in self.items():
+            for (wallet, amount) in template.allocation().iteritems():
+                writer.writerow([name, template.amount(),
+                    template.frequency(), template.account(),
+                    wallet, amount])
+
+        self._write(path, f.getvalue())
+
+def zeros(n):
+    """a column of n empty balances. The balances are kept in a numpy
+    int64 array when numpy is installed and in an array of longs
+    otherwise."""
+    if np is None:
+        return array('l', [0]) * n
+    return np.zeros(n, dtype=np.int64)
+
+class Column(object):
+    """An ordered mapping of names to balances. The names are kept
+    in an index and the balances in a contiguous array of cents, one
+    array slot per balance rather than a Wallet object each.
+
+    Removing a balance leaves an empty slot behind so the slots after
+    it keep their positions. The slots are packed once half of them
+    are empty."""
+    def __init__(self):
+        self._index = {}
+        self._names = []
+        self._cells = {}
+        self._removed = 0
+        self.cents = zeros(0)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return (k for k in self._names if k is not None)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __getitem__(self, key):
+        if key not in self._index:
+            raise KeyError(key)
+
+        cell = self._cells.get(key)
+        if cell is None:
+            cell = self._cells[key] = Cell(self, key)
+
+        return cell
+
+    def __setitem__(self, key, value):
+        if key in self._index:
+            self.cents[self._index[key]] = value.cents()
+        else:
+            self._append(key, value.cents())
+
+    def _append(self, key, cents):
+        n = len(self._names)
+        if np is None:
+            self.cents.append(cents)
+        else:
+            # NOTE(steve): a numpy array can't be appended to in place
+            # so it is grown by doubling, the spare slots are zero.
+            if n == len(self.cents):
+                grown = zeros(max(8, 2 * n))
+                grown[:n] = self.cents
+                self.cents = grown
+            self.cents[n] = cents
+
+        self._index[key] = n
+        self._names.append(key)
+
+    def pop(self, key):
+        """removes a balance and returns it as a detached wallet"""
+        i = self._index.pop(key)
+        self._cells.pop(key, None)
+        cents = int(self.cents[i])
+        self._names[i] = None
+        self.cents[i] = 0
+
+        self._removed += 1
+        if self._removed * 2 > len(self._names):
+            self._pack()
+
+        return Wallet.from_cents(cents)
+
+    def _pack(self):
+        """drops the empty slots"""
+        names = [k for k in self._names if k is not None]
+        positions = [self._index[k] for k in names]
+        if np is None:
+            self.cents = array('l', (self.cents[i] for i in positions))
+        else:
+            self.cents = self.cents[np.array(positions, dtype=np.intp)]
+        self._names = names
+        self._index = dict((k, i) for (i, k) in enumerate(names))
+        self._removed = 0
+
+    def position(self, key):
+        return self._index[key]
+
+    def total(self):
+        """the sum of the balances in cents"""
+        if np is None:
+            return sum(self.cents)
+        return int(self.cents.sum())
+
+    def add_at(self, positions, cents):
+        """adds the cents to the balances at the positions. A position
+        may be given more than once."""
+        if np is None:
+            for (i, c) in zip(positions, cents):
+                self.cents[i] += c
+        else:
+            np.add.at(self.cents, np.array(positions, dtype=np.intp),
+                    np.array(cents, dtype=np.int64))
+
+    def viewitems(self):
+        return ((k, self[k]) for k in self)
+
+    def viewvalues(self):
+        return (self[k] for k in self)
+
+class Cell(object):
+    """A wallet like view of a single balance in a column"""
+    __slots__ = ('_column', '_key', '_owner')
+
+    def __init__(self, column, key):
+        self._column = column
+        self._key = key
+        self._owner = None
+
+    def balance(self):
+        return self.cents() / 100.0
+
+    def cents(self):
+        return int(self._column.cents[self._column.position(self._key)])
+
+    def add(self, amount):
         try:
-            with open(self._data, 'wb') as f:
-                writer = csv.writer(f)
-                for (name, template) in self._items.iteritems():
-                    for (wallet, amount) in template.allocation().iteritems():
-                        writer.writerow([name, template.amount(),
-                            template.frequency(), template.account(),
-                            wallet, amount])
-        except Exception as e:
+            cents = to_cents(amount)
+        except ValueError as e:
             raise e
+
+        self._column.cents[self._column.position(self._key)] += cents
+
+class ColumnarCollection(Collection):
+    """A collection that stores its balances in a Column to save the
+    memory of a Wallet per balance. No running total is kept, the
+    total is summed over the column when it is asked for."""
+    def __init__(self, autosave=True):
+        super(ColumnarCollection, self).__init__(autosave)
+        self._items = Column()
+
+    def balance(self, verify=False):
+        """the total of the balances in the column. It is checked
+        against a count of every balance when verify is set."""
+        total = self._items.total()
+        if verify:
+            count = super(ColumnarCollection, self).recount()
+            if total != count:
+                msg = 'Column balance {} does not match recount {}'.format(
+                        total / 100.0, count / 100.0)
+                raise Exception(msg)
+
+        return total / 100.0
+
+    def recount(self):
+        return self._items.total()
+
+    def add_many(self, amounts):
+        positions = []
+        cents = []
+        for (k, v) in amounts.iteritems():
+            if k not in self._items:
+                msg = 'collection does not contain key {}.'.format(k)
+                raise Exception(msg)
+
+            positions.append(self._items.position(k))
+            cents.append(to_cents(v))
+
+        self._items.add_at(positions, cents)
+
+    def _attach(self, value):
+        pass
+
+    def _detach(self, value):
+        pass
+
+class ColumnarAccounts(Accounts, ColumnarCollection):
+    pass
+
+class ColumnarWallets(Wallets, ColumnarCollection):
+    pass